@@ -7,18 +7,18 @@ from .tools import *
 __all__ = [
     # /beatmap
     'Settings', 'GeneralSettings', 'EditorSettings', 'MetadataSettings', 'DifficultySettings', 'ColorSettings',
-    'HitSample', 'TimingPoint',
-    'HitObject', 'Circle', 'Slider', 'SliderAdditionalPoint', 'Spinner', 'Hold',
-    'Beatmap',
+    'HitSample', 'TimingPoint', 'TimingIndex',
+    'HitObject', 'Circle', 'Slider', 'SliderAdditionalPoint', 'Spinner', 'Hold', 'HitObjectStore',
+    'Beatmap', 'BeatmapInfo', 'BeatmapCache', 'BeatmapCorpus',
 
     # /replay
-    'Replay', 'ReplayFrame',
+    'Replay', 'ReplayFrame', 'ReplayFrames', 'HitJudgement', 'ReplayJudgement',
 
     # /storyboard
     'Event', 'Image', 'Video', 'Break', 'BackgroundColor', 'Sprite', 'Sample', 'Animation',
     'BaseCommand', 'Loop', 'Trigger',
     'SpriteCommand', 'Fade', 'Move', 'MoveX', 'MoveY', 'Scale', 'VectorScale', 'Rotate', 'Color', 'Parameter',
-    'StoryBoard',
+    'StoryBoard', 'Timeline', 'SpriteTimeline', 'SpriteState', 'OptimisationReport',
 
     # /tools
     'ar_to_ms', 'ms_to_ar',
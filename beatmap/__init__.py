@@ -1,8 +1,10 @@
 from .classes import *
+from .cache import BeatmapCache
+from .corpus import BeatmapCorpus
 
 __all__ = [
     'Settings', 'GeneralSettings', 'EditorSettings', 'MetadataSettings', 'DifficultySettings', 'ColorSettings',
-    'HitSample', 'TimingPoint',
-    'HitObject', 'Circle', 'Slider', 'SliderAdditionalPoint', 'Spinner', 'Hold',
-    'Beatmap',
+    'HitSample', 'TimingPoint', 'TimingIndex',
+    'HitObject', 'Circle', 'Slider', 'SliderAdditionalPoint', 'Spinner', 'Hold', 'HitObjectStore',
+    'Beatmap', 'BeatmapInfo', 'BeatmapCache', 'BeatmapCorpus',
 ]
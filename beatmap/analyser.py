@@ -1,8 +1,13 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from heapq import merge
 from itertools import accumulate, chain
 from math import dist, floor, sin, cos, atan2
-from .classes import Beatmap, Slider, SliderTick, Spinner, Hold
+from typing import Iterator, Sequence, Tuple
+from .classes import Beatmap, HitObject, HitObjectStore, Slider, SliderPath, SliderTick, Spinner, Hold
 from ..tools.conversions import ar_to_ms, cs_to_radius
-from ..helpers import Vector, find_circle_center, angles_are_rotating_clockwise, bezier
+from ..helpers import Vector, find_circle_center, angles_are_rotating_clockwise, bezier, flatten_bezier
 
 
 def analyse_linear_slider(slider: Slider):
@@ -11,10 +16,10 @@ def analyse_linear_slider(slider: Slider):
 
     point_distances = [0] + [dist(p1, p2) for p1, p2 in zip(curve_points, curve_points[1:])]
 
-    slider.path = {
-        round(tot_dist / slider_velocity): pos
-        for pos, tot_dist in zip(curve_points, accumulate(point_distances))
-    }
+    slider.path = SliderPath(
+        (round(tot_dist / slider_velocity) for tot_dist in accumulate(point_distances)),
+        curve_points
+    )
 
 
 def analyse_perfect_slider(slider: Slider, loop_ms: int):
@@ -34,14 +39,15 @@ def analyse_perfect_slider(slider: Slider, loop_ms: int):
         slider.length / radius  # Anti-clockwise rotation
     )
 
-    slider.path = {
-        t: Vector(sin(ball_angle), cos(ball_angle)) * radius + center
-        for t in chain(range(0, floor(slider.slideDuration), loop_ms), [slider.slideDuration])
+    times = list(chain(range(0, floor(slider.slideDuration), loop_ms), [slider.slideDuration]))
+    slider.path = SliderPath(times, [
+        Vector(sin(ball_angle), cos(ball_angle)) * radius + center
+        for t in times
         for ball_angle in [ curve_points_angle[0] + rotation_angle*(t / slider.slideDuration) ]
-    }
+    ])
 
 
-def analyse_bezier_slider(slider: Slider, bezier_precision: int):
+def analyse_bezier_slider(slider: Slider, bezier_precision: int = 50, bezier_tolerance: float = 0.25):
     curve_points = Vector(slider.x, slider.y), *slider.curvePoints
     slider_velocity = slider.length / slider.slideDuration  # Velocity in px/ms
 
@@ -61,21 +67,21 @@ def analyse_bezier_slider(slider: Slider, bezier_precision: int):
 
     curves_path = [
         curve if len(curve) == 2
-        else [bezier(i/bezier_precision, *curve) for i in range(bezier_precision + 1)]
+        else flatten_bezier(curve, bezier_tolerance) if bezier_precision is None  # Adaptive precision
+        else [bezier(i/bezier_precision, *curve) for i in range(bezier_precision + 1)]  # Fixed precision
         for curve in separated_curves
     ]
     whole_curve_path = list(chain.from_iterable(curves_path))  # Flatten curves_path
     distances = [0] + [dist(p1, p2) for p1, p2, in zip(whole_curve_path, whole_curve_path[1:])]
-    slider.path = {
-        (t_dist / slider_velocity): pos for t_dist, pos in zip(accumulate(distances), whole_curve_path)
-    }
+    slider.path = SliderPath((t_dist / slider_velocity for t_dist in accumulate(distances)), whole_curve_path)
 
 
 def analyse_catmull_slider(slider: Slider):  # Catmull sliders are deprecated in osu! and are barely used anyway
     raise ValueError(f"catmull sliders not yet supported")
 
 
-def analyse_slider(beatmap: Beatmap, slider: Slider, loop_ms: int, bezier_precision: int):
+def analyse_slider(beatmap: Beatmap, slider: Slider, loop_ms: int, bezier_precision: int = 50,
+                   bezier_tolerance: float = 0.25):
     """Writes more info in the additionalData attribute of slider"""
 
     slide_duration = slider.length / beatmap.slider_velocity(slider.time)
@@ -89,7 +95,7 @@ def analyse_slider(beatmap: Beatmap, slider: Slider, loop_ms: int, bezier_precis
     # Compute slider's path
     if slider.curveType == "L": analyse_linear_slider(slider)
     elif slider.curveType == "P": analyse_perfect_slider(slider, loop_ms)
-    elif slider.curveType == "B": analyse_bezier_slider(slider, bezier_precision)
+    elif slider.curveType == "B": analyse_bezier_slider(slider, bezier_precision, bezier_tolerance)
     elif slider.curveType == "C": analyse_catmull_slider(slider)
     else:
         raise ValueError(f"Unknown curve type '{slider.curveType}'")
@@ -102,19 +108,299 @@ def analyse_slider(beatmap: Beatmap, slider: Slider, loop_ms: int, bezier_precis
     # Get the position of the slider ticks
     # Slider ticks happen SliderTickRate times per beat
     time_between_ticks = beatmap.beat_length(slider.time) / beatmap.Difficulty.SliderTickRate
+    tick_times = [i*time_between_ticks for i in range(1, floor(slider.slideDuration / time_between_ticks))]
     slider.ticksPos = [
-        SliderTick(time=i*time_between_ticks, pos=slider.ball_pos(slider.time + i*time_between_ticks))
-        for i in range(1, floor(slider.slideDuration / time_between_ticks))
+        SliderTick(time=time, pos=pos)
+        for time, pos in zip(tick_times, slider.ball_pos_many(slider.time + time for time in tick_times))
     ]
 
 
 
-def analyse_beatmap(beatmap: Beatmap, loop_ms: int = 10, bezier_precision: int = 50):
+STACK_DISTANCE = 2.9  # Objects closer than this (in osu!pixels) are stacked together
+
+
+class StackGrid:
+    """
+    Spatial hash of the positions of some hit objects, with cells of STACK_DISTANCE px
+    Each cell holds the increasing list of the indices of its objects, so the lookups can be restricted to a range of
+    indices (the stack leniency window) with bisect
+    """
+    def __init__(self, positions: dict[int, Tuple[float, float]]):
+        self.positions = positions
+        self.cells = defaultdict(list)
+        for index, (x, y) in sorted(positions.items()):
+            self.cells[(floor(x / STACK_DISTANCE), floor(y / STACK_DISTANCE))].append(index)
+        self.neighbours = {}  # Cache of neighbour_cells
+
+    def neighbour_cells(self, x: float, y: float) -> list[list[int]]:
+        """ The non-empty cells that can hold a position near (x, y) """
+        key = (floor(x / STACK_DISTANCE), floor(y / STACK_DISTANCE))
+        if (cells := self.neighbours.get(key)) is None:
+            self.neighbours[key] = cells = [
+                cell for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                if (cell := self.cells.get( (key[0] + dx, key[1] + dy) )) is not None
+            ]
+        return cells
+
+    def last_near(self, x: float, y: float, lo: int, hi: int) -> int:
+        """ The greatest index in [lo, hi) whose position is near (x, y), or -1 """
+        found = -1
+        for cell in self.neighbour_cells(x, y):
+            k = bisect_left(cell, hi) - 1
+            while k >= 0 and cell[k] >= lo:
+                if dist((x, y), self.positions[cell[k]]) < STACK_DISTANCE:
+                    found = cell[k]
+                    lo = found + 1  # The other cells can only do better with greater indices
+                    break
+                k -= 1
+        return found
+
+    def all_near(self, x: float, y: float, lo: int) -> Iterator[int]:
+        """ The indices greater or equal to lo whose position is near (x, y), in increasing order """
+        return (
+            index for index in merge(*(cell[bisect_left(cell, lo):] for cell in self.neighbour_cells(x, y)))
+            if dist(self.positions[index], (x, y)) < STACK_DISTANCE
+        )
+
+
+def find_stacks(hit_objects: list[HitObject], stack_leniency_time: float):
+    """ Sets the stack attribute of the hit objects (except spinners and holds). See find_column_stacks """
+    is_slider = [isinstance(obj, Slider) for obj in hit_objects]
+    stacks = [obj.stack for obj in hit_objects]
+    find_column_stacks(
+        x=[obj.x for obj in hit_objects],
+        y=[obj.y for obj in hit_objects],
+        times=[obj.time for obj in hit_objects],
+        end_times=[obj.end.time if is_slider[i] else obj.time for i, obj in enumerate(hit_objects)],
+        slider_ends={i: (obj.end.x, obj.end.y) for i, obj in enumerate(hit_objects) if is_slider[i]},
+        is_stackable=[not isinstance(obj, (Spinner, Hold)) for obj in hit_objects],
+        stacks=stacks,
+        stack_leniency_time=stack_leniency_time
+    )
+    for obj, stack in zip(hit_objects, stacks):
+        obj.stack = stack
+
+
+def find_column_stacks(x: Sequence[float], y: Sequence[float], times: Sequence[float], end_times: Sequence[float],
+                       slider_ends: dict[int, Tuple[float, float]], is_stackable: list[bool], stacks: list[int],
+                       stack_leniency_time: float):
+    """
+    Computes the stacks of hit objects given by their columns, so that they don't need to be built
+    :param x: The x position of the objects
+    :param y: The y position of the objects
+    :param times: The time of the objects
+    :param end_times: The end time of the sliders (any value for the other objects)
+    :param slider_ends: The index of each slider: the position of its end
+    :param is_stackable: False for spinners and holds
+    :param stacks: The stack of the objects, None where it is not computed yet. This list is filled in place
+    :param stack_leniency_time: The stack leniency of the beatmap, in ms
+    The objects are looked up in StackGrids instead of being compared one by one, and the time windows are found with
+    bisect when the objects are sorted by time, so dense maps do not make the scan quadratic
+    """
+    # The stacking rules are complex and obscure, so I won't be explaining them. Good luck find them out :)
+    # In case you really want to know, look into "osu!stacks.py" (I don't know if that will help, but you can try)
+    count = len(times)
+    times_are_sorted = all(t1 <= t2 for t1, t2 in zip(times, times[1:]))
+    heads = StackGrid({i: (x[i], y[i]) for i in range(count) if is_stackable[i]})
+    ends = StackGrid(slider_ends)
+
+    def window_start(time: float, hi: int) -> int:
+        """ The first index the backward scan can reach before being too far in time (the scan starts at hi - 1) """
+        j = hi
+        if times_are_sorted:  # Objects from j are too close in time to stop the scan, whatever their type is
+            j = min(hi, bisect_left(times, time - stack_leniency_time + 1e-3))
+        for j in reversed(range(j)):
+            if not is_stackable[j]: continue
+            if (end_times[j] if j in slider_ends else times[j]) + stack_leniency_time < time:  # Too far in time
+                return j + 1
+        return 0
+
+    def window_end(time: float, lo: int) -> int:
+        """ The index where the forward scan (starting at lo) stops because it is too far in time """
+        limit = time + stack_leniency_time
+        k = bisect_right(times, limit, lo=lo) if times_are_sorted else lo
+        for k in range(k, count):
+            if is_stackable[k] and limit < times[k]:
+                return k
+        return count
+
+    for i in reversed(range(count)):  # We iterate through the hit objects in reversed order
+        if not is_stackable[i] or stacks[i] is not None:
+            # Spinners and holds are not part of stacks
+            # If stack is not None, that means the stack offset for this object has already been computed
+            continue
+        stacks[i] = 0  # This must be a stack base
+        current = i
+        slider_stack = i in slider_ends  # Stacks ignore sliders is the first object is itself a slider
+        total_stack = 0
+        hi = i
+        while True:  # We try to find the first object that might be stacked on top of current
+            current_pos = x[current], y[current]
+            lo = window_start(times[current], hi)
+            j = max(heads.last_near(*current_pos, lo, hi), ends.last_near(*current_pos, lo, hi))
+            if j == -1:
+                break
+            hi = j
+            if j in slider_ends:  # Sliders are special because they have an end that could be part of a stack
+                if dist(current_pos, slider_ends[j]) < STACK_DISTANCE:
+                    total_stack += 1
+                    current = j
+                    stacks[current] = total_stack
+                    if not slider_stack:
+                        # Tail stack: we want the slider to base the base, so we are shifting everything back
+                        stacks[current] = 0  # This slider is now the base of the stack
+                        end = window_end(end_times[j], j + 1)
+                        for k in heads.all_near(*slider_ends[j], j + 1):
+                            if k >= end: break
+                            if stacks[k] is None: stacks[k] = 0
+                            stacks[k] -= total_stack
+                            end = window_end(times[k], k + 1)
+                        total_stack = 0
+                        slider_stack = True
+                else:  # Its head is near the current object
+                    if slider_stack: break  # Sliders break the stack if their head is on it
+                    total_stack += 1
+                    current = j
+                    stacks[current] = total_stack
+            else:  # j is a Circle
+                total_stack += 1
+                current = j
+                stacks[current] = total_stack
+
+
+def apply_stack(obj: HitObject, stack_offset_unit: Vector):
+    """ Moves obj and its slider data according to its stack attribute """
+    if obj.stack is None: return
+    stack_offset = obj.stack * stack_offset_unit
+    obj.pos += stack_offset
+    if isinstance(obj, Slider):  # Sliders have more data to modify than regular Circles
+        obj.tail.pos += stack_offset
+        obj.end.pos += stack_offset
+        obj.path.shift(stack_offset)
+        for tick in obj.ticksPos:
+            tick.pos += stack_offset
+
+
+class StackGroup:
+    """
+    Hit objects that can only stack with one another, because they are separated from the other objects by more than
+    the stack leniency. They are analysed together, the first time one of their analysis attributes is read
+    """
+    def __init__(self, beatmap: Beatmap, hit_objects: list[HitObject], params: tuple):
+        self.beatmap = beatmap
+        self.hitObjects = hit_objects
+        self.params = params  # loop_ms, bezier_precision, bezier_tolerance, stack_leniency_time, stack_offset_unit
+        for obj in hit_objects:
+            for name in obj.LAZY_ATTRIBUTES:
+                del obj.__dict__[name]
+            obj._stackGroup = self
+
+    def resolve(self):
+        loop_ms, bezier_precision, bezier_tolerance, stack_leniency_time, stack_offset_unit = self.params
+        # The attributes are put back before anything is analysed, so that reading them does not resolve the group again
+        for obj in self.hitObjects:
+            obj.clear_analysis()
+            obj.pos = Vector(obj.x, obj.y)
+            del obj._stackGroup
+        for obj in self.hitObjects:
+            if obj.type == "slider":
+                analyse_slider(self.beatmap, obj, loop_ms, bezier_precision, bezier_tolerance)
+        if len(self.hitObjects) == 1:  # Most groups of sparse maps, find_stacks would make it a stack base
+            self.hitObjects[0].stack = 0
+        else:
+            find_stacks(self.hitObjects, stack_leniency_time)
+        for obj in self.hitObjects:
+            apply_stack(obj, stack_offset_unit)
+
+
+def split_stack_groups(beatmap: Beatmap, stack_leniency_time: float) -> Iterator[list[HitObject]]:
+    """
+    Splits the stackable hit objects of beatmap where the next object starts more than stack_leniency_time after the
+    end of all the previous ones: find_stacks never looks across such a gap
+    """
+    hit_objects = [obj for obj in beatmap.HitObjects if not isinstance(obj, (Spinner, Hold))]
+    if any(obj1.time > obj2.time for obj1, obj2 in zip(hit_objects, hit_objects[1:])):
+        yield hit_objects  # The windows of find_stacks are not contiguous when the objects are not sorted by time
+        return
+
+    group = []
+    last_end_time = None
+    for obj in hit_objects:
+        if group and last_end_time + stack_leniency_time < obj.time:
+            yield group
+            group = []
+        if obj.type == "slider":  # Same computation as analyse_slider
+            end_time = obj.time + obj.length / beatmap.slider_velocity(obj.time) * obj.slides
+        else:
+            end_time = obj.time
+        last_end_time = end_time if not group else max(last_end_time, end_time)
+        group.append(obj)
+    if group:
+        yield group
+
+
+def analyse_store(store: HitObjectStore, analysis: tuple, stack_leniency_time: float):
+    """
+    Analyses a HitObjectStore from its columns: the combos, stacks and slider end times are written into them. Only the
+    sliders are built, to find where they end, and they are not kept. The rows are then analysed when they are built
+    :param store: The HitObjectStore to analyse
+    :param analysis: beatmap, loop_ms, bezier_precision, bezier_tolerance and stack_offset_unit (see analyse_row)
+    :param stack_leniency_time: The stack leniency of the beatmap, in ms
+    """
+    beatmap, loop_ms, bezier_precision, bezier_tolerance, _ = analysis
+    store.compute_combos()
+    slider_ends = {}
+    for i, obj_type in enumerate(store.type):
+        if obj_type & 0b_0000_0010:
+            slider = store.build(i)
+            slider.pos = Vector(slider.x, slider.y)
+            analyse_slider(beatmap, slider, loop_ms, bezier_precision, bezier_tolerance)
+            store.endTime[i] = slider.end.time
+            slider_ends[i] = slider.end.x, slider.end.y
+
+    stacks = [None] * len(store)
+    find_column_stacks(store.x, store.y, store.time, store.endTime, slider_ends,
+                       [not obj_type & 0b_1000_1000 for obj_type in store.type], stacks, stack_leniency_time)
+    store.stack = array("i", (stack or 0 for stack in stacks))
+    store.analysis = analysis
+
+
+def analyse_row(store: HitObjectStore, index: int, obj: HitObject):
+    """ Gives obj, just built from a row of an analysed HitObjectStore, the attributes of an analysed HitObject """
+    beatmap, loop_ms, bezier_precision, bezier_tolerance, stack_offset_unit = store.analysis
+    obj.pos = Vector(obj.x, obj.y)
+    obj.comboIndex = store.comboIndex[index]
+    obj.comboNumber = store.comboNumber[index]
+    if obj.type == "slider":
+        analyse_slider(beatmap, obj, loop_ms, bezier_precision, bezier_tolerance)
+    if not isinstance(obj, (Spinner, Hold)):
+        obj.stack = store.stack[index]
+        apply_stack(obj, stack_offset_unit)
+
+
+def analyse_beatmap(beatmap: Beatmap, loop_ms: int = 10, bezier_precision: int = 50, bezier_tolerance: float = 0.25,
+                    lazy: bool = False):
+    """
+    :param beatmap: The beatmap to analyse
+    :param loop_ms: The time between two points of the path of perfect circle sliders
+    :param bezier_precision: The number of evenly spaced points each bezier curve is sampled at
+        If it is None, the curves are flattened adaptively instead, like the osu! client does
+    :param bezier_tolerance: The maximum distance (in osu!pixels) between an adaptively flattened path and its curve
+    :param lazy: If this is True, only the combos are computed now. The positions, stacks and slider data of each
+        StackGroup are computed the first time one of them is read
+        A HitObjectStore is always analysed from its columns (see analyse_store), as its rows are only analysed when
+        they are built
+    """
     # Values that are used later in the function
     stack_leniency_time = ar_to_ms(beatmap.Difficulty.ApproachRate) * beatmap.General.StackLeniency
     stack_leniency_offset = cs_to_radius(beatmap.Difficulty.CircleSize) / 10
     stack_offset_unit = Vector(-stack_leniency_offset, -stack_leniency_offset)
 
+    if isinstance(beatmap.HitObjects, HitObjectStore):
+        analysis = beatmap, loop_ms, bezier_precision, bezier_tolerance, stack_offset_unit
+        analyse_store(beatmap.HitObjects, analysis, stack_leniency_time)
+        return
+
     # Evaluate comboNumber and comboIndex
     combo_index = 0
     combo_number = 0
@@ -128,68 +414,18 @@ def analyse_beatmap(beatmap: Beatmap, loop_ms: int = 10, bezier_precision: int =
         obj.comboIndex = combo_index
         obj.comboNumber = combo_number
 
-        if obj.type == "slider":
-            analyse_slider(beatmap, obj, loop_ms, bezier_precision)
+        if obj.type == "slider" and not lazy:
+            analyse_slider(beatmap, obj, loop_ms, bezier_precision, bezier_tolerance)
+
+    if lazy:
+        params = loop_ms, bezier_precision, bezier_tolerance, stack_leniency_time, stack_offset_unit
+        for group in split_stack_groups(beatmap, stack_leniency_time):
+            StackGroup(beatmap, group, params)
+        return
 
     # Scan for stacks
-    # The stacking rules are complex and obscure, so I won't be explaining them. Good luck find them out :)
-    # In case you really want to know, look into "osu!stacks.py" (I don't know if that will help, but you can try)
-    for i in reversed(range(len(beatmap.HitObjects))):  # We iterate through the hit objects in reversed order
-        current = beatmap.HitObjects[i]
-        if isinstance(current, (Spinner, Hold)) or current.stack is not None:  # Those are not part of stacks
-            # Spinners and holds are not part of stacks
-            # If stack is not None, that means the stack offset for this object has already been computed
-            continue
-        current.stack = 0  # This must be a stack base
-        slider_stack = isinstance(current, Slider)  # Stacks ignore sliders is the first object is itself a slider
-        total_stack = 0
-        for j in reversed(range(i)):  # We try to find the first object that might be stacked on top of current
-            obj = beatmap.HitObjects[j]
-            if isinstance(obj, (Spinner, Hold)): continue
-            if isinstance(obj, Slider):  # Sliders are special because they have an end that could be part of a stack
-                if obj.end.time + stack_leniency_time < current.time:  # Too far in time; the stack stops here
-                    break
-                if dist((current.x, current.y), (obj.end.x, obj.end.y)) < 2.9:
-                    total_stack += 1
-                    current = obj
-                    current.stack = total_stack
-                    if not slider_stack:
-                        # Tail stack: we want the slider to base the base, so we are shifting everything back
-                        current2 = current.end
-                        current.stack = 0  # This slider is now the base of the stack
-                        for k in range(j+1, len(beatmap.HitObjects)):
-                            obj2 = beatmap.HitObjects[k]
-                            if isinstance(obj2, (Spinner, Hold)): continue
-                            if current2.time + stack_leniency_time < obj2.time:  # Too far in time; the stack stops here
-                                break
-                            if dist((current.end.x, current.end.y), (obj2.x, obj2.y)) < 2.9:
-                                current2 = obj2
-                                if current2.stack is None: current2.stack = 0
-                                current2.stack -= total_stack
-                        total_stack = 0
-                        slider_stack = True
-                elif dist((current.x, current.y), (obj.x, obj.y)) < 2.9:
-                    if slider_stack: break  # Sliders break the stack if their head is on it
-                    total_stack += 1
-                    current = obj
-                    current.stack = total_stack
-            else:  # obj is a Circle
-                if obj.time + stack_leniency_time < current.time:  # Too far in time; the stack stops here
-                    break
-                if dist((current.x, current.y), (obj.x, obj.y)) < 2.9:
-                    total_stack += 1
-                    current = obj
-                    current.stack = total_stack
+    find_stacks(beatmap.HitObjects, stack_leniency_time)
 
     # Apply stacks values
     for obj in beatmap.HitObjects:
-        if obj.stack is None: continue
-        stack_offset = obj.stack * stack_offset_unit
-        obj.pos += stack_offset
-        if isinstance(obj, Slider):  # Sliders have more data to modify than regular Circles
-            obj.tail.pos += stack_offset
-            obj.end.pos += stack_offset
-            for time in obj.path:
-                obj.path[time] += stack_offset
-            for tick in obj.ticksPos:
-                tick.pos += stack_offset
+        apply_stack(obj, stack_offset_unit)
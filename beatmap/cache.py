@@ -0,0 +1,127 @@
+import os
+import struct
+from hashlib import md5 as hashlib_md5
+from tempfile import mkstemp
+from typing import Optional
+from .classes import Beatmap
+from ..helpers import osu_fp, complete_path, read_file
+from ..helpers.binary import to_binary, read_binary_file
+
+
+CACHE_VERSION = 2  # Must be increased whenever the classes or the analysis change, so that older entries are ignored
+ENTRY_EXT = ".ospy"
+
+
+class BeatmapCache:
+    """
+    Folder of analysed beatmaps, addressed by the MD5 of their .osu file and the analysis parameters
+    The entries are in the binary format of helpers.binary, which only creates objects of the classes of this package
+    (unlike pickle, reading a tampered entry can't run code)
+    Several processes can use the same folder at once: entries are written to a temporary file that is then renamed,
+    and an entry that disappears or can't be read is simply treated as missing
+    When the folder grows over max_size bytes, the least recently used entries are deleted. The folder is only
+    scanned again when the size written since the last scan could have made it grow over max_size
+    On Windows, an entry opened by another process can't be replaced or deleted: such entries are skipped
+    """
+    def __init__(self, directory: str, max_size: int = 1 << 30):
+        """
+        :param directory: The folder of the cache. It is created if it does not exist
+        :param max_size: The maximum total size of the entries, in bytes
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None  # Total size of the entries at the last scan, plus the size written since then
+
+    def entry_path(self, md5: str, loop_ms: int, bezier_precision: int, bezier_tolerance: float) -> str:
+        name = f"{md5}_{loop_ms}_{bezier_precision}_{bezier_tolerance}_v{CACHE_VERSION}{ENTRY_EXT}"
+        return os.path.join(self.directory, name)
+
+    def get(self, md5: str, loop_ms: int = 10, bezier_precision: int = 50,
+            bezier_tolerance: float = 0.25) -> Optional[Beatmap]:
+        """ The cached beatmap, or None if it is not in the cache """
+        entry = self.entry_path(md5, loop_ms, bezier_precision, bezier_tolerance)
+        try:
+            beatmap = read_binary_file(entry, Beatmap)
+        except OSError:  # Missing, or locked by another process
+            return None
+        except (ValueError, TypeError, IndexError, struct.error):
+            self.remove(entry)  # Broken entry
+            return None
+        try:
+            os.utime(entry)  # The modification time is the last use time
+        except OSError:
+            pass
+        return beatmap
+
+    def put(self, md5: str, beatmap: Beatmap, loop_ms: int = 10, bezier_precision: int = 50,
+            bezier_tolerance: float = 0.25):
+        entry = self.entry_path(md5, loop_ms, bezier_precision, bezier_tolerance)
+        data = to_binary(beatmap)
+        fd, temp_path = mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            size = len(data)
+            os.replace(temp_path, entry)  # Atomic: other processes never see a partly written entry
+        except OSError:  # On Windows, the entry may be opened by another process: skip it
+            self.remove(temp_path)
+            return
+        except BaseException:
+            self.remove(temp_path)
+            raise
+        if self.size is not None:
+            self.size += size
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def load(self, path: str, loop_ms: int = 10, bezier_precision: int = 50,
+             bezier_tolerance: float = 0.25) -> Beatmap:
+        """ Reads and analyses the beatmap at path, unless the cache already holds the same file """
+        from .reader import read_beatmap_file
+        from .analyser import analyse_beatmap
+        path = complete_path(path, root=osu_fp.get(), folder="Songs\\", ext=".osu")
+        md5 = hashlib_md5(read_file(path)).hexdigest()  # The file then stays in memory for read_beatmap_file
+
+        beatmap = self.get(md5, loop_ms, bezier_precision, bezier_tolerance)
+        if beatmap is None:
+            beatmap = read_beatmap_file(path)
+            analyse_beatmap(beatmap, loop_ms, bezier_precision, bezier_tolerance)
+            self.put(md5, beatmap, loop_ms, bezier_precision, bezier_tolerance)
+        beatmap.Path = path  # The cached entry may come from a copy of the file
+        return beatmap
+
+    def evict(self):
+        """ Scans the folder, and deletes the least recently used entries until the cache fits in max_size """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(ENTRY_EXT):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # Deleted by another process
+                continue
+            entries.append( (stat.st_mtime, stat.st_size, entry.path) )
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if self.remove(entry):
+                total_size -= size
+        self.size = total_size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_EXT):
+                self.remove(entry.path)
+        self.size = None
+
+    @staticmethod
+    def remove(path: str) -> bool:
+        """ Whether the file was deleted: it may already be gone, or be locked by another process """
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
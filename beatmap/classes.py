@@ -3,11 +3,14 @@ To see what each property does, check the osu!wiki: https://osu.ppy.sh/wiki/sk/o
 """
 
 
+from array import array
+from bisect import bisect_left, bisect_right
 from hashlib import md5 as hashlib_md5
-from typing import Tuple, Union
+from itertools import accumulate
+from typing import Iterable, Iterator, Tuple, Union
 from dataclasses import dataclass
 from ..storyboard import Event, StoryBoard
-from ..helpers import Vector, segment_fraction, split_get, zigzag_function
+from ..helpers import Vector, VectorArray, SplitParser, read_file
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -15,6 +18,14 @@ from ..helpers import Vector, segment_fraction, split_get, zigzag_function
 # ----------------------------------------------------------------------------------------------------------------------
 
 
+HIT_SAMPLE_PARSER = SplitParser(":", [int, int, int, int, str], [0, 0, 0, 0, ""], min_len=5)
+HOLD_PARAMS_PARSER = SplitParser(":", [int, int, int, int, int, str], [0, 0, 0, 0, 0, ""], min_len=6)
+CURVE_PARSER = SplitParser("|", [[str]], max_len=None)  # Bezier curves can have more than 100 points
+CURVE_POINT_PARSER = SplitParser(":", [int, int])
+EDGE_SOUNDS_PARSER = SplitParser("|", [[int]])
+EDGE_SET_PARSER = SplitParser(":", [int, int])
+
+
 def get_hit_object_type_str(obj_type: int) -> str:
     if obj_type & 0b_0000_0001:
         return "circle"
@@ -41,6 +52,77 @@ class SliderTick:
     pos: Vector
 
 
+class SliderPath:
+    """
+    Path of an analysed slider: positions of the ball at some times (in ms since the start of the slide)
+    The times are stored in a contiguous array and the points in a VectorArray,
+    with a table of the cumulative arc length at each point
+    It behaves like a read-only {time: Vector} dictionary, sorted by time
+    """
+    def __init__(self, times: Iterable[float] = (), points: Iterable[Vector] = ()):
+        self.times = array("d")
+        self.points = VectorArray()
+        for time, point in zip(times, points):
+            if self.times and time == self.times[-1]:  # Like in a dictionary, the last position given for a time is kept
+                self.points[-1] = point
+                continue
+            self.times.append(time)
+            self.points.append(point)
+        self.lengths = self.points.cumulative_lengths()
+
+    def position(self, time: float) -> Vector:
+        """ The ball position at that time, interpolated between the two points that surround it """
+        times, x, y = self.times, self.points.x, self.points.y
+        i = bisect_left(times, time)
+        if i == len(times): i -= 1
+        fraction = (times[i] - time) / (times[i] - times[i-1])
+        return Vector(
+            (x[i-1] - x[i]) * fraction + x[i],
+            (y[i-1] - y[i]) * fraction + y[i]
+        )
+
+    def position_at_length(self, length: float) -> Vector:
+        """ The position of the point at that distance from the start of the path, following the path """
+        lengths, x, y = self.lengths, self.points.x, self.points.y
+        i = min(max(bisect_left(lengths, length), 1), len(lengths) - 1)
+        fraction = (length - lengths[i-1]) / (lengths[i] - lengths[i-1]) if lengths[i] != lengths[i-1] else 0
+        return Vector(
+            (x[i] - x[i-1]) * fraction + x[i-1],
+            (y[i] - y[i-1]) * fraction + y[i-1]
+        )
+
+    def shift(self, offset: Vector):
+        self.points.shift(offset)
+
+    def __getitem__(self, time: float) -> Vector:
+        i = bisect_left(self.times, time)
+        if i == len(self.times) or self.times[i] != time:
+            raise KeyError(time)
+        return self.points[i]
+
+    def __contains__(self, time: float) -> bool:
+        i = bisect_left(self.times, time)
+        return i != len(self.times) and self.times[i] == time
+
+    def __iter__(self) -> Iterator[float]:
+        return iter(self.times)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def keys(self) -> Iterator[float]:
+        return iter(self.times)
+
+    def values(self) -> Iterator[Vector]:
+        return iter(self.points)
+
+    def items(self) -> Iterator[Tuple[float, Vector]]:
+        return zip(self.times, self.values())
+
+    def __repr__(self) -> str:
+        return f"SliderPath(<{len(self)} points>)"
+
+
 @dataclass
 class SliderAdditionalPoint:
     x: int = None
@@ -272,9 +354,24 @@ class HitObject:
         # This is for beatmap analysis (see tools/beatmap_analyser.py)
         self.comboIndex = None
         self.comboNumber = None
+        self.clear_analysis()
+
+    # Attributes that are removed while the object waits for a lazy analysis (see analyser.StackGroup)
+    LAZY_ATTRIBUTES = frozenset({"pos", "stack"})
+
+    def clear_analysis(self):
+        """ Resets the attributes computed by the analysis (except the combo) """
         self.pos = None
         self.stack = None
 
+    def __getattr__(self, name: str):
+        # This is only called for missing attributes, such as the ones of an object that has not been analysed yet
+        group = self.__dict__.get("_stackGroup")
+        if group is None or name not in self.LAZY_ATTRIBUTES:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        group.resolve()
+        return getattr(self, name)
+
     @classmethod
     def from_params(cls, *args):
         obj_type = args[3]
@@ -306,7 +403,7 @@ class Circle(HitObject):
         if self.hitSample == "":
             self.hitSample = "0:0:0:0:"
         self.hitSample = HitSample(
-            *split_get(self.hitSample, ":", [int, int, int, int, str], [0, 0, 0, 0, ""], min_len=5)
+            *HIT_SAMPLE_PARSER(self.hitSample)
         )
 
     def osu_format(self) -> str:
@@ -324,22 +421,26 @@ class Slider(HitObject):
 
     def __post_init__(self):
         super().__post_init__()
-        self.curveType, *self.curvePoints = split_get(self.curve, "|", [[str]])
-        self.curvePoints = [ Vector( *split_get(point, ":", [int, int]) ) for point in self.curvePoints ]
+        self.curveType, *self.curvePoints = CURVE_PARSER(self.curve)
+        self.curvePoints = [ Vector( *CURVE_POINT_PARSER(point) ) for point in self.curvePoints ]
 
         self.edgeSounds = (
             [0]*self.slides if self.edgeSounds is None else
-            split_get(str(self.edgeSounds), "|", [[int]])
+            EDGE_SOUNDS_PARSER(str(self.edgeSounds))
         )
         self.edgeSets = (
             [(0, 0)]*self.slides if self.edgeSets is None else
-            [tuple(split_get(i, ":", [int, int])) for i in self.edgeSets.split("|")]
+            [tuple(EDGE_SET_PARSER(i)) for i in self.edgeSets.split("|")]
         )
 
         self.hitSample = HitSample(
-            *split_get(self.hitSample, ":", [int, int, int, int, str], [0, 0, 0, 0, ""], min_len=5)
+            *HIT_SAMPLE_PARSER(self.hitSample)
         )
 
+    LAZY_ATTRIBUTES = HitObject.LAZY_ATTRIBUTES | {"tail", "end", "slideDuration", "duration", "ticksPos", "path"}
+
+    def clear_analysis(self):
+        super().clear_analysis()
         # This is for slider analysis (see tools/slider_analyser.py)
         self.tail = SliderAdditionalPoint()
         self.end = SliderAdditionalPoint()
@@ -356,22 +457,23 @@ class Slider(HitObject):
             f"{edge_sounds},{edge_sets},{self.hitSample.osu_format()}"
         )
 
+    def slide_time(self, time: float) -> float:
+        """ The time since the start of the current slide, counted backwards on reverse slides """
+        slide_duration = self.slideDuration
+        if slide_duration <= 0:  # Zero length slider: the ball never leaves the head
+            return 0.0
+        return abs((time - self.time + slide_duration) % (slide_duration + slide_duration) - slide_duration)
+
     def ball_pos(self, time: float) -> Vector:
         if self.path is None:
             raise ValueError("path has not yet been calculated")
+        return self.path.position(self.slide_time(time))
 
-        slide_duration = self.slideDuration
-        relative_time = zigzag_function(slide_duration, start_x=self.time)(time)
-
-        timestamps = list(self.path.keys())
-        for i, timestamp in enumerate(timestamps):
-            if timestamp < relative_time and i != len(timestamps)-1: continue
-
-            return segment_fraction(
-                (timestamp - relative_time) / (timestamp - timestamps[i-1]),
-                self.path[timestamp],
-                self.path[timestamps[i-1]]
-            )
+    def ball_pos_many(self, times: Iterable[float]) -> list[Vector]:
+        if self.path is None:
+            raise ValueError("path has not yet been calculated")
+        position, slide_time = self.path.position, self.slide_time
+        return [position(slide_time(time)) for time in times]
 
 
 @dataclass
@@ -382,7 +484,7 @@ class Spinner(HitObject):
     def __post_init__(self):
         super().__post_init__()
         self.hitSample = HitSample(
-            *split_get(self.hitSample, ":", [int, int, int, int, str], [0, 0, 0, 0, ""], min_len=5)
+            *HIT_SAMPLE_PARSER(self.hitSample)
         )
 
     def osu_format(self) -> str:
@@ -395,13 +497,236 @@ class Hold(HitObject):
 
     def __post_init__(self):
         super().__post_init__()
-        self.endTime, *sample = split_get(self.params, ":", [int, int, int, int, int, str], [0, 0, 0, 0, 0, ""], min_len=6)
+        self.endTime, *sample = HOLD_PARAMS_PARSER(self.params)
         self.hitSample = HitSample(*sample)
 
     def osu_format(self) -> str:
         return f"{self.head()},{self.params}"
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+# HitObjectStore class. Columnar storage of the hit objects of a beatmap: one typed array per common property
+# Its properties use lowerCamelCase
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class HitObjectStore:
+    """
+    Behaves like a list of HitObject, but holds the common properties of the objects in typed arrays, and the other
+    ones in their .osu lines. No HitObject is kept: indexing or iterating builds a new one for each row, so changes to
+    it are only stored by assigning it back (store[i] = obj)
+    The columns can be used directly, without building any object:
+    - x, y, time, type (the raw bits) and hitSound, as in the .osu file
+    - endTime: the end of spinners, holds and sliders (time for circles). See compute_end_times for sliders
+    - comboIndex and comboNumber, computed like analyser.analyse_beatmap does
+    - stack: 0 until the beatmap is analysed. The analysis computes it from the columns (see analyser.analyse_store)
+    Once the store is analysed, the rows are analysed when they are built
+    """
+    COLUMNS = ("x", "y", "time", "type", "hitSound", "endTime", "comboIndex", "comboNumber", "stack")
+
+    def __init__(self):
+        self.x = array("d")
+        self.y = array("d")
+        self.time = array("d")
+        self.type = array("i")
+        self.hitSound = array("i")
+        self.endTime = array("d")
+        self.comboIndex = array("i")
+        self.comboNumber = array("i")
+        self.stack = array("i")
+        self.lines = []  # .osu line of each row
+        self.analysis = None  # (beatmap, loop_ms, bezier_precision, bezier_tolerance, stack_offset_unit) once analysed
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]):
+        store = cls()
+        for line in lines:
+            store.append_line(line)
+        return store
+
+    def make_writable(self):
+        """ Replaces the read-only columns of a memory-mapped store (see helpers.binary) by copies """
+        from ..helpers.binary import writable_array
+        for name in self.COLUMNS:
+            setattr(self, name, writable_array(getattr(self, name)))
+
+    @staticmethod
+    def read_line(line: str) -> Tuple[float, float, float, int, int, float]:
+        """ The x, y, time, type, hitSound and endTime of a .osu line (endTime is the time for sliders) """
+        fields = line.split(",", 6)
+        obj_type = int(fields[3])
+        if not obj_type & 0b_1000_1011:
+            raise ValueError(f"Unknown object of type {obj_type}")
+        time = float(fields[2])
+        if obj_type & 0b_0000_1000:  # Spinner
+            end_time = float(fields[5])
+        elif obj_type & 0b_1000_0000:  # Hold
+            end_time = float(fields[5].split(":", 1)[0])
+        else:  # The end of sliders needs the timing points
+            end_time = time
+        return float(fields[0]), float(fields[1]), time, obj_type, int(fields[4]), end_time
+
+    def append_line(self, line: str):
+        if type(self.x) is memoryview:
+            self.make_writable()
+        x, y, time, obj_type, hit_sound, end_time = self.read_line(line)
+
+        combo_index = self.comboIndex[-1] if self.comboIndex else 0
+        combo_number = self.comboNumber[-1] + 1 if self.comboNumber else 1
+        if obj_type & 0b100:  # New combo
+            combo_index += 1
+            combo_number = 1
+
+        self.x.append(x)
+        self.y.append(y)
+        self.time.append(time)
+        self.type.append(obj_type)
+        self.hitSound.append(hit_sound)
+        self.endTime.append(end_time)
+        self.comboIndex.append(combo_index)
+        self.comboNumber.append(combo_number)
+        self.stack.append(0)
+        self.lines.append(line)
+
+    def append(self, obj: HitObject):
+        self.append_line(obj.osu_format())
+        self.write_analysis(len(self) - 1, obj)
+
+    def compute_end_times(self, beatmap: "Beatmap"):
+        """ Sets the end time of the sliders, from the timing points of beatmap (same computation as the analysis) """
+        if type(self.x) is memoryview:
+            self.make_writable()
+        rows = [i for i, obj_type in enumerate(self.type) if obj_type & 0b_0000_0010]
+        velocities = beatmap.slider_velocities(self.time[i] for i in rows)
+        for i, velocity in zip(rows, velocities):
+            _, _, _, _, _, _, slides, length = self.lines[i].split(",", 8)[:8]
+            self.endTime[i] = self.time[i] + float(length) / velocity * int(slides)
+
+    def compute_combos(self):
+        """ Sets comboIndex and comboNumber from the new combo bits of the type column """
+        if type(self.x) is memoryview:
+            self.make_writable()
+        combo_index = combo_number = 0
+        for i, obj_type in enumerate(self.type):
+            combo_number += 1
+            if obj_type & 0b100:
+                combo_index += 1
+                combo_number = 1
+            self.comboIndex[i] = combo_index
+            self.comboNumber[i] = combo_number
+
+    def build(self, index: int) -> HitObject:
+        """ A new HitObject for a row, without any analysis """
+        from .reader import HIT_OBJECT_PARSER
+        return HitObject.from_params(*HIT_OBJECT_PARSER(self.lines[index]))
+
+    def row(self, index: int) -> HitObject:
+        """ A new HitObject for a row, analysed if the store is """
+        obj = self.build(index)
+        if self.analysis is not None:
+            from .analyser import analyse_row
+            analyse_row(self, index, obj)
+        return obj
+
+    def write_analysis(self, index: int, obj: HitObject):
+        """
+        Writes the analysis results of obj (stack, combo, slider end time) into the columns of a row
+        Attributes that a lazy analysis has not computed yet are skipped
+        """
+        attributes = obj.__dict__
+        if attributes.get("stack") is not None:
+            self.stack[index] = attributes["stack"]
+        if attributes.get("comboIndex") is not None:
+            self.comboIndex[index] = attributes["comboIndex"]
+            self.comboNumber[index] = attributes["comboNumber"]
+        if "end" in attributes and attributes["end"].time is not None:
+            self.endTime[index] = attributes["end"].time
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(len(self)))]
+        return self.row(index)
+
+    def __setitem__(self, index: int, obj: HitObject):
+        if type(self.x) is memoryview:
+            self.make_writable()
+        line = obj.osu_format()
+        self.x[index], self.y[index], self.time[index], self.type[index], self.hitSound[index], self.endTime[index] = \
+            self.read_line(line)
+        self.lines[index] = line
+        self.write_analysis(index, obj)
+
+    def __iter__(self) -> Iterator[HitObject]:
+        return map(self.row, range(len(self)))
+
+    def __repr__(self) -> str:
+        return f"HitObjectStore(<{len(self)} objects>)"
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# TimingIndex dataclass. Lookup table built from the timing points of a beatmap
+# Its properties use lowerCamelCase
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@dataclass
+class TimingIndex:
+    times: list[int]  # Running maximum of the timing point times, so the lookups can use bisect
+    beatLengths: list[float]  # Beat length of the last uninherited point, at each point
+    velocityBeatLengths: list[float]  # Same, but the first uninherited point is used before any is reached
+    velocityMultipliers: list[float]  # beatLength of the last inherited point (-100 after an uninherited one)
+    source: list[TimingPoint] = None  # The list the index was built from
+    sourceLength: int = 0
+
+    @classmethod
+    def from_timing_points(cls, points: list[TimingPoint]):
+        base_beat_length = next((point.beatLength for point in points if point.uninherited), 500)
+        beat_length = 500  # Default value
+        velocity_beat_length = base_beat_length
+        velocity_multiplier = -100  # Default value
+
+        beat_lengths, velocity_beat_lengths, velocity_multipliers = [], [], []
+        for point in points:
+            if point.uninherited:
+                beat_length = velocity_beat_length = point.beatLength
+                velocity_multiplier = -100
+            else:
+                velocity_multiplier = point.beatLength
+            beat_lengths.append(beat_length)
+            velocity_beat_lengths.append(velocity_beat_length)
+            velocity_multipliers.append(velocity_multiplier)
+
+        return cls(
+            times=list(accumulate((point.time for point in points), max)),
+            beatLengths=beat_lengths,
+            velocityBeatLengths=velocity_beat_lengths,
+            velocityMultipliers=velocity_multipliers,
+            source=points,
+            sourceLength=len(points)
+        )
+
+    def is_up_to_date(self, points: list[TimingPoint]) -> bool:
+        return self.source is points and self.sourceLength == len(points)
+
+    def index(self, time: float) -> int:
+        """ Index of the last timing point that applies at that time (-1 if there is none) """
+        return bisect_right(self.times, time) - 1
+
+    def beat_length(self, time: float) -> float:
+        i = self.index(time)
+        return self.beatLengths[i] if i >= 0 else 500
+
+    def velocity_params(self, time: float) -> Tuple[float, float]:
+        """ The beat length and velocity multiplier used to compute the slider velocity """
+        i = self.index(time)
+        if i < 0:
+            return self.velocityBeatLengths[0] if self.times else 500, -100
+        return self.velocityBeatLengths[i], self.velocityMultipliers[i]
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Main Beatmap class. This is the object that should be returned by the decompress_beatmap function
 # Its properties use UpperCamelCase
@@ -418,48 +743,104 @@ class Beatmap:
     Events: StoryBoard[Event]
     TimingPoints: list[TimingPoint]
     Colors: ColorSettings
-    HitObjects: list[HitObject]
+    HitObjects: Union[list[HitObject], HitObjectStore]
     Path: str
 
+    def __post_init__(self):
+        self._timing_index = None
+
     @classmethod
-    def from_file(cls, path: str):
+    def from_file(cls, path: str, lazy: bool = False, cache=None, columnar: bool = False):
+        """
+        :param path: The path to the .osu file
+        :param lazy: If this is True, the hit objects are only analysed when their analysis attributes are first read
+            (pos, stack, and the path, ticks, tail and end of sliders)
+        :param cache: A BeatmapCache. If it is given, the analysed beatmap is taken from it (or stored in it)
+        :param columnar: If this is True, HitObjects is a HitObjectStore instead of a list
+        """
+        if cache is not None:
+            if lazy:
+                raise ValueError("A lazily analysed beatmap can't be cached")
+            if columnar:
+                raise ValueError("A columnar beatmap can't be cached")
+            return cache.load(path)
         from .reader import read_beatmap_file
         from .analyser import analyse_beatmap
-        beatmap = read_beatmap_file(path)
-        analyse_beatmap(beatmap)
+        beatmap = read_beatmap_file(path, columnar)
+        analyse_beatmap(beatmap, lazy=lazy)
         return beatmap
 
     def save(self, path: str):
         from .reader import write_beatmap_file
         return write_beatmap_file(self, path)
 
+    @classmethod
+    def from_binary(cls, path: str, memory_map: bool = False):
+        """ Reads a beatmap written by save_binary, with its analysis; see helpers.binary.read_binary_file """
+        from ..helpers.binary import read_binary_file
+        return read_binary_file(path, cls, memory_map)
+
+    def save_binary(self, path: str):
+        from ..helpers.binary import write_binary_file
+        write_binary_file(self, path)
+
     def get_hash(self) -> str:
-        return hashlib_md5( open(self.Path, "rb").read() ).hexdigest()
+        return hashlib_md5( read_file(self.Path) ).hexdigest()
+
+    def timing_index(self) -> TimingIndex:
+        """
+        The index is rebuilt when TimingPoints is replaced or changes length
+        If timing points are edited in place, call invalidate_timing_index
+        """
+        if self._timing_index is None or not self._timing_index.is_up_to_date(self.TimingPoints):
+            self._timing_index = TimingIndex.from_timing_points(self.TimingPoints)
+        return self._timing_index
+
+    def invalidate_timing_index(self):
+        self._timing_index = None
 
     def beat_length(self, time: int) -> float:
-        beat_length = 500  # Default value
-        for point in self.TimingPoints:
-            if point.time > time: break
-            if point.uninherited:
-                beat_length = point.beatLength
-        return beat_length
+        return self.timing_index().beat_length(time)
+
+    def beat_lengths(self, times: Iterable[int]) -> list[float]:
+        index = self.timing_index()
+        return [index.beat_length(time) for time in times]
 
     def slider_velocity(self, time: int) -> float:
-        beat_length = 500  # Default value
-        # Look for base beat length
-        for point in self.TimingPoints:
-            if point.uninherited:
-                beat_length = point.beatLength
-                break
+        beat_length, velocity_multiplier = self.timing_index().velocity_params(time)
+        return 100 * self.Difficulty.SliderMultiplier * (-100 / velocity_multiplier) * (1 / beat_length)
 
-        velocity_multiplier = -100  # Default value
-        # Get current timing point settings
-        for point in self.TimingPoints:
-            if point.time > time: break
-            if point.uninherited:
-                beat_length = point.beatLength
-                velocity_multiplier = -100
-            else:
-                velocity_multiplier = point.beatLength
+    def slider_velocities(self, times: Iterable[int]) -> list[float]:
+        index = self.timing_index()
+        slider_multiplier = self.Difficulty.SliderMultiplier
+        return [
+            100 * slider_multiplier * (-100 / velocity_multiplier) * (1 / beat_length)
+            for time in times
+            for beat_length, velocity_multiplier in [ index.velocity_params(time) ]
+        ]
 
-        return 100 * self.Difficulty.SliderMultiplier * (-100 / velocity_multiplier) * (1 / beat_length)
+
+@dataclass
+class BeatmapInfo:
+    """
+    The settings of a beatmap that describe it, read without parsing its events, timing points and hit objects
+    The object counts are only set when they are asked for
+    """
+    FileFormat: int
+    General: GeneralSettings
+    Metadata: MetadataSettings
+    Difficulty: DifficultySettings
+    Path: str
+    ObjectCount: int = None
+    FirstObjectTime: int = None
+    LastObjectTime: int = None
+
+    @classmethod
+    def from_file(cls, path: str, count_objects: bool = False):
+        """
+        :param path: The path to the .osu file
+        :param count_objects: If this is True, the [HitObjects] section is also scanned (without building the objects)
+            to count them and find the time of the first and last ones. Else, the file is not read past [Difficulty]
+        """
+        from .reader import read_beatmap_info
+        return read_beatmap_info(path, count_objects)
@@ -0,0 +1,75 @@
+from os import walk
+from os.path import isdir, join
+from typing import Iterable, Iterator, Tuple, Union
+from .classes import Beatmap
+from ..helpers import osu_fp, complete_path
+from ..helpers.pool import imap_bounded
+
+
+def find_beatmap_files(directory: str) -> Iterator[str]:
+    for folder, sub_folders, files in walk(directory):
+        sub_folders.sort()  # Walk the folders in a stable order
+        for file in sorted(files):
+            if file.endswith(".osu"):
+                yield join(folder, file)
+
+
+def load_beatmap(path: str, loop_ms: int, bezier_precision: int, bezier_tolerance: float) -> Beatmap:
+    """ Runs in the worker processes """
+    from .reader import read_beatmap_file
+    from .analyser import analyse_beatmap
+    beatmap = read_beatmap_file(path)
+    analyse_beatmap(beatmap, loop_ms, bezier_precision, bezier_tolerance)
+    return beatmap
+
+
+class BeatmapCorpus:
+    """
+    Parses and analyses a whole set of beatmaps in a process pool
+    Iterating over it yields (path, beatmap) pairs; the files that could not be loaded are skipped and their
+    exception is stored in the errors dictionary, so one broken map never stops the run
+    """
+    def __init__(self, source: Union[str, Iterable[str]] = None, processes: int = None, max_pending: int = None,
+                 ordered: bool = True, loop_ms: int = 10, bezier_precision: int = 50,
+                 bezier_tolerance: float = 0.25):
+        """
+        :param source: A folder (searched recursively for .osu files) or an iterable of paths to .osu files
+            Relative folders are taken from the Songs folder, and None (default) means the whole Songs folder
+        :param processes: The number of worker processes. None (default) means one per CPU
+        :param max_pending: How many beatmaps can be loaded ahead of the consumer. None (default) means 4 per process
+        :param ordered: If this is True, beatmaps are yielded in the order of source; else as soon as they are loaded
+        :param loop_ms: Passed to analyse_beatmap
+        :param bezier_precision: Passed to analyse_beatmap
+        :param bezier_tolerance: Passed to analyse_beatmap
+        """
+        if source is None:
+            source = ""
+        if isinstance(source, str):
+            source = complete_path(source, root=osu_fp.get(), folder="Songs\\")
+            if not isdir(source):
+                raise NotADirectoryError(f"'{source}' is not a folder")
+        self.source = source
+        self.processes = processes
+        self.max_pending = max_pending
+        self.ordered = ordered
+        self.loop_ms = loop_ms
+        self.bezier_precision = bezier_precision
+        self.bezier_tolerance = bezier_tolerance
+        self.errors = {}
+
+    def paths(self) -> Iterator[str]:
+        if isinstance(self.source, str):
+            return find_beatmap_files(self.source)
+        return iter(self.source)
+
+    def __iter__(self) -> Iterator[Tuple[str, Beatmap]]:
+        self.errors = {}
+        results = imap_bounded(
+            load_beatmap, self.paths(), self.loop_ms, self.bezier_precision, self.bezier_tolerance,
+            processes=self.processes, max_pending=self.max_pending, ordered=self.ordered
+        )
+        for path, future in results:
+            if future.exception() is not None:
+                self.errors[path] = future.exception()
+                continue
+            yield path, future.result()
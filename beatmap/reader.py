@@ -1,98 +1,192 @@
-from .classes import Beatmap, TimingPoint, HitObject,  \
+from .classes import Beatmap, BeatmapInfo, TimingPoint, HitObject, HitObjectStore,  \
     GeneralSettings, EditorSettings, MetadataSettings, DifficultySettings, ColorSettings
-from ..storyboard.reader import get_events
-from ..storyboard import SpriteCommand, Loop, Trigger
-from ..helpers import osu_fp, complete_path, split_get
-from re import match, findall
-from typing import Union
+from ..storyboard.reader import get_events, write_events
+from ..storyboard import StoryBoard
+from ..helpers import osu_fp, complete_path, open_text_file, iter_sections, SplitParser
+from io import StringIO
+from itertools import groupby
+from operator import itemgetter
+from re import match
+from typing import Iterable, Union
 
 
-def read_beatmap_file(path: str) -> Beatmap:
-    path = complete_path(path, root=osu_fp.get(), folder="Songs\\", ext=".osu")  # Be sure the path is correct
-    with open(path, "r", encoding="utf-8") as file:
-        file_content = file.read()
+SETTING_PARSER = SplitParser(":", [str, (int, float, str)])
+METADATA_PARSER = SplitParser(":", [str, (int, float, str)], max_split=1)
+DIFFICULTY_PARSER = SplitParser(":", [str, float])
+BOOKMARKS_PARSER = SplitParser(",", [[int]])
+TIMING_POINT_PARSER = SplitParser(",", [[int, float]])
+COLOR_PARSER = SplitParser(":", [str, str])
+RGB_PARSER = SplitParser(",", [int, int, int])
+HIT_OBJECT_PARSER = SplitParser(",", [[int, float, str]])
 
-    file_format = int( match(r"^[^o]?osu file format v(\d+)", file_content).group(1) )
-    sections = {
-        name: [line for line in content.split("\n") if line != "" and not line.startswith("//")]
-        for name, content in findall(r"\n\[(\w+)\]\n((?:[^\[]+|(?<!\n)\[)+)(?=\n\[|$)", file_content)
-    }
 
-    general = {
+def read_general(lines: Iterable[str]) -> dict:
+    return {
         key: value
-        for line in sections.get("General", [])
-        for key, value in [ split_get(line, ":", [str, (int, float, str)]) ]
+        for line in lines
+        for key, value in [ SETTING_PARSER(line) ]
     }
-    editor = {
-        key: value if key != "Bookmarks" else split_get(str(value), ",", [[int]])
-        for line in sections.get("Editor", [])
-        for key, value in [ split_get(line, ":", [str, (int, float, str)]) ]
+
+
+def read_editor(lines: Iterable[str]) -> dict:
+    return {
+        key: value if key != "Bookmarks" else BOOKMARKS_PARSER(str(value))
+        for line in lines
+        for key, value in [ SETTING_PARSER(line) ]
     }
-    metadata = {
+
+
+def read_metadata(lines: Iterable[str]) -> dict:
+    return {
         key: value
-        for line in sections.get("Metadata", [])
-        for key, value in [ split_get(line, ":", [str, (int, float, str)], max_split=1) ]
+        for line in lines
+        for key, value in [ METADATA_PARSER(line) ]
     }
-    difficulty = {
+
+
+def read_difficulty(lines: Iterable[str]) -> dict:
+    return {
         key: value
-        for line in sections.get("Difficulty", [])
-        for key, value in [ split_get(line, ":", [str, float]) ]
+        for line in lines
+        for key, value in [ DIFFICULTY_PARSER(line) ]
     }
-    events = get_events(sections.get("Events", []))
-    timing_points = [
-        TimingPoint( *split_get(line, ",", [[int, float]]) )
-        for line in sections.get("TimingPoints", [])
-    ]
-    colors = {
-        key: split_get(value, ",", [int, int, int])
-        for line in sections.get("Colours", [])
-        for key, value in [ split_get(line, ":", [str, str]) ]
+
+
+def read_timing_points(lines: Iterable[str]) -> list[TimingPoint]:
+    return [ TimingPoint( *TIMING_POINT_PARSER(line) ) for line in lines ]
+
+
+def read_colors(lines: Iterable[str]) -> dict:
+    return {
+        key: RGB_PARSER(value)
+        for line in lines
+        for key, value in [ COLOR_PARSER(line) ]
     }
-    hit_objects = [
-        HitObject.from_params(*split_get(line, ",", [[int, float, str]]))
-        for line in sections.get("HitObjects", [])
-    ]
-
-    return Beatmap(
-        FileFormat=file_format,
-        General=GeneralSettings(general),
-        Editor=EditorSettings(editor),
-        Metadata=MetadataSettings(metadata),
-        Difficulty=DifficultySettings(difficulty),
-        Events=events,
-        TimingPoints=timing_points,
-        Colors=ColorSettings(colors),
-        HitObjects=hit_objects,
+
+
+def read_hit_objects(lines: Iterable[str]) -> list[HitObject]:
+    return [ HitObject.from_params(*HIT_OBJECT_PARSER(line)) for line in lines ]
+
+
+SECTION_READERS = {
+    "General": read_general,
+    "Editor": read_editor,
+    "Metadata": read_metadata,
+    "Difficulty": read_difficulty,
+    "Events": get_events,
+    "TimingPoints": read_timing_points,
+    "Colours": read_colors,
+    "HitObjects": read_hit_objects
+}
+
+
+def read_file_format(lines: Iterable[str]) -> int:
+    for line in lines:
+        if file_format := match(r"^[^o]?osu file format v(\d+)", line):
+            return int(file_format.group(1))
+    raise ValueError("Missing 'osu file format' header")
+
+
+def read_beatmap_file(path: str, columnar: bool = False) -> Beatmap:
+    """
+    :param path: The path to the .osu file
+    :param columnar: If this is True, the hit objects are read into a HitObjectStore instead of a list
+    """
+    path = complete_path(path, root=osu_fp.get(), folder="Songs\\", ext=".osu")  # Be sure the path is correct
+    readers = {**SECTION_READERS, "HitObjects": HitObjectStore.from_lines} if columnar else SECTION_READERS
+
+    # The file is read only once, line by line: each section is parsed as soon as its lines come in
+    sections = {}
+    with open_text_file(path) as file:
+        for name, tokens in groupby(iter_sections(file), key=itemgetter(0)):
+            lines = (line for _, line in tokens)
+            if name is None:
+                sections[name] = read_file_format(lines)
+            elif name in readers:
+                sections[name] = readers[name](lines)
+    if None not in sections:
+        raise ValueError("Missing 'osu file format' header")
+
+    beatmap = Beatmap(
+        FileFormat=sections[None],
+        General=GeneralSettings(sections.get("General", {})),
+        Editor=EditorSettings(sections.get("Editor", {})),
+        Metadata=MetadataSettings(sections.get("Metadata", {})),
+        Difficulty=DifficultySettings(sections.get("Difficulty", {})),
+        Events=sections.get("Events", StoryBoard()),
+        TimingPoints=sections.get("TimingPoints", []),
+        Colors=ColorSettings(sections.get("Colours", {})),
+        HitObjects=sections.get("HitObjects", HitObjectStore() if columnar else []),
         Path=path
     )
+    if columnar:
+        beatmap.HitObjects.compute_end_times(beatmap)
+    return beatmap
 
 
-# ----------------------------------------------------------------------------------------------------------------------
+INFO_SECTIONS = ("General", "Metadata", "Difficulty")
+
 
+def read_object_time(line: str) -> Union[int, float]:
+    """ The time of a hit object line, without parsing the rest of the line """
+    time = line.split(",", 3)[2]
+    try:
+        return int(time)
+    except ValueError:
+        return float(time)
 
-def format_sprite_command(cmd: Union[SpriteCommand, Loop, Trigger]) -> str:
-    if isinstance(cmd, SpriteCommand):
-        return cmd.osu_format()
-    return "\n".join(
-        [cmd.osu_format()] + [format_sprite_command(sub_cmd) for sub_cmd in cmd.commands]
+
+def read_beatmap_info(path: str, count_objects: bool = False) -> BeatmapInfo:
+    path = complete_path(path, root=osu_fp.get(), folder="Songs\\", ext=".osu")  # Be sure the path is correct
+
+    sections = {}
+    object_count = first_time = last_time = None
+    with open(path, "r", encoding="utf-8") as file:
+        for name, tokens in groupby(iter_sections(file), key=itemgetter(0)):
+            lines = (line for _, line in tokens)
+            if name is None:
+                sections[name] = read_file_format(lines)
+            elif name in INFO_SECTIONS:
+                sections[name] = SECTION_READERS[name](lines)
+            elif name == "HitObjects" and count_objects:
+                times = [ read_object_time(line) for line in lines ]
+                object_count = len(times)
+                first_time, last_time = (min(times), max(times)) if times else (None, None)
+            if not count_objects and all(section in sections for section in INFO_SECTIONS):
+                break  # The rest of the file is not needed
+    if None not in sections:
+        raise ValueError("Missing 'osu file format' header")
+
+    return BeatmapInfo(
+        FileFormat=sections[None],
+        General=GeneralSettings(sections.get("General", {})),
+        Metadata=MetadataSettings(sections.get("Metadata", {})),
+        Difficulty=DifficultySettings(sections.get("Difficulty", {})),
+        Path=path,
+        ObjectCount=object_count,
+        FirstObjectTime=first_time,
+        LastObjectTime=last_time
     )
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+
+
 def write_beatmap_file(beatmap: Beatmap, output_path=None) -> str:
-    events = "[Events]"
-    for event in beatmap.Events:
-        events += "\n"
-        events += event.osu_format()
-        if hasattr(event, "commands"):
-            events += "\n".join( format_sprite_command(cmd) for cmd in event.commands )
+    events = StringIO()
+    events.write("[Events]\n")
+    write_events(beatmap.Events, events)
 
     timing_points = (
         "[TimingPoints]\n" +
         "\n".join(point.osu_format() for point in beatmap.TimingPoints)
     )
+    hit_objects = beatmap.HitObjects
+    if isinstance(hit_objects, HitObjectStore):  # Analysing the rows would not change their lines
+        hit_objects = map(hit_objects.build, range(len(hit_objects)))
     hit_objects = (
         "[HitObjects]\n" +
-        "\n".join(obj.osu_format() for obj in beatmap.HitObjects)
+        "\n".join(obj.osu_format() for obj in hit_objects)
     )
 
     beatmap_str = (
@@ -101,7 +195,7 @@ def write_beatmap_file(beatmap: Beatmap, output_path=None) -> str:
         f"{beatmap.Editor.osu_format()}\n\n"
         f"{beatmap.Metadata.osu_format()}\n\n"
         f"{beatmap.Difficulty.osu_format()}\n\n"
-        f"{events}\n\n"
+        f"{events.getvalue()}\n"
         f"{timing_points}\n\n"
         f"{beatmap.Colors.osu_format()}\n\n"
         f"{hit_objects}\n"
@@ -1,13 +1,14 @@
 from .miscellaneous import zigzag_function
-from .paths import osu_fp, complete_path
-from .parsing import split_get
-from .plane_classes import Vector, CartesianLine
-from .plane_functions import segment_fraction, bezier, angles_are_rotating_clockwise, find_circle_center
+from .paths import osu_fp, complete_path, file_cache, read_file, open_text_file, mapped_file
+from .parsing import split_get, SplitParser, iter_sections
+from .plane_classes import Vector, VectorArray, CartesianLine
+from .plane_functions import segment_fraction, bezier, flatten_bezier, angles_are_rotating_clockwise, find_circle_center
 
 __all__ = [
-    'complete_path', 'split_get',
-    'Vector', 'CartesianLine',
-    'segment_fraction', 'bezier', 'angles_are_rotating_clockwise', 'find_circle_center',
+    'complete_path', 'file_cache', 'read_file', 'open_text_file', 'mapped_file',
+    'split_get', 'SplitParser', 'iter_sections',
+    'Vector', 'VectorArray', 'CartesianLine',
+    'segment_fraction', 'bezier', 'flatten_bezier', 'angles_are_rotating_clockwise', 'find_circle_center',
     'zigzag_function',
     'osu_fp'
 ]
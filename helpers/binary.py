@@ -0,0 +1,550 @@
+"""
+Binary serialisation of the objects of this package (.ospy files)
+
+A file is a header (magic, format version, byte order of the arrays) followed by one tagged value
+Objects are stored as a class and the values of their attributes, without running their __init__ or __post_init__,
+so nothing is parsed from text when they are read back. The class names, attribute name sets and strings are written
+once and then referred to by index
+Lists of objects are stored column by column, and the numeric columns as raw arrays. Arrays are aligned in the file,
+so that they can be read as zero-copy memoryviews of a memory-mapped file
+These memoryviews are read-only: the classes that change their arrays in place (ReplayFrames, HitObjectStore,
+VectorArray) first replace them with copies (see writable_array)
+"""
+
+
+import mmap
+import struct
+from array import array
+from importlib import import_module
+from itertools import accumulate, chain
+from sys import byteorder
+from typing import Any, Union
+from .plane_classes import Vector
+
+
+MAGIC = b"OSPY"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHB")  # Magic, format version, byte order of the arrays (0: little endian, 1: big endian)
+DOUBLE = struct.Struct("<d")
+PACKAGE = __name__.rsplit(".", 2)[0]  # Only the classes of this package can be written and read
+
+# Tags of the values
+NONE, FALSE, TRUE, INT, FLOAT, STR, STR_REF, BYTES, LIST, TUPLE, DICT, ARRAY, VECTOR, OBJECT, REF = range(15)
+
+# Layouts of the items of a list
+PLAIN, RECORDS = range(2)
+
+# Kinds of the columns of records
+COLUMN_VALUES, COLUMN_INTS, COLUMN_FLOATS, COLUMN_VECTORS, COLUMN_RECORDS, COLUMN_ARRAYS = range(6)
+
+INT64_MIN, INT64_MAX = -1 << 63, (1 << 63) - 1
+MIN_RECORDS = 16  # Shorter lists of objects are faster to read object by object than column by column
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Low level readers and writers
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class BinaryWriter:
+    """ Appends little endian values to a bytearray """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write_bytes(self, data: Union[bytes, bytearray, memoryview]):
+        self.buffer += data
+
+    def write_byte(self, value: int):
+        self.buffer.append(value)
+
+    def write_uleb128(self, value: int):
+        buffer = self.buffer
+        while value >= 0x80:
+            buffer.append(value & 0x7f | 0x80)
+            value >>= 7
+        buffer.append(value)
+
+    def write_int(self, value: int):
+        """ Signed integer of any size, zigzag encoded as an uleb128 """
+        self.write_uleb128(value << 1 if value >= 0 else (-value << 1) - 1)
+
+    def write_string(self, string: str):
+        data = string.encode("utf-8")
+        self.write_uleb128(len(data))
+        self.buffer += data
+
+    def write_osu_string(self, string: str):
+        """ String in the format of osu! binary files: 0x00 if it is empty, else 0x0b, its uleb128 length and itself """
+        if not string:
+            self.buffer.append(0x00)
+            return
+        self.buffer.append(0x0b)
+        self.write_string(string)
+
+    def write_struct(self, fmt: struct.Struct, *values):
+        self.buffer += fmt.pack(*values)
+
+    def align(self, size: int):
+        """ Pads the buffer with zeros up to a multiple of size """
+        self.buffer += bytes(-len(self.buffer) % size)
+
+    def write_array(self, values: array):
+        """ The typecode, item size and length of the array, then its raw items, aligned on their size """
+        self.buffer.append(ord(values.typecode))
+        self.buffer.append(values.itemsize)
+        self.write_uleb128(len(values))
+        self.align(values.itemsize)
+        self.buffer += memoryview(values).cast("B")
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buffer)
+
+
+class BinaryReader:
+    """ Reads the values written by a BinaryWriter from any bytes-like object (bytes, mmap, ...), without copying it """
+    def __init__(self, data, offset: int = 0):
+        self.view = memoryview(data)
+        if self.view.format != "B" or self.view.ndim != 1:
+            self.view = self.view.cast("B")
+        self.offset = offset
+
+    def read_bytes(self, size: int) -> memoryview:
+        start = self.offset
+        self.offset += size
+        if self.offset > len(self.view):
+            raise ValueError("Unexpected end of binary data")
+        return self.view[start:self.offset]
+
+    def read_byte(self) -> int:
+        value = self.view[self.offset]
+        self.offset += 1
+        return value
+
+    def read_uleb128(self) -> int:
+        view, offset = self.view, self.offset
+        value = shift = 0
+        while True:
+            byte = view[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                self.offset = offset
+                return value
+
+    def read_int(self) -> int:
+        value = self.read_uleb128()
+        return (value >> 1) ^ -(value & 1)
+
+    def read_string(self) -> str:
+        return str(self.read_bytes(self.read_uleb128()), "utf-8")
+
+    def read_osu_string(self, skip: bool = False) -> str:
+        """
+        String in the format of osu! binary files (see BinaryWriter.write_osu_string)
+        :param skip: If this is True, the string is skipped without being decoded, and "" is returned
+        """
+        marker = self.read_byte()
+        if marker == 0x00:
+            return ""
+        if marker != 0x0b:
+            raise ValueError(f"Invalid string marker {marker:#x} at offset {self.offset - 1}")
+        data = self.read_bytes(self.read_uleb128())
+        return "" if skip else str(data, "utf-8")
+
+    def read_struct(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.view, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def read_array(self, zero_copy: bool = False, swap: bool = False) -> Union[array, memoryview]:
+        """
+        :param zero_copy: If this is True, a read-only memoryview of the data is returned instead of a copy
+        :param swap: If this is True, the items were written with the other byte order (this implies a copy)
+        """
+        typecode = chr(self.read_byte())
+        itemsize = self.read_byte()
+        length = self.read_uleb128()
+        if array(typecode).itemsize != itemsize:
+            raise ValueError(f"Array of '{typecode}' items of {itemsize} bytes can't be read on this platform")
+        self.offset += -self.offset % itemsize
+        data = self.read_bytes(length * itemsize)
+        if zero_copy and not swap:
+            return data.cast(typecode)
+        values = array(typecode)
+        values.frombytes(data)
+        if swap:
+            values.byteswap()
+        return values
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Tagged values
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def class_name(cls: type) -> str:
+    """ The name of a class, relative to the package """
+    if not cls.__module__.startswith(PACKAGE + "."):
+        raise TypeError(f"Objects of type '{cls.__name__}' can't be written in binary format")
+    return f"{cls.__module__[len(PACKAGE) + 1:]}:{cls.__qualname__}"
+
+
+def class_from_name(name: str) -> type:
+    module, _, qualname = name.partition(":")
+    try:
+        cls = getattr(import_module(f"{PACKAGE}.{module}"), qualname, None)
+    except ImportError:
+        cls = None
+    if not isinstance(cls, type) or not cls.__module__.startswith(PACKAGE + "."):  # Imported classes are not decoded
+        raise ValueError(f"Unknown class '{name}' in binary data")
+    return cls
+
+
+def is_object(value: Any) -> bool:
+    """ Objects that are stored as their class and the values of their attributes """
+    cls = type(value)
+    return cls.__module__.startswith(PACKAGE + ".") and cls is not Vector and hasattr(value, "__dict__")
+
+
+class BinaryEncoder:
+    def __init__(self, writer: BinaryWriter):
+        self.writer = writer
+        self.memo = {}  # id of the lists, dictionaries and objects already written: their index
+        self.keep_alive = []  # The memoized values, so that their id is not reused
+        self.classes = {}
+        self.key_sets = {}
+        self.strings = {}
+
+    def memoize(self, value: Any):
+        self.memo[id(value)] = len(self.memo)
+        self.keep_alive.append(value)
+
+    def write_class(self, cls: type):
+        index = self.classes.get(cls)
+        if index is None:  # New class: the index is followed by its name
+            index = self.classes[cls] = len(self.classes)
+            self.writer.write_uleb128(index)
+            self.writer.write_string(class_name(cls))
+            return
+        self.writer.write_uleb128(index)
+
+    def write_keys(self, keys: tuple):
+        index = self.key_sets.get(keys)
+        if index is None:  # New key set: the index is followed by the keys
+            index = self.key_sets[keys] = len(self.key_sets)
+            self.writer.write_uleb128(index)
+            self.writer.write_uleb128(len(keys))
+            for key in keys:
+                self.writer.write_string(key)
+            return
+        self.writer.write_uleb128(index)
+
+    def encode(self, value: Any):
+        writer = self.writer
+        cls = type(value)
+        if cls is int:
+            writer.buffer.append(INT)
+            writer.write_int(value)
+        elif cls is float:
+            writer.buffer.append(FLOAT)
+            writer.buffer += DOUBLE.pack(value)
+        elif cls is str:
+            index = self.strings.get(value)
+            if index is None:
+                self.strings[value] = len(self.strings)
+                writer.buffer.append(STR)
+                writer.write_string(value)
+            else:
+                writer.buffer.append(STR_REF)
+                writer.write_uleb128(index)
+        elif value is None:
+            writer.buffer.append(NONE)
+        elif cls is bool:
+            writer.buffer.append(TRUE if value else FALSE)
+        elif cls is Vector:
+            writer.buffer.append(VECTOR)
+            self.encode(value.x)
+            self.encode(value.y)
+        elif cls is tuple:
+            writer.buffer.append(TUPLE)
+            writer.write_uleb128(len(value))
+            for item in value:
+                self.encode(item)
+        elif cls is bytes:
+            writer.buffer.append(BYTES)
+            writer.write_uleb128(len(value))
+            writer.buffer += value
+        elif cls is array:
+            writer.buffer.append(ARRAY)
+            writer.write_array(value)
+        elif id(value) in self.memo:
+            writer.buffer.append(REF)
+            writer.write_uleb128(self.memo[id(value)])
+        elif cls is list:
+            writer.buffer.append(LIST)
+            self.memoize(value)
+            self.encode_items(value)
+        elif cls is dict:
+            writer.buffer.append(DICT)
+            self.memoize(value)
+            writer.write_uleb128(len(value))
+            for key, item in value.items():
+                self.encode(key)
+                self.encode(item)
+        elif is_object(value):
+            writer.buffer.append(OBJECT)
+            self.write_class(cls)
+            self.memoize(value)
+            state = vars(value)
+            self.write_keys(tuple(state))
+            for item in state.values():
+                self.encode(item)
+            if isinstance(value, list):  # Lists subclasses (StoryBoard) also have items
+                self.encode_items(value)
+        else:
+            raise TypeError(f"Objects of type '{cls.__name__}' can't be written in binary format")
+
+    def can_be_records(self, items: list) -> bool:
+        """ Lists of at least MIN_RECORDS distinct unwritten objects, none of them having items of their own """
+        return (
+            len(items) >= MIN_RECORDS
+            and all(is_object(item) and not isinstance(item, list) and id(item) not in self.memo for item in items)
+            and len(set(map(id, items))) == len(items)
+        )
+
+    def encode_items(self, items: list):
+        if self.can_be_records(items):
+            self.writer.write_byte(RECORDS)
+            self.encode_records(items)
+            return
+        self.writer.write_byte(PLAIN)
+        self.writer.write_uleb128(len(items))
+        for item in items:
+            self.encode(item)
+
+    def encode_records(self, items: list):
+        """ Objects grouped by class and attribute names, each group being stored column by column """
+        groups = {}  # (class, keys): index of the group
+        kinds = [ groups.setdefault( (type(item), tuple(vars(item))), len(groups) ) for item in items ]
+        for item in items:
+            self.memoize(item)
+
+        writer = self.writer
+        writer.write_uleb128(len(groups))
+        for cls, keys in groups:
+            self.write_class(cls)
+            self.write_keys(keys)
+        writer.write_uleb128(len(items))
+        if len(groups) > 1:
+            writer.write_array(array("B" if len(groups) <= 0x100 else "I", kinds))
+        for (cls, keys), kind in groups.items():
+            members = [item for item, item_kind in zip(items, kinds) if item_kind == kind]
+            states = [vars(item) for item in members]
+            for key in keys:
+                self.encode_column([state[key] for state in states])
+
+    def encode_column(self, values: list):
+        writer = self.writer
+        types = set(map(type, values))
+        if types == {int} and INT64_MIN <= min(values) and max(values) <= INT64_MAX:
+            writer.write_byte(COLUMN_INTS)
+            writer.write_array(array("q", values))
+        elif types == {float}:
+            writer.write_byte(COLUMN_FLOATS)
+            writer.write_array(array("d", values))
+        elif types == {Vector} and all(type(value.x) is float and type(value.y) is float for value in values):
+            writer.write_byte(COLUMN_VECTORS)
+            writer.write_array(array("d", (value.x for value in values)))
+            writer.write_array(array("d", (value.y for value in values)))
+        elif types == {array} and len({value.typecode for value in values}) == 1:  # Stored end to end
+            writer.write_byte(COLUMN_ARRAYS)
+            writer.write_array(array("q", map(len, values)))
+            writer.write_array(array(values[0].typecode, chain.from_iterable(values)))
+        elif self.can_be_records(values):
+            writer.write_byte(COLUMN_RECORDS)
+            self.encode_records(values)
+        else:
+            writer.write_byte(COLUMN_VALUES)
+            for value in values:
+                self.encode(value)
+
+
+class BinaryDecoder:
+    def __init__(self, reader: BinaryReader, zero_copy: bool = False, swap: bool = False):
+        self.reader = reader
+        self.zero_copy = zero_copy
+        self.swap = swap
+        self.memo = []
+        self.classes = []
+        self.key_sets = []
+        self.strings = []
+
+    def read_class(self) -> type:
+        index = self.reader.read_uleb128()
+        if index == len(self.classes):
+            self.classes.append(class_from_name(self.reader.read_string()))
+        return self.classes[index]
+
+    def read_keys(self) -> tuple:
+        index = self.reader.read_uleb128()
+        if index == len(self.key_sets):
+            self.key_sets.append(tuple(self.reader.read_string() for _ in range(self.reader.read_uleb128())))
+        return self.key_sets[index]
+
+    def decode(self) -> Any:
+        reader = self.reader
+        view, offset = reader.view, reader.offset
+        tag = view[offset]
+        if tag == INT and view[offset + 1] < 0x80:  # Small integers (most of them) are read inline
+            reader.offset = offset + 2
+            value = view[offset + 1]
+            return (value >> 1) ^ -(value & 1)
+        reader.offset = offset + 1
+        if tag == INT:
+            return reader.read_int()
+        if tag == FLOAT:
+            return reader.read_struct(DOUBLE)[0]
+        if tag == STR_REF and view[offset + 1] < 0x80:
+            reader.offset = offset + 2
+            return self.strings[view[offset + 1]]
+        if tag == STR:
+            string = reader.read_string()
+            self.strings.append(string)
+            return string
+        if tag == STR_REF:
+            return self.strings[reader.read_uleb128()]
+        if tag == NONE:
+            return None
+        if tag == FALSE:
+            return False
+        if tag == TRUE:
+            return True
+        if tag == VECTOR:
+            return Vector(self.decode(), self.decode())
+        if tag == TUPLE:
+            return tuple([self.decode() for _ in range(reader.read_uleb128())])
+        if tag == BYTES:
+            return bytes(reader.read_bytes(reader.read_uleb128()))
+        if tag == ARRAY:
+            return reader.read_array(self.zero_copy, self.swap)
+        if tag == REF:
+            return self.memo[reader.read_uleb128()]
+        if tag == LIST:
+            items = []
+            self.memo.append(items)
+            items.extend(self.decode_items())
+            return items
+        if tag == DICT:
+            mapping = {}
+            self.memo.append(mapping)
+            for _ in range(reader.read_uleb128()):
+                key = self.decode()
+                mapping[key] = self.decode()
+            return mapping
+        if tag == OBJECT:
+            cls = self.read_class()
+            obj = cls.__new__(cls)
+            self.memo.append(obj)
+            keys = self.read_keys()
+            obj.__dict__.update([ (key, self.decode()) for key in keys ])
+            if isinstance(obj, list):
+                list.extend(obj, self.decode_items())
+            return obj
+        raise ValueError(f"Unknown tag {tag} in binary data at offset {reader.offset - 1}")
+
+    def decode_items(self) -> list:
+        layout = self.reader.read_byte()
+        if layout == RECORDS:
+            return self.decode_records()
+        if layout != PLAIN:
+            raise ValueError(f"Unknown list layout {layout} in binary data")
+        return [self.decode() for _ in range(self.reader.read_uleb128())]
+
+    def decode_records(self) -> list:
+        reader = self.reader
+        groups = [(self.read_class(), self.read_keys()) for _ in range(reader.read_uleb128())]
+        length = reader.read_uleb128()
+        kinds = reader.read_array() if len(groups) > 1 else [0] * length
+        items = [groups[kind][0].__new__(groups[kind][0]) for kind in kinds]
+        self.memo.extend(items)
+        for kind, (cls, keys) in enumerate(groups):
+            members = [item for item, item_kind in zip(items, kinds) if item_kind == kind]
+            columns = [self.decode_column(len(members)) for _ in keys]
+            for item, row in zip(members, zip(*columns)):
+                item.__dict__.update(zip(keys, row))
+        return items
+
+    def decode_column(self, length: int) -> list:
+        kind = self.reader.read_byte()
+        if kind in (COLUMN_INTS, COLUMN_FLOATS):
+            return self.reader.read_array(swap=self.swap).tolist()
+        if kind == COLUMN_VECTORS:
+            x, y = self.reader.read_array(swap=self.swap), self.reader.read_array(swap=self.swap)
+            return list(map(Vector, x, y))
+        if kind == COLUMN_RECORDS:
+            return self.decode_records()
+        if kind == COLUMN_ARRAYS:
+            ends = list(accumulate(self.reader.read_array(swap=self.swap), initial=0))
+            values = self.reader.read_array(self.zero_copy, self.swap)
+            return [values[start:end] for start, end in zip(ends, ends[1:])]
+        if kind == COLUMN_VALUES:
+            return [self.decode() for _ in range(length)]
+        raise ValueError(f"Unknown column kind {kind} in binary data")
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Functions, meant for use in other modules
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def writable_array(values: Union[array, memoryview]) -> array:
+    """ values itself if it is an array, or a copy of it if it is a read-only memoryview (see read_array) """
+    if not isinstance(values, memoryview):
+        return values
+    copy = array(values.format)
+    copy.frombytes(values.cast("B"))
+    return copy
+
+
+def to_binary(value: Any) -> bytes:
+    writer = BinaryWriter()
+    writer.write_struct(HEADER, MAGIC, FORMAT_VERSION, byteorder == "big")
+    BinaryEncoder(writer).encode(value)
+    return writer.getvalue()
+
+
+def from_binary(data, zero_copy: bool = False) -> Any:
+    """
+    :param data: Any bytes-like object
+    :param zero_copy: If this is True, the arrays are read-only memoryviews of data instead of copies
+    """
+    reader = BinaryReader(data)
+    magic, version, big_endian = reader.read_struct(HEADER)
+    if magic != MAGIC:
+        raise ValueError("Not an osu-py binary file")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary format version {version} (expected {FORMAT_VERSION})")
+    return BinaryDecoder(reader, zero_copy, swap=big_endian != (byteorder == "big")).decode()
+
+
+def write_binary_file(value: Any, path: str):
+    with open(path, "wb") as file:
+        file.write(to_binary(value))
+
+
+def read_binary_file(path: str, expected_type: type = None, memory_map: bool = False) -> Any:
+    """
+    :param path: The path to the binary file
+    :param expected_type: If this is given, a TypeError is raised when the file holds something else
+    :param memory_map: If this is True, the file is memory-mapped and its arrays are read as zero-copy memoryviews
+        (the file then stays mapped as long as these arrays are used)
+    """
+    with open(path, "rb") as file:
+        if memory_map:
+            value = from_binary(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), zero_copy=True)
+        else:
+            value = from_binary(file.read())
+    if expected_type is not None and not isinstance(value, expected_type):
+        raise TypeError(f"'{path}' holds a {type(value).__name__}, not a {expected_type.__name__}")
+    return value
@@ -1,4 +1,5 @@
-from typing import Any
+from functools import partial
+from typing import Any, Iterable, Iterator, Optional, Tuple
 
 
 def apply_first_correct_function(s: str, funcs: tuple, default: Any = ...):
@@ -12,6 +13,75 @@ def apply_first_correct_function(s: str, funcs: tuple, default: Any = ...):
     raise ValueError(f"All given functions made an exception with '{s}'")
 
 
+MAX_LAYOUTS = 16  # Number of element counts a SplitParser keeps the layout of
+
+
+class SplitParser:
+    """
+    A precompiled split_get: the layout of the functions is resolved once per number of elements,
+    so each call only does the split and the conversions. SplitParser(sep, ...)(s) == split_get(s, sep, ...)
+    Parsers made of a single starred list (like [[int]]) have a single layout, whatever the number of elements
+    The other ones keep the layouts of MAX_LAYOUTS numbers of elements at most, the others are built on each call
+    """
+    def __init__(self, sep: str, obj_funcs: list, defaults: list = None,
+                 max_split: int = -1, no_strip: bool = False, min_len: int = 0, max_len: int = 100):
+        self.sep = sep
+        self.obj_funcs = list(obj_funcs)
+        self.defaults = [] if defaults is None else list(defaults)
+        self.max_split = max_split
+        self.no_strip = no_strip
+        self.min_len = min_len
+        self.max_len = max_len
+        self.star = next((i for i, f in enumerate(self.obj_funcs) if isinstance(f, list)), None)
+        self.layouts = {}  # {number of elements}: (functions, defaults, converters)
+        self.star_only = len(self.obj_funcs) == 1 and self.star == 0 and not self.defaults
+        if self.star_only:  # The same functions for every element
+            funcs = tuple(self.obj_funcs[0])
+            self.star_funcs = funcs
+            self.star_converter = funcs[0] if len(funcs) == 1 else partial(apply_first_correct_function, funcs=funcs)
+
+    def layout(self, length: int) -> tuple:
+        obj_funcs = self.obj_funcs
+        # Resolve the "starred expression" pattern so there is one function per element
+        if self.star is not None:
+            star_span = length - len(obj_funcs) + 1
+            obj_funcs = obj_funcs[:self.star] + [tuple(obj_funcs[self.star])]*star_span + obj_funcs[self.star+1:]
+        # Convert every non-tuple function to a 1-tuple containing that function
+        obj_funcs = [(f,) if not isinstance(f, tuple) else f for f in obj_funcs]
+        # Extend obj_funcs and defaults so they match the number of elements
+        obj_funcs += [(str,)] * (length - len(obj_funcs))
+        defaults = self.defaults + [...] * (length - len(self.defaults))
+        # Single functions are called directly; if they fail, __call__ falls back to apply_first_correct_function
+        converters = [
+            funcs[0] if len(funcs) == 1 else partial(apply_first_correct_function, funcs=funcs, default=default)
+            for funcs, default in zip(obj_funcs, defaults)
+        ]
+        layout = (obj_funcs, defaults, converters)
+        if len(self.layouts) < MAX_LAYOUTS:
+            self.layouts[length] = layout
+        return layout
+
+    def __call__(self, s: str) -> list:
+        args = s.split(self.sep, self.max_split)
+        if not self.no_strip:
+            args = [i.strip() for i in args]
+        if self.star_only:
+            try:
+                res = list(map(self.star_converter, args))
+            except Exception:
+                res = [apply_first_correct_function(arg, self.star_funcs) for arg in args]
+            return res[:self.max_len]
+        obj_funcs, defaults, converters = self.layouts.get(len(args)) or self.layout(len(args))
+        try:
+            res = [f(arg) for f, arg in zip(converters, args)]
+        except Exception:
+            res = [apply_first_correct_function(arg, funcs, default)
+                   for arg, funcs, default in zip(args, obj_funcs, defaults)]
+        if len(res) < self.min_len:
+            res += self.defaults[len(res):self.min_len]
+        return res[:self.max_len]
+
+
 def split_get(s: str, sep: str, obj_funcs: list, defaults: list = None,
               max_split: int = -1, no_strip: bool = False, min_len: int = 0, max_len: int = 100) -> list:
     """
@@ -47,3 +117,22 @@ def split_get(s: str, sep: str, obj_funcs: list, defaults: list = None,
     defaults.extend( ... for i in range(len(args)-len(defaults)) )
     res = [apply_first_correct_function(arg, funcs, default) for arg, funcs, default in zip(args, obj_funcs, defaults)]
     return ( res + defaults[len(res):min_len] )[:max_len]
+
+
+def iter_sections(lines: Iterable[str]) -> Iterator[Tuple[Optional[str], str]]:
+    """
+    Reads .osu/.osb-like content line by line, in a single pass
+    :param lines: Any iterable of lines (an opened text file works)
+    :return: An iterator of (section, line) pairs, where section is the name of the last "[Section]" header seen
+        (None for the lines before the first header). Empty lines, comments and headers are not yielded
+    """
+    section = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("//") or line.isspace():
+            continue
+        header = line.rstrip()
+        if header.startswith("[") and header.endswith("]") and header[1:-1].isidentifier():
+            section = header[1:-1]
+            continue
+        yield section, line
@@ -1,4 +1,12 @@
+import os
+import mmap
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from io import BytesIO, TextIOWrapper
 from os.path import join, dirname
+from threading import Lock
+from typing import Iterator, Optional, TextIO, Union
 
 FP_CONTAINER = join(dirname(__file__), 'osu_fp.txt')
 
@@ -18,18 +26,149 @@ class OsuFolderPath:
     def get(self):
         return self.fp
 
-    def set(self, fp):
-        with open(FP_CONTAINER, "w") as file:
-            file.write(fp)
+    def set(self, fp, persist: bool = False):
+        """
+        :param fp: The path to the osu! folder
+        :param persist: If this is True, fp is also saved (see save) to be the default of the next sessions
+        """
         self.fp = fp
+        if persist:
+            self.save()
+
+    def save(self):
+        """ Writes the current path to osu_fp.txt, unless it already holds it """
+        with open(FP_CONTAINER, "r+") as file:
+            if file.read() != self.fp:
+                file.seek(0)
+                file.truncate()
+                file.write(self.fp)
 
 
 osu_fp = OsuFolderPath()
 
 
+@lru_cache(maxsize=4096)
 def complete_path(path, root, folder="", ext=None) -> str:
     if ":" not in path:  # Relative import
         path = join(root, folder, path)
     if ext is not None and not path.endswith(ext):
         path += ext
     return path
+
+
+class FileCache:
+    """
+    Process-wide LRU cache of the raw content of files, bounded by the total size of the contents
+    An entry is only used while the modification time and size of its file are unchanged
+    """
+    def __init__(self, max_size: int = 64 << 20):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # path: (mtime_ns, size, data), from the least to the most recently used
+        self.size = 0
+        self.lock = Lock()
+
+    def get(self, path: str, stat: os.stat_result = None) -> Optional[bytes]:
+        """ The cached content of a file, or None if it is not cached (or changed since) """
+        if stat is None:
+            stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                self.entries.move_to_end(path)
+                return entry[2]
+        return None
+
+    def read(self, path: str, store: bool = True) -> bytes:
+        """
+        :param path: The path to the file
+        :param store: If this is False, a file that is not cached is read without being added to the cache
+        """
+        data = self.get(path)
+        if data is not None or not store:
+            return data if data is not None else read_uncached(path)
+
+        with open(path, "rb") as file:
+            data = file.read()
+            stat = os.fstat(file.fileno())  # In case the file changed in the meantime
+        with self.lock:
+            self.discard(path)
+            if len(data) <= self.max_size:
+                self.entries[path] = (stat.st_mtime_ns, stat.st_size, data)
+                self.size += len(data)
+                while self.size > self.max_size:
+                    self.discard(next(iter(self.entries)))
+        return data
+
+    def discard(self, path: str):
+        """ Forgets a file (the lock must be held) """
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+    def invalidate(self, path: str = None):
+        """ Forgets a file, or every file if path is None """
+        with self.lock:
+            if path is None:
+                self.entries.clear()
+                self.size = 0
+            else:
+                self.discard(path)
+
+
+file_cache = FileCache()
+
+
+def read_uncached(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def read_file(path: str, cache: bool = True) -> bytes:
+    """
+    The content of a file, read from the disk only if it is not in file_cache (or changed since)
+    :param path: The path to the file
+    :param cache: If this is False, the file is not added to file_cache when it has to be read from the disk
+    """
+    return file_cache.read(path, store=cache)
+
+
+def open_text_file(path: str, encoding: str = "utf-8") -> TextIO:
+    """
+    Like open(path, "r"), but the content is taken from file_cache, and added to it when the file has to be read
+    Files too big for file_cache are streamed from the disk instead
+    """
+    stat = os.stat(path)
+    data = file_cache.get(path, stat)
+    if data is None:
+        if stat.st_size > file_cache.max_size:
+            return open(path, "r", encoding=encoding)
+        data = file_cache.read(path)
+    return TextIOWrapper(BytesIO(data), encoding=encoding)
+
+
+@contextmanager
+def mapped_file(path: str) -> Iterator[Union[bytes, mmap.mmap]]:
+    """
+    The content of a file: the bytes in file_cache, which are read from the disk and added to it if needed
+    Files too big for file_cache are not read but memory-mapped instead (read-only). The map is closed on exit, unless
+    memoryviews of it are still alive
+    """
+    stat = os.stat(path)
+    data = file_cache.get(path, stat)
+    if data is None:
+        if stat.st_size > file_cache.max_size:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))  # Cheaper than open: no file object needed
+            try:
+                data = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        else:
+            data = file_cache.read(path)
+    try:
+        yield data
+    finally:
+        if isinstance(data, mmap.mmap):
+            try:
+                data.close()
+            except BufferError:  # It is then closed when these memoryviews are garbage collected
+                pass
@@ -1,45 +1,155 @@
-from itertools import zip_longest
-from typing import Tuple
-from math import isclose
-
-class Vector(tuple):
-    def __new__(cls, *args):
-        if len(args) == 1 and not isinstance(args[0], (int, float)):
-            args = args[0]
-        if not all(isinstance(e, (int, float)) for e in args):
-            raise TypeError("Vector can only contain ints or floats")
-        return super().__new__(cls, args)
+from array import array
+from itertools import accumulate
+from typing import Iterable, Iterator, Tuple
+from math import dist, isclose
+
+class Vector:
+    """
+    A 2D point (or vector), with slots instead of a dictionary
+    It can be unpacked, indexed and compared like the (x, y) tuple, and arithmetic with plain tuples works too
+    Like a tuple, it is immutable (so it can be hashed), but it can't be ordered and json can't serialise it
+    """
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y=None):
+        if y is None:  # Vector(point)
+            x, y = x
+        set_x(self, x)
+        set_y(self, y)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"'Vector' object attribute '{name}' is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"'Vector' object attribute '{name}' is read-only")
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
+    def __len__(self) -> int:
+        return 2
+
+    def __getitem__(self, index):
+        return (self.x, self.y)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, Vector):
+            return self.x == other.x and self.y == other.y
+        if isinstance(other, tuple):
+            return (self.x, self.y) == other
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash( (self.x, self.y) )
+
+    def __repr__(self) -> str:
+        return f"Vector({self.x!r}, {self.y!r})"
+
+    def __reduce__(self):
+        return Vector, (self.x, self.y)
 
     def __add__(self, other):
-        if not isinstance(other, tuple):
-            raise TypeError(f"can't add 'Vector' and '{type(other).__name__}'")
-        return Vector( [a+b for a, b in zip_longest(self, other, fillvalue=0)] )
+        if isinstance(other, Vector):
+            return Vector(self.x + other.x, self.y + other.y)
+        if isinstance(other, tuple):
+            return Vector(self.x + other[0], self.y + other[1])
+        raise TypeError(f"can't add 'Vector' and '{type(other).__name__}'")
 
     def __sub__(self, other):
-        if not isinstance(other, tuple):
-            raise TypeError(f"can't subtract 'Vector' by '{type(other).__name__}'")
-        return Vector( [a-b for a, b in zip_longest(self, other, fillvalue=0)] )
+        if isinstance(other, Vector):
+            return Vector(self.x - other.x, self.y - other.y)
+        if isinstance(other, tuple):
+            return Vector(self.x - other[0], self.y - other[1])
+        raise TypeError(f"can't subtract 'Vector' by '{type(other).__name__}'")
 
     def __neg__(self):
-        return Vector( [-a for a in self] )
+        return Vector(-self.x, -self.y)
 
     def __mul__(self, other):
         if not isinstance(other, (int, float)):
             raise TypeError(f"can't multiply 'Vector' by '{type(other).__name__}'")
-        return Vector( [a*other for a in self] )
+        return Vector(self.x * other, self.y * other)
 
     def __truediv__(self, other):
         if not isinstance(other, (int, float)):
             raise TypeError(f"can't divide 'Vector' by '{type(other).__name__}'")
-        return Vector( [a/other for a in self] )
+        return Vector(self.x / other, self.y / other)
 
     def __radd__(self, other): return self + other
-    def __iadd__(self, other): return self + other
     def __rsub__(self, other): return (-self) + other
-    def __isub__(self, other): return self - other
     def __rmul__(self, other): return self * other
-    def __imul__(self, other): return self * other
-    def __itruediv__(self, other): return self / other
+
+
+set_x, set_y = Vector.x.__set__, Vector.y.__set__  # The only way to set the slots, used by Vector.__init__
+
+
+class VectorArray:
+    """
+    A sequence of 2D points stored in two contiguous arrays of floats, for whole paths
+    Indexing and iterating over it gives Vector objects, created on demand
+    """
+    def __init__(self, points: Iterable[Tuple[float, float]] = ()):
+        self.x = array("d")
+        self.y = array("d")
+        self.extend(points)
+
+    @classmethod
+    def from_columns(cls, x: Iterable[float], y: Iterable[float]):
+        points = cls()
+        points.x = array("d", x)
+        points.y = array("d", y)
+        return points
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, index: int) -> Vector:
+        return Vector(self.x[index], self.y[index])
+
+    def __setitem__(self, index: int, point: Tuple[float, float]):
+        if type(self.x) is memoryview:
+            self.make_writable()
+        self.x[index], self.y[index] = point
+
+    def __iter__(self) -> Iterator[Vector]:
+        return map(Vector, self.x, self.y)
+
+    def __repr__(self) -> str:
+        return f"VectorArray(<{len(self)} points>)"
+
+    def make_writable(self):
+        """ Replaces the read-only columns of memory-mapped points (see helpers.binary) by copies """
+        from .binary import writable_array
+        self.x, self.y = writable_array(self.x), writable_array(self.y)
+
+    def append(self, point: Tuple[float, float]):
+        if type(self.x) is memoryview:
+            self.make_writable()
+        x, y = point
+        self.x.append(x)
+        self.y.append(y)
+
+    def extend(self, points: Iterable[Tuple[float, float]]):
+        if type(self.x) is memoryview:
+            self.make_writable()
+        for x, y in points:
+            self.x.append(x)
+            self.y.append(y)
+
+    def shift(self, offset: Tuple[float, float]):
+        """ Adds offset to every point, in place """
+        dx, dy = offset
+        self.x = array("d", (x + dx for x in self.x))
+        self.y = array("d", (y + dy for y in self.y))
+
+    def cumulative_lengths(self) -> array:
+        """ The length of the polyline from the first point up to each point """
+        x, y = self.x, self.y
+        return array("d", accumulate(
+            (dist((x1, y1), (x2, y2)) for x1, y1, x2, y2 in zip(x, y, x[1:], y[1:])),
+            initial=0.0
+        ) if x else ())
 
 
 class CartesianLine:
@@ -1,12 +1,60 @@
+from typing import Tuple
 from .plane_classes import Vector, CartesianLine
 
 def segment_fraction(fraction: float, p1: Vector, p2: Vector) -> Vector:
     return (p2-p1)*fraction + p1
 
 def bezier(fraction: float, p: Vector, *args: Vector) -> Vector:
-    if not args: return p
-    new_points = [ segment_fraction(fraction, p1, p2) for p1, p2 in zip((p, *args), args) ]
-    return bezier(fraction, *new_points)
+    # Iterative de Casteljau algorithm, on plain floats (same operations as chaining segment_fraction)
+    xs = [p[0]] + [point[0] for point in args]
+    ys = [p[1]] + [point[1] for point in args]
+    for _ in args:  # One level of interpolation per extra control point
+        xs = [(x2-x1)*fraction + x1 for x1, x2 in zip(xs, xs[1:])]
+        ys = [(y2-y1)*fraction + y1 for y1, y2 in zip(ys, ys[1:])]
+    return Vector(xs[0], ys[0]) if args else p
+
+
+def subdivide_bezier(points: list[Tuple[float, float]]) -> Tuple[list, list]:
+    """ Splits a bezier curve in two halves, and returns the control points of both """
+    left, right = [points[0]], [points[-1]]
+    while len(points) > 1:
+        points = [((x1+x2) / 2, (y1+y2) / 2) for (x1, y1), (x2, y2) in zip(points, points[1:])]
+        left.append(points[0])
+        right.append(points[-1])
+    right.reverse()
+    return left, right
+
+
+def flatten_bezier(points: list[Vector], tolerance: float = 0.25) -> list[Vector]:
+    """
+    Approximates a bezier curve with line segments, like the osu! client does
+    Control polygons are split in halves until they are flat enough to be within tolerance (in osu!pixels) of the
+    curve, so short or straight curves get few points and long curvy ones get as many as they need
+    """
+    if len(points) <= 2:
+        return list(points)
+    max_deviation = tolerance * tolerance * 4
+    output = []
+    to_flatten = [ [(x, y) for x, y in points] ]
+    while to_flatten:
+        current = to_flatten.pop()
+        if all(
+            (x1 - 2*x2 + x3)**2 + (y1 - 2*y2 + y3)**2 <= max_deviation
+            for (x1, y1), (x2, y2), (x3, y3) in zip(current, current[1:], current[2:])
+        ):  # The curve is flat enough: approximate it with the points of its own subdivision
+            left, right = subdivide_bezier(current)
+            merged = left + right[1:]
+            output.append(current[0])
+            output.extend(
+                (0.25 * (x1 + 2*x2 + x3), 0.25 * (y1 + 2*y2 + y3))
+                for (x1, y1), (x2, y2), (x3, y3) in zip(merged[1::2], merged[2::2], merged[3::2])
+            )
+            continue
+        left, right = subdivide_bezier(current)
+        to_flatten.append(right)  # The stack is last in, first out: the left half is flattened first
+        to_flatten.append(left)
+    output.append(tuple(points[-1]))
+    return [Vector(x, y) for x, y in output]
 
 def angles_are_rotating_clockwise(a1: float, a2: float, a3: float) -> bool:
     return ((a1 > a2) + (a2 > a3) + (a3 > a1)) >= 2
@@ -0,0 +1,42 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from os import cpu_count
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+
+def imap_bounded(func: Callable, items: Iterable, *args, processes: int = None, max_pending: int = None,
+                 ordered: bool = True) -> Iterator[Tuple[Any, Future]]:
+    """
+    Like multiprocessing.Pool.imap, but with backpressure: items are only pulled from the iterable when there is room
+    :param func: The function to call in the worker processes, as func(item, *args). It must be picklable
+    :param items: The items to process. They can come from a lazy iterator
+    :param processes: The number of worker processes. None (default) means one per CPU
+    :param max_pending: The maximum number of items submitted but not yet yielded. None (default) means 4 per process
+    :param ordered: If this is True, results are yielded in the order of items; else as soon as they complete
+    :return: An iterator of (item, future) pairs, with futures that are done (so future.exception() does not block)
+    """
+    processes = processes or cpu_count() or 1
+    max_pending = max_pending or 4 * processes
+    executor = ProcessPoolExecutor(processes)
+    pending = deque()
+    try:
+        for item in items:
+            if len(pending) >= max_pending:
+                yield from pop_done(pending, ordered)
+            pending.append( (item, executor.submit(func, item, *args)) )
+        while pending:
+            yield from pop_done(pending, ordered)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def pop_done(pending: deque, ordered: bool) -> Iterator[Tuple[Any, Future]]:
+    if ordered:  # Wait for the oldest item
+        item, future = pending.popleft()
+        wait([future])
+        yield item, future
+        return
+    done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+    for item, future in [pair for pair in pending if pair[1] in done]:
+        pending.remove( (item, future) )
+        yield item, future
@@ -1,5 +1,7 @@
-from .classes import Replay, ReplayFrame
+from .classes import Replay, ReplayFrame, ReplayFrames
+from .judgement import HitJudgement, ReplayJudgement
 
 __all__ = [
-    'Replay', 'ReplayFrame'
+    'Replay', 'ReplayFrame', 'ReplayFrames',
+    'HitJudgement', 'ReplayJudgement'
 ]
\ No newline at end of file
@@ -3,9 +3,12 @@ To see what each property does, check the osu!wiki: https://osu.ppy.sh/wiki/cs/o
 """
 
 
-from typing import Union
+import lzma
+from array import array
+from itertools import accumulate
+from typing import Iterable, Iterator, Tuple, Union
 from dataclasses import dataclass
-from ..helpers import split_get
+from ..helpers import SplitParser
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -44,6 +47,10 @@ MODS_INDEX_TO_STR = {
     28: "Key2"
 }
 
+LIST_PARSER = SplitParser(",", [[str]], max_len=None)  # No limit: replays have thousands of frames
+LIFE_GRAPH_POINT_PARSER = SplitParser("|", [int, float])
+FRAME_PARSER = SplitParser("|", [int, float, float, int])
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Some functions, meant for use in other modules
 # ----------------------------------------------------------------------------------------------------------------------
@@ -63,6 +70,92 @@ class ReplayFrame:
     action: int
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+# ReplayFrames class. Columnar storage of the frames of a replay: one typed array per ReplayFrame property
+# Its properties use lowerCamelCase
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class ReplayFrames:
+    """
+    Behaves like a list of ReplayFrame, but only holds 4 typed arrays (time, x, y, action)
+    The ReplayFrame objects are created on demand, when the frames are indexed or iterated over
+    """
+    def __init__(self, time: Iterable[int] = (), x: Iterable[float] = (), y: Iterable[float] = (),
+                 action: Iterable[int] = ()):
+        self.time = array("i", time)  # Time since the previous frame, like ReplayFrame.time
+        self.x = array("f", x)
+        self.y = array("f", y)
+        self.action = array("i", action)  # Not uint8: the last frame of a replay stores the RNG seed as its action
+        if not len(self.time) == len(self.x) == len(self.y) == len(self.action):
+            raise ValueError("all columns of ReplayFrames must have the same length")
+
+    @classmethod
+    def from_compressed(cls, data: bytes):
+        """ The LZMA-compressed frames of a .osr file, which are only decompressed when the columns are first used """
+        frames = cls.__new__(cls)
+        frames.compressed = data
+        return frames
+
+    def __getattr__(self, name: str):
+        # Only called for missing attributes, which are the columns while the frames are still compressed
+        if name not in ("time", "x", "y", "action") or "compressed" not in self.__dict__:
+            raise AttributeError(f"'ReplayFrames' object has no attribute '{name}'")
+        decompressed = lzma.decompress(self.__dict__.pop("compressed")).decode("utf-8")
+        self.__dict__.update(ReplayFrames.from_string(decompressed).__dict__)
+        return self.__dict__[name]
+
+    @classmethod
+    def from_string(cls, frames: str):
+        """ Decodes the decompressed frame string of a .osr file (w|x|y|z,w|x|y|z,...) """
+        if frames.endswith(","):
+            frames = frames[:-1]
+        if frames == "":
+            return cls()
+        fields = frames.replace(",", "|").split("|")
+        if len(fields) % 4 != 0:
+            raise ValueError("replay frames must have exactly 4 values")
+        return cls(
+            time=map(int, fields[0::4]),
+            x=map(float, fields[1::4]),
+            y=map(float, fields[2::4]),
+            action=map(int, fields[3::4])
+        )
+
+    def absolute_time(self) -> array:
+        """ The time of each frame since the start of the replay """
+        return array("q", accumulate(self.time))
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return ReplayFrames(self.time[index], self.x[index], self.y[index], self.action[index])
+        return ReplayFrame(self.time[index], self.x[index], self.y[index], self.action[index])
+
+    def __iter__(self) -> Iterator[ReplayFrame]:
+        return map(ReplayFrame, self.time, self.x, self.y, self.action)
+
+    def __repr__(self) -> str:
+        if "compressed" in self.__dict__:
+            return f"ReplayFrames(<{len(self.compressed)} compressed bytes>)"
+        return f"ReplayFrames(<{len(self)} frames>)"
+
+    def make_writable(self):
+        """ Replaces the read-only columns of memory-mapped frames (see helpers.binary) by copies """
+        from ..helpers.binary import writable_array
+        self.time, self.x, self.y, self.action = map(writable_array, (self.time, self.x, self.y, self.action))
+
+    def append(self, frame: ReplayFrame):
+        if type(self.time) is memoryview:
+            self.make_writable()
+        self.time.append(frame.time)
+        self.x.append(frame.x)
+        self.y.append(frame.y)
+        self.action.append(frame.action)
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Main Replay class. This is the object that should be returned by the decompress_replay function
 # Its properties use lowerCamelCase
@@ -86,21 +179,49 @@ class Replay:
     maxCombo: int
     fullCombo: int
     mods: Union[int, list[str]]
-    lifeGraph: Union[str, dict[int, float]]
+    lifeGraph: Union[str, dict[int, float], None]
     time: int
     replayLength: int
-    replay: Union[str, list[ReplayFrame]]
+    replay: Union[str, list[ReplayFrame], ReplayFrames, None]
     scoreID: int
     additionalModInfo: float
 
     @classmethod
-    def from_file(cls, path: str):
+    def from_file(cls, path: str, columnar: bool = False, header_only: bool = False, lazy: bool = False):
         from .reader import read_replay_file
-        return read_replay_file(path)
+        return read_replay_file(path, columnar, header_only, lazy)
 
-    def save(self, path: str):
+    @staticmethod
+    def iter_frames(path: str, batch_size: int = None) -> Iterator[Union[ReplayFrame, list[ReplayFrame]]]:
+        """ Yields the frames of a .osr file while decompressing it; see reader.iter_replay_frames """
+        from .reader import iter_replay_frames
+        return iter_replay_frames(path, batch_size)
+
+    def save(self, path: str, preset: int = 2):
         from .reader import write_replay_file
-        return write_replay_file(self, path)
+        return write_replay_file(self, path, preset)
+
+    @staticmethod
+    def save_many(jobs: Iterable[Tuple["Replay", str]], preset: int = 2, processes: int = None,
+                  max_pending: int = None) -> dict[str, Exception]:
+        """ Writes (replay, path) pairs in a process pool; see reader.write_replay_files """
+        from .reader import write_replay_files
+        return write_replay_files(jobs, preset, processes, max_pending)
+
+    @classmethod
+    def from_binary(cls, path: str, memory_map: bool = False):
+        """ Reads a replay written by save_binary; see helpers.binary.read_binary_file """
+        from ..helpers.binary import read_binary_file
+        return read_binary_file(path, cls, memory_map)
+
+    def save_binary(self, path: str):
+        from ..helpers.binary import write_binary_file
+        write_binary_file(self, path)
+
+    def judge(self, beatmap):
+        """ Judges each hit object of the analysed beatmap from the frames; see judgement.judge_replay """
+        from .judgement import judge_replay
+        return judge_replay(self, beatmap)
 
     def __post_init__(self):
         if isinstance(self.mods, int):
@@ -114,15 +235,15 @@ class Replay:
         elif isinstance(self.lifeGraph, str):
             self.lifeGraph = {
                 time: health
-                for point in split_get(self.lifeGraph[:-1], ",", [[str]])
-                for time, health in [ split_get(point, "|", [int, float]) ]
+                for point in LIST_PARSER(self.lifeGraph[:-1])
+                for time, health in [ LIFE_GRAPH_POINT_PARSER(point) ]
             }
 
         if isinstance(self.replay, str):
             self.replay = [
                 ReplayFrame(time, x, y, action)
-                for frame in split_get(self.replay[:-1], ",", [[str]])
-                for time, x, y, action in [ split_get(frame, "|", [int, float, float, int]) ]
+                for frame in LIST_PARSER(self.replay[:-1])
+                for time, x, y, action in [ FRAME_PARSER(frame) ]
             ]
 
     def add_frame(self, time: int, x: float, y: float, action: int = 0):
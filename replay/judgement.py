@@ -0,0 +1,297 @@
+"""
+Judgement of the hit objects of a beatmap from the cursor and key presses of a replay (osu!standard only)
+The rules follow the osu!stable client closely enough to recompute the accuracy of a play, with these simplifications:
+- Stacks are the ones found by the analysis of the beatmap, without mods (AR changes are ignored)
+- Sliders are tracked from their start: a checkpoint is hit if a key is held and the cursor is in the follow circle
+- Spinners only count the rotations of the cursor around the playfield center while a key is held
+"""
+
+
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from itertools import accumulate
+from math import atan2, floor, pi
+from statistics import fmean, pstdev
+from typing import Callable, Tuple, Union
+from .classes import Replay, ReplayFrame, ReplayFrames
+from ..beatmap.classes import Beatmap, HitObject, Slider, Spinner, Hold
+from ..tools.conversions import od_to_win300, od_to_win100, od_to_win50, cs_to_radius
+from ..tools.constants import PLAYFIELD_CENTER
+from ..helpers import Vector
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Some constants
+# ----------------------------------------------------------------------------------------------------------------------
+
+RNG_SEED_TIME = -12345  # Time of the last frame of a replay, whose action is the RNG seed
+PLAYFIELD_HEIGHT = 384
+FOLLOW_RADIUS_SCALE = 2.4  # Radius of the slider follow circle, in circle radii
+SLIDER_END_LENIENCY = 36  # The end of a slider is checked that many ms early (but never before its middle)
+HIT_RESULTS = (300, 100, 50, 0)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# HitJudgement and ReplayJudgement dataclasses. They are returned by judge_replay
+# Their properties use lowerCamelCase
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@dataclass
+class HitJudgement:
+    hitObject: HitObject
+    result: int  # 300, 100, 50 or 0 (miss)
+    hitTime: int = None  # Time of the press that hit the object (or the head of the slider), None if it was not hit
+    hitError: int = None  # hitTime - hitObject.time
+    ticksHit: int = 0  # Slider ticks
+    tickCount: int = 0
+    repeatsHit: int = 0  # Slider repeats (reverse arrows)
+    repeatCount: int = 0
+    endHit: bool = None  # Slider end
+    rotations: float = None  # Spinners
+    requiredRotations: int = None
+
+
+@dataclass
+class ReplayJudgement:
+    judgements: list[HitJudgement]
+    count300: int = 0
+    count100: int = 0
+    count50: int = 0
+    countMiss: int = 0
+
+    def __post_init__(self):
+        for judgement in self.judgements:
+            if judgement.result == 300: self.count300 += 1
+            elif judgement.result == 100: self.count100 += 1
+            elif judgement.result == 50: self.count50 += 1
+            else: self.countMiss += 1
+
+    def accuracy(self) -> float:
+        total = len(self.judgements)
+        if total == 0:
+            return 1.0
+        return (300*self.count300 + 100*self.count100 + 50*self.count50) / (300*total)
+
+    def hit_errors(self) -> list[int]:
+        """ The hit errors of the circles and slider heads that were hit (negative when early) """
+        return [
+            judgement.hitError for judgement in self.judgements
+            if judgement.hitError is not None
+        ]
+
+    def mean_hit_error(self) -> float:
+        errors = self.hit_errors()
+        return fmean(errors) if errors else 0.0
+
+    def unstable_rate(self) -> float:
+        errors = self.hit_errors()
+        return 10 * pstdev(errors) if errors else 0.0
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Cursor class. Replay frames, with their absolute times, for lookups by time
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class Cursor:
+    """
+    The frames of a replay as columns of absolute times, positions and held keys
+    The cursor state at a time is the one of the last frame before it, found with bisect
+    """
+    def __init__(self, frames: Union[list[ReplayFrame], ReplayFrames], flip: bool = False):
+        if not isinstance(frames, ReplayFrames):
+            frames = ReplayFrames(
+                (frame.time for frame in frames), (frame.x for frame in frames),
+                (frame.y for frame in frames), (frame.action for frame in frames)
+            )
+        count = len(frames)
+        if count and frames.time[-1] == RNG_SEED_TIME:
+            count -= 1
+        # The first frames can go back in time, so the running maximum is kept for bisect
+        self.times = array("q", accumulate(frames.absolute_time()[:count], max))
+        self.x = frames.x[:count]
+        self.y = array("f", (PLAYFIELD_HEIGHT - y for y in frames.y[:count])) if flip else frames.y[:count]
+        self.keys = array("B", (action & 0b1111 for action in frames.action[:count]))  # Without the smoke bit
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def index(self, time: float) -> int:
+        """ Index of the last frame at or before that time (-1 if there is none) """
+        return bisect_right(self.times, time) - 1
+
+    def presses(self) -> list[int]:
+        """
+        Indices of the frames where a key goes down, once per key that goes down
+        K1 and K2 also set the M1 and M2 bits, so they are told apart from the mouse buttons with their own bits
+        """
+        presses = []
+        previous = (0, 0, 0, 0)
+        for i, keys in enumerate(self.keys):
+            k1, k2 = keys & 4, keys & 8
+            current = (k1, k2, keys & 1 and not k1, keys & 2 and not k2)
+            presses.extend(i for was_down, is_down in zip(previous, current) if is_down and not was_down)
+            previous = current
+        return presses
+
+    def tracking(self, times: list[float], positions: list[Vector], radius: float) -> list[bool]:
+        """ For each time, whether a key was held with the cursor less than radius px from the position """
+        index, cursor_x, cursor_y, keys = self.index, self.x, self.y, self.keys
+        squared_radius = radius * radius
+        results = []
+        for time, (x, y) in zip(times, positions):
+            i = index(time)
+            results.append(
+                i >= 0 and keys[i] & 0b11 != 0
+                and (cursor_x[i] - x)**2 + (cursor_y[i] - y)**2 <= squared_radius
+            )
+        return results
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Judgement functions
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def modded_difficulty(beatmap: Beatmap, mods: list[str]) -> Tuple[float, float]:
+    """ The circle size and overall difficulty of the beatmap under the HardRock and Easy mods """
+    circle_size, overall_difficulty = beatmap.Difficulty.CircleSize, beatmap.Difficulty.OverallDifficulty
+    if "HardRock" in mods:
+        circle_size = min(circle_size * 1.3, 10)
+        overall_difficulty = min(overall_difficulty * 1.4, 10)
+    if "Easy" in mods:
+        circle_size /= 2
+        overall_difficulty /= 2
+    return circle_size, overall_difficulty
+
+
+def required_rotations(spinner: Spinner, overall_difficulty: float) -> int:
+    """ The number of full rotations needed for a 300, from the spins per second that the OD requires """
+    if overall_difficulty < 5:
+        spins_per_second = 3 + 0.4 * overall_difficulty
+    else:
+        spins_per_second = 2.5 + 0.5 * overall_difficulty
+    return floor((spinner.endTime - spinner.time) / 1000 * spins_per_second)
+
+
+def judge_spinner(spinner: Spinner, cursor: Cursor, overall_difficulty: float) -> HitJudgement:
+    required = required_rotations(spinner, overall_difficulty)
+    start, end = cursor.index(spinner.time) + 1, cursor.index(spinner.endTime) + 1
+    center_x, center_y = PLAYFIELD_CENTER
+    total_angle = 0.0
+    previous_angle = None
+    for i in range(start, end):
+        if cursor.keys[i] & 0b11 == 0:
+            previous_angle = None
+            continue
+        angle = atan2(cursor.y[i] - center_y, cursor.x[i] - center_x)
+        if previous_angle is not None:
+            delta = angle - previous_angle
+            if delta > pi: delta -= 2*pi
+            elif delta < -pi: delta += 2*pi
+            total_angle += delta
+        previous_angle = angle
+    rotations = abs(total_angle) / (2*pi)
+
+    progress = rotations / required if required > 0 else 1.0
+    result = 300 if progress >= 1 else 100 if progress > 0.9 else 50 if progress > 0.75 else 0
+    return HitJudgement(spinner, result, rotations=rotations, requiredRotations=required)
+
+
+def slider_checkpoints(slider: Slider) -> Tuple[list[float], list[float], float]:
+    """ The times of the ticks of all the slides, of the repeats and of the end check of slider """
+    slide_duration = slider.slideDuration
+    tick_times = []
+    for slide in range(slider.slides):
+        start = slider.time + slide * slide_duration
+        tick_times.extend(
+            start + (tick.time if slide % 2 == 0 else slide_duration - tick.time)
+            for tick in (slider.ticksPos if slide % 2 == 0 else reversed(slider.ticksPos))
+        )
+    repeat_times = [slider.time + slide * slide_duration for slide in range(1, slider.slides)]
+    end_time = max(slider.time + slider.duration / 2, slider.time + slider.duration - SLIDER_END_LENIENCY)
+    return tick_times, repeat_times, end_time
+
+
+def judge_slider_body(judgement: HitJudgement, cursor: Cursor, transform: Callable, follow_radius: float):
+    """ Checks the ticks, repeats and end of the slider of judgement, then sets its final result """
+    slider = judgement.hitObject
+    tick_times, repeat_times, end_time = slider_checkpoints(slider)
+    times = tick_times + repeat_times + [end_time]
+    positions = [transform(slider, position) for position in slider.ball_pos_many(times)]
+    tracked = cursor.tracking(times, positions, follow_radius)
+
+    ticks, repeats = len(tick_times), len(repeat_times)
+    judgement.tickCount, judgement.repeatCount = ticks, repeats
+    judgement.ticksHit = sum(tracked[:ticks])
+    judgement.repeatsHit = sum(tracked[ticks:ticks + repeats])
+    judgement.endHit = tracked[-1]
+
+    hit = judgement.ticksHit + judgement.repeatsHit + judgement.endHit + (judgement.hitTime is not None)
+    total = ticks + repeats + 2  # With the head and the end
+    judgement.result = 300 if hit == total else 100 if 2*hit >= total else 50 if hit > 0 else 0
+
+
+def judge_replay(replay: Replay, beatmap: Beatmap) -> ReplayJudgement:
+    """
+    :param replay: An osu!standard replay
+    :param beatmap: The analysed beatmap the replay was played on (see analyser.analyse_beatmap)
+    :return: The judgement of each hit object, in the order of beatmap.HitObjects
+    Presses and objects are merged in time order: a press can only hit the oldest object that has not been judged yet
+    (later objects are "note locked"), and objects whose 50 window has passed are missed
+    """
+    if replay.gameMode != 0:
+        raise ValueError("Only osu!standard replays can be judged")
+    if isinstance(replay.replay, str) or replay.replay is None:
+        raise ValueError("The replay frames are not loaded")
+
+    circle_size, overall_difficulty = modded_difficulty(beatmap, replay.mods)
+    windows = od_to_win300(overall_difficulty), od_to_win100(overall_difficulty), od_to_win50(overall_difficulty)
+    window50 = windows[2]
+    radius = cs_to_radius(circle_size)
+    squared_radius = radius * radius
+
+    # The positions of the analysis are moved to where the objects are shown with the mods: the CS changes the stack
+    # offsets, and HardRock flips the playfield. The frames of such replays are stored flipped, so the cursor is
+    # flipped back, and the stack offset (always towards the top left of the screen) goes down in the unflipped space
+    flip = "HardRock" in replay.mods
+    nomod_radius = cs_to_radius(beatmap.Difficulty.CircleSize)
+    stack_shift = Vector(nomod_radius - radius, nomod_radius + radius if flip else nomod_radius - radius) / 10
+
+    def transform(obj: HitObject, position: Vector) -> Vector:
+        return position + stack_shift * obj.stack if obj.stack else position
+
+    cursor = Cursor(replay.replay, flip)
+    presses = cursor.presses()
+    press_times = [cursor.times[i] for i in presses]
+
+    judgements = []
+    press = 0
+    for obj in beatmap.HitObjects:
+        if isinstance(obj, Hold):  # osu!mania objects
+            continue
+        if isinstance(obj, Spinner):
+            judgements.append(judge_spinner(obj, cursor, overall_difficulty))
+            continue
+
+        # Presses too early for this object are skipped, and the next ones in its window are used by it, even when they
+        # miss the circle. The first one on the circle hits it
+        judgement = HitJudgement(obj, 0)
+        judgements.append(judgement)
+        press = bisect_left(press_times, obj.time - window50, lo=press)
+        x, y = transform(obj, obj.pos)
+        while press < len(presses) and press_times[press] <= obj.time + window50:
+            i, time = presses[press], press_times[press]
+            press += 1
+            if (cursor.x[i] - x)**2 + (cursor.y[i] - y)**2 <= squared_radius:
+                judgement.hitTime, judgement.hitError = time, time - obj.time
+                judgement.result = next(
+                    result for result, window in zip(HIT_RESULTS, windows) if abs(time - obj.time) <= window
+                )
+                break
+
+        if isinstance(obj, Slider):
+            judge_slider_body(judgement, cursor, transform, FOLLOW_RADIUS_SCALE * radius)
+
+    return ReplayJudgement(judgements)
@@ -1,57 +1,131 @@
 import lzma
 import struct
 import hashlib
-from .classes import Replay, MODS_INDEX_TO_STR
-from ..helpers import osu_fp, complete_path
-
-
-def get_uleb128(offset: int, file_bytes: bytes) -> tuple[int, int]:
-    if file_bytes[offset] > 0x7f:
-        tmp_length, tmp_str_offset = get_uleb128(offset + 1, file_bytes)
-        return (tmp_length << 7) + file_bytes[offset] - 0x80, tmp_str_offset + 1
+from itertools import chain
+from typing import Iterable, Iterator, Tuple, Union
+from .classes import Replay, ReplayFrame, ReplayFrames, MODS_INDEX_TO_STR, FRAME_PARSER
+from ..helpers import osu_fp, complete_path, mapped_file
+from ..helpers.binary import BinaryReader, BinaryWriter
+from ..helpers.pool import imap_bounded
+
+
+# Fixed-size parts of the .osr format, between its variable-length strings
+GAME_MODE_AND_VERSION = struct.Struct("<BI")
+SCORE_DATA = struct.Struct("<6HIHBI")
+TIME_AND_REPLAY_LENGTH = struct.Struct("<QI")
+SCORE_ID = struct.Struct("<Q")
+ADDITIONAL_MOD_INFO = struct.Struct("<d")
+
+
+def read_replay_data(data, columnar: bool = False, header_only: bool = False, lazy: bool = False) -> Replay:
+    """
+    Parses the content of a .osr file in place: the fields are unpacked from data, and the compressed frames are given
+    to the decompressor as a memoryview of data. Nothing that refers to data is kept once this returns
+    :param data: Any bytes-like object (bytes, mmap, ...); see read_replay_file for the other parameters
+    """
+    reader = BinaryReader(data)
+    game_mode, version = reader.read_struct(GAME_MODE_AND_VERSION)
+    beatmap_hash = reader.read_osu_string()
+    player_name = reader.read_osu_string()
+    replay_hash = reader.read_osu_string()
+    score_data = reader.read_struct(SCORE_DATA)
+    life_graph = reader.read_osu_string(skip=header_only)
+    time, replay_length = reader.read_struct(TIME_AND_REPLAY_LENGTH)
+    compressed = reader.read_bytes(replay_length)  # Not copied
+    score_id, = reader.read_struct(SCORE_ID)
+    remaining = len(reader.view) - reader.offset
+    additional_mod_info = reader.read_struct(ADDITIONAL_MOD_INFO)[0] if remaining >= ADDITIONAL_MOD_INFO.size else None
+
+    if header_only:
+        life_graph = replay = None
+    elif lazy:
+        replay = ReplayFrames.from_compressed(bytes(compressed))  # Copied, as it outlives data
     else:
-        return file_bytes[offset], 1
+        replay = lzma.decompress(compressed).decode("utf-8")  # Decompress the replay
+        if columnar:
+            replay = ReplayFrames.from_string(replay)
+    compressed.release()
+    reader.view.release()
+
+    return Replay(
+        game_mode, version, beatmap_hash, player_name, replay_hash, *score_data,
+        life_graph, time, replay_length, replay, score_id, additional_mod_info
+    )
 
 
-def read_replay_file(path: str) -> Replay:
+def read_replay_file(path: str, columnar: bool = False, header_only: bool = False, lazy: bool = False) -> Replay:
+    """
+    :param path: The path to the .osr file. It is read through the file cache, or memory-mapped when it is too big for
+        it (the parts of the file that are skipped are then never read from the disk)
+    :param columnar: If this is True, the frames are decoded into a ReplayFrames object instead of a list of ReplayFrame
+    :param header_only: If this is True, the life graph and the compressed frames are skipped without being read
+        (lifeGraph and replay are None in the returned Replay)
+    :param lazy: If this is True, the frames are only decompressed the first time they are accessed
+        (replay is then always a ReplayFrames object)
+    """
     path = complete_path(path, root=osu_fp.get(), folder="Replays\\", ext=".osr")
-    with open(path, 'rb') as file:
-        file_bytes = file.read()
-
-    # Locate the length of every string beforehand
-    str_formats = []
-    offset = 0
-    for pos in [5, 6, 7, 31]:
-        addr = pos + offset
-        if file_bytes[addr] == 0x00:
-            str_formats.append("x")
-        elif file_bytes[addr] == 0x0b:
-            str_len, size_of_uleb128 = get_uleb128(addr + 1, file_bytes)
-            str_formats.append(f"x{size_of_uleb128}x{str_len}s")
-            offset += size_of_uleb128 + str_len
+    with mapped_file(path) as data:
+        return read_replay_data(data, columnar, header_only, lazy)
+
+
+def decompress_chunks(compressed: memoryview, chunk_size: int) -> Iterator[bytes]:
+    """ Decompresses compressed, without ever holding more than about chunk_size decompressed bytes at once """
+    decompressor = lzma.LZMADecompressor()
+    position = 0
+    while not decompressor.eof:
+        if decompressor.needs_input:
+            chunk = compressed[position:position + chunk_size]
+            position += len(chunk)
+            if not chunk:
+                raise EOFError("Compressed replay data ended before the end-of-stream marker was reached")
         else:
-            raise ValueError
-
-    # Locate the length of the replay beforehand
-    replay_length, = struct.unpack("I", file_bytes[40+offset:44+offset])
-
-    f1, f2, f3, f4 = str_formats
-    replay_data = struct.unpack(
-        f"<BI{f1}{f2}{f3}6HIHBI{f4}QI{replay_length}sQ",
-        file_bytes[:52+offset+replay_length]
-    )
-    additional_mod_info = (
-        struct.unpack("d", value)
-        if len(value := file_bytes[52+offset+replay_length:]) == 8
-        else None
-    )
-
-    replay_data = [
-        data.decode("utf-8") if i in (2, 3, 4, 15) else data
-        for i, data in enumerate(replay_data)
-    ]
-    replay_data[18] = lzma.decompress(replay_data[18]).decode("utf-8")  # Decompress the replay
-    return Replay(*replay_data, additional_mod_info)
+            chunk = b""  # Some decompressed data is still waiting in the decompressor
+        yield decompressor.decompress(chunk, max_length=chunk_size)
+
+
+def iter_replay_frames(path: str, batch_size: int = None,
+                       chunk_size: int = 1 << 16) -> Iterator[Union[ReplayFrame, list[ReplayFrame]]]:
+    """
+    Decompresses and decodes the frames of a replay while reading it, so the memory used does not depend on its length
+    :param path: The path to the .osr file
+    :param batch_size: If this is None (default), the frames are yielded one by one; else in lists of that many frames
+        (the last list can be shorter)
+    :param chunk_size: How many bytes are decompressed at once
+    """
+    path = complete_path(path, root=osu_fp.get(), folder="Replays\\", ext=".osr")
+    with mapped_file(path) as data:
+        # Skip everything up to the compressed frames
+        reader = BinaryReader(data, offset=GAME_MODE_AND_VERSION.size)
+        for _ in range(3):  # beatmapHash, playerName and replayHash
+            reader.read_osu_string(skip=True)
+        reader.offset += SCORE_DATA.size
+        reader.read_osu_string(skip=True)  # lifeGraph
+        _, replay_length = reader.read_struct(TIME_AND_REPLAY_LENGTH)
+        compressed = reader.read_bytes(replay_length)
+
+        batch = []
+        remainder = ""  # The start of a frame that is cut by the end of a chunk
+        for chunk in decompress_chunks(compressed, chunk_size):
+            *frames, remainder = (remainder + chunk.decode("ascii")).split(",")
+            for frame in frames:
+                frame = ReplayFrame(*FRAME_PARSER(frame))
+                if batch_size is None:
+                    yield frame
+                    continue
+                batch.append(frame)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        compressed.release()
+        reader.view.release()
+        if remainder:  # The frame string normally ends with a comma
+            frame = ReplayFrame(*FRAME_PARSER(remainder))
+            if batch_size is None:
+                yield frame
+            else:
+                batch.append(frame)
+        if batch:
+            yield batch
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -68,20 +142,32 @@ LZMA_CONFIG = {
 }
 
 
-def osr_string(string: str) -> bytes:
-    if string == "": return bytes([0x00])
-    # Determine the uleb128 that corresponds to the length of the string
-    str_len = []
-    l = len(string)
-    while l:
-        str_len.append(l % 0x80 + 0x80)
-        l >>= 7
-    str_len[-1] -= 0x80  # The last byte does not exceed 0x80
+def lzma_filters(preset: int = 2) -> list[dict]:
+    """
+    The filters of the LZMA stream of a .osr file. The preset (0 to 9, see the lzma module) only changes the speed and
+    ratio of the compression: the dictionary size and literal settings, that the osu! client expects, are kept
+    """
+    return [LZMA_CONFIG if preset == LZMA_CONFIG["preset"] else {**LZMA_CONFIG, "preset": preset}]
 
-    return bytes([0x0b]) + bytes(str_len) + bytes(string, "utf-8")
+
+def format_frames(frames: Union[list[ReplayFrame], ReplayFrames]) -> bytes:
+    """ The uncompressed frame string of a .osr file (w|x|y|z,w|x|y|z,...) """
+    if isinstance(frames, ReplayFrames):  # One format operation for the whole columns
+        values = tuple(chain.from_iterable(zip(frames.time, frames.x, frames.y, frames.action)))
+        return ("%d|%.7g|%.7g|%d," * len(frames) % values).encode("ascii")
+    return "".join(
+        f"{frame.time}|{frame.x:.7g}|{frame.y:.7g}|{frame.action},"
+        for frame in frames
+    ).encode("ascii")
 
 
-def write_replay_file(replay: Replay, output_path: str = None) -> bytes:
+def write_replay_file(replay: Replay, output_path: str = None, preset: int = 2) -> bytes:
+    """
+    :param replay: The replay to write
+    :param output_path: If this is given, the replay is also written to that file
+    :param preset: The LZMA preset of the frame compression, from 0 (fastest) to 9 (smallest); see lzma_filters
+    :return: The content of the .osr file
+    """
     # Reformat mod list to an integer
     mods = sum(
         1 << i
@@ -90,11 +176,8 @@ def write_replay_file(replay: Replay, output_path: str = None) -> bytes:
     )
 
     # Compress the array early to get its length
-    replay_str = "".join(
-        f"{frame.time}|{frame.x:.7g}|{frame.y:.7g}|{frame.action},"
-        for frame in replay.replay
-    ).encode("ascii")
-    compressed_array = lzma.compress(replay_str, format=lzma.FORMAT_ALONE, filters=[LZMA_CONFIG])
+    replay_str = format_frames(replay.replay)
+    compressed_array = lzma.compress(replay_str, format=lzma.FORMAT_ALONE, filters=lzma_filters(preset))
     replay_hash = hashlib.md5(replay_str).hexdigest() if replay.replayHash is None else replay.replayHash
     replay_length = len(compressed_array)
 
@@ -104,36 +187,25 @@ def write_replay_file(replay: Replay, output_path: str = None) -> bytes:
         for time, health in replay.lifeGraph.items()
     )
 
-    # Encode strings into their .osr format
-    beatmap_hash = osr_string(replay.beatmapHash)
-    player_name = osr_string(replay.playerName)
-    replay_hash = osr_string(replay_hash)
-    life_graph = osr_string(life_graph)
-
-    compressed_replay = struct.pack(
-        f"<BI{len(beatmap_hash)}s{len(player_name)}s{len(replay_hash)}s6HIHBI{len(life_graph)}sQI{replay_length}sQd",
-        replay.gameMode,
-        replay.version,
-        beatmap_hash,
-        player_name,
-        replay_hash,
-        replay.count300,
-        replay.count100,
-        replay.count50,
-        replay.countGeki,
-        replay.countKatu,
-        replay.countMiss,
-        replay.score,
-        replay.maxCombo,
-        replay.fullCombo,
-        mods,
-        life_graph,
-        replay.time,
-        replay_length,
-        compressed_array,
-        replay.scoreID,
-        replay.additionalModInfo if replay.additionalModInfo is not None else 0.0
+    writer = BinaryWriter()
+    writer.write_struct(GAME_MODE_AND_VERSION, replay.gameMode, replay.version)
+    writer.write_osu_string(replay.beatmapHash)
+    writer.write_osu_string(replay.playerName)
+    writer.write_osu_string(replay_hash)
+    writer.write_struct(
+        SCORE_DATA,
+        replay.count300, replay.count100, replay.count50, replay.countGeki, replay.countKatu, replay.countMiss,
+        replay.score, replay.maxCombo, replay.fullCombo, mods
     )
+    writer.write_osu_string(life_graph)
+    writer.write_struct(TIME_AND_REPLAY_LENGTH, replay.time, replay_length)
+    # The compressed frames are copied only once, straight into the result
+    compressed_replay = b"".join((
+        writer.getvalue(),
+        compressed_array,
+        SCORE_ID.pack(replay.scoreID),
+        ADDITIONAL_MOD_INFO.pack(replay.additionalModInfo if replay.additionalModInfo is not None else 0.0)
+    ))
 
     if output_path is not None:
         # Write the return value to a file
@@ -141,3 +213,29 @@ def write_replay_file(replay: Replay, output_path: str = None) -> bytes:
         with open(output_path, 'wb') as output_file:
             output_file.write(compressed_replay)
     return compressed_replay
+
+
+def write_replay_job(job: Tuple[Replay, str], preset: int) -> int:
+    """ Runs in the worker processes """
+    replay, output_path = job
+    return len(write_replay_file(replay, output_path, preset))
+
+
+def write_replay_files(jobs: Iterable[Tuple[Replay, str]], preset: int = 2, processes: int = None,
+                       max_pending: int = None) -> dict[str, Exception]:
+    """
+    Writes many replays at once, compressing them in a process pool
+    :param jobs: (replay, output_path) pairs. They can come from a lazy iterator: only a few replays are held at once
+    :param preset: The LZMA preset, from 0 (fastest) to 9 (smallest); see lzma_filters
+    :param processes: The number of worker processes. None (default) means one per CPU
+    :param max_pending: How many replays can wait for a worker. None (default) means 4 per process
+    :return: The exceptions of the replays that could not be written, by output path (the other ones were written)
+    """
+    errors = {}
+    results = imap_bounded(
+        write_replay_job, jobs, preset, processes=processes, max_pending=max_pending, ordered=False
+    )
+    for (_, output_path), future in results:
+        if future.exception() is not None:
+            errors[output_path] = future.exception()
+    return errors
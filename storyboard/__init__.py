@@ -1,9 +1,11 @@
 from .classes import *
+from .timeline import Timeline, SpriteTimeline, SpriteState
+from .optimiser import OptimisationReport
 
 
 __all__ = [
     'Event', 'Image', 'Video', 'Break', 'BackgroundColor', 'Sprite', 'Sample', 'Animation',
     'BaseCommand', 'Loop', 'Trigger',
     'SpriteCommand', 'Fade', 'Move', 'MoveX', 'MoveY', 'Scale', 'VectorScale', 'Rotate', 'Color', 'Parameter',
-    'StoryBoard'
+    'StoryBoard', 'Timeline', 'SpriteTimeline', 'SpriteState', 'OptimisationReport'
 ]
@@ -177,7 +177,7 @@ class Sample(Event):
             self.layer = EVENT_LAYER_INT_TO_STR[self.layer]
 
     def osu_format(self) -> str:
-        return f"4,{self.time},{self.layer},{self.filepath},{self.volume}"
+        return f"5,{self.time},{self.layer},{self.filepath},{self.volume}"
 
 
 @dataclass
@@ -201,7 +201,7 @@ class Animation(Event):
 
     def osu_format(self) -> str:
         return (
-            f"4,{self.layer},{self.origin},{self.filepath},{self.x},{self.y},"
+            f"6,{self.layer},{self.origin},{self.filepath},{self.x},{self.y},"
             f"{self.frameCount},{self.frameDelay},{self.loopType}"
         )
 
@@ -335,7 +335,7 @@ class Color(SpriteCommand):
                     setattr(self, param, int(val, base=16))
 
     def osu_format(self) -> str:
-        return f"{self.head()},{self.startR},{self.startG},{self.startB},{self.endR},{self.endG}{self.endB}"
+        return f"{self.head()},{self.startR},{self.startG},{self.startB},{self.endR},{self.endG},{self.endB}"
 
 
 @dataclass
@@ -387,5 +387,26 @@ class StoryBoard(list):
         from .reader import read_storyboard_file
         return read_storyboard_file(path)
 
-    def save(self, path: str):
-        raise NotImplementedError
+    def save(self, path: str, extract_variables: bool = False):
+        from .reader import write_storyboard_file
+        return write_storyboard_file(self, path, extract_variables)
+
+    def optimise(self, unroll: bool = False, drop_invisible: bool = True):
+        """ Removes the redundant commands and invisible sprites in place; see optimiser.optimise_storyboard """
+        from .optimiser import optimise_storyboard
+        return optimise_storyboard(self, unroll, drop_invisible)
+
+    def timeline(self):
+        """ The Timeline of the sprites and animations, to get their state at any time; see timeline.Timeline """
+        from .timeline import Timeline
+        return Timeline(self)
+
+    @classmethod
+    def from_binary(cls, path: str, memory_map: bool = False):
+        """ Reads a storyboard written by save_binary; see helpers.binary.read_binary_file """
+        from ..helpers.binary import read_binary_file
+        return read_binary_file(path, cls, memory_map)
+
+    def save_binary(self, path: str):
+        from ..helpers.binary import write_binary_file
+        write_binary_file(self, path)
@@ -0,0 +1,224 @@
+"""
+Optimisation pass over storyboards: loop unrolling, removal and merging of redundant commands, and removal of the
+sprites that are never visible
+The storyboard is changed in place, without changing what it shows (see timeline.Timeline for how it is evaluated)
+"""
+
+
+from copy import copy
+from dataclasses import dataclass
+from typing import Iterable
+from .classes import BaseCommand, SpriteCommand, Loop, Trigger, Parameter, Fade, Scale, VectorScale, Event, StoryBoard
+from .timeline import COMMAND_PROPERTIES, iter_flat_commands, flatten_commands
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# OptimisationReport dataclass. It is returned by optimise_storyboard
+# Its properties use lowerCamelCase
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@dataclass
+class OptimisationReport:
+    commandsBefore: int = 0  # Command lines, loops and triggers included
+    commandsAfter: int = 0
+    loopsUnrolled: int = 0
+    commandsRemoved: int = 0  # Commands that set a property to the value it already had
+    commandsMerged: int = 0  # Commands that were merged into the previous one
+    spritesDropped: int = 0
+
+    def reduction(self) -> float:
+        """ The fraction of the commands that were removed (negative if unrolled loops made the storyboard grow) """
+        if self.commandsBefore == 0:
+            return 0.0
+        return 1 - self.commandsAfter / self.commandsBefore
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Some functions, meant for use in other modules
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def count_commands(commands: Iterable[BaseCommand]) -> int:
+    return sum(
+        1 + count_commands(command.commands) if isinstance(command, (Loop, Trigger)) else 1
+        for command in commands
+    )
+
+
+def command_properties(command: BaseCommand) -> list[str]:
+    if isinstance(command, Parameter):
+        return [f"P{command.parameter}"]
+    return [name for name, _, _ in COMMAND_PROPERTIES.get(type(command), ())]
+
+
+def command_values(command: SpriteCommand) -> list[tuple[float, float]]:
+    """ The (start, end) values of each property changed by the command """
+    return [
+        (float(getattr(command, start)), float(getattr(command, end)))
+        for _, start, end in COMMAND_PROPERTIES[type(command)]
+    ]
+
+
+def is_constant(values: list[tuple[float, float]]) -> bool:
+    return all(start == end for start, end in values)
+
+
+def are_collinear(command1: SpriteCommand, values1: list, command2: SpriteCommand, values2: list) -> bool:
+    """ Whether two linear commands, the second one starting when the first one ends, change at the same rate """
+    duration1, duration2 = command1.endTime - command1.startTime, command2.endTime - command2.startTime
+    if duration1 <= 0 or duration2 <= 0 or command1.easing != 0 or command2.easing != 0:
+        return False
+    return all(
+        end1 == start2 and abs((end1 - start1) * duration2 - (end2 - start2) * duration1) <= 1e-9 * duration1 * duration2
+        for (start1, end1), (start2, end2) in zip(values1, values2)
+    )
+
+
+def mergeable_types(command_lists: list[list[BaseCommand]]) -> list[set[type]]:
+    """
+    For each list of commands of a sprite (the top level, and the body of each loop and trigger), the command types
+    that can be merged there: the ones whose properties are not changed anywhere else in the sprite, even by another
+    type of command (like Move and MoveX), so a merge can't change which command is applied at some time
+    """
+    owners = {}  # Property -> (list index, command type), or None when several lists or types change it
+    for i, commands in enumerate(command_lists):
+        for command in commands:
+            if isinstance(command, (Loop, Trigger, Parameter)):
+                continue
+            for name in command_properties(command):
+                owner = (i, type(command))
+                owners[name] = owner if owners.get(name, owner) == owner else None
+    mergeable = [set() for _ in command_lists]
+    for command_type, properties in COMMAND_PROPERTIES.items():
+        property_owners = {owners[name] for name, _, _ in properties if name in owners}
+        if len(property_owners) == 1 and (owner := property_owners.pop()) is not None and owner[1] is command_type:
+            mergeable[owner[0]].add(command_type)
+    return mergeable
+
+
+def remove_redundant_commands(commands: list[BaseCommand], command_type: type, start_time: float,
+                              end_time: float) -> int:
+    """
+    Removes the constant commands of that type that set their properties to the values they already have
+    The commands that start or end the sprite are kept, because they set its lifetime (start_time to end_time)
+    """
+    previous, previous_values = None, None
+    redundant = set()
+    for command in sorted((command for command in commands if type(command) is command_type), key=lambda c: c.startTime):
+        values = command_values(command)
+        if (
+            previous is not None and is_constant(values)
+            and previous.startTime < command.startTime and previous.endTime <= command.startTime
+            and all(end == value for (_, end), (value, _) in zip(previous_values, values))
+            and start_time < command.startTime and command.endTime < end_time
+        ):
+            redundant.add(id(command))
+            continue
+        previous, previous_values = command, values
+    commands[:] = [command for command in commands if id(command) not in redundant]
+    return len(redundant)
+
+
+def merge_commands(commands: list[BaseCommand], command_type: type) -> int:
+    """
+    Merges the consecutive commands of that type that could be a single one: constant commands with the same values,
+    or linear commands that follow each other at the same rate
+    """
+    merged_into = {}  # id of a removed command -> its replacement
+    current, current_values, first = None, None, None
+    for command in sorted((command for command in commands if type(command) is command_type), key=lambda c: c.startTime):
+        values = command_values(command)
+        if current is not None and current.startTime < command.startTime and (
+            (is_constant(current_values) and current_values == values and current.endTime <= command.startTime) or
+            (current.endTime == command.startTime and are_collinear(current, current_values, command, values))
+        ):
+            if current is first:  # The first command of the run is replaced by a copy, that grows with the run
+                current = copy(current)
+                merged_into[id(first)] = current
+            current.endTime = command.endTime
+            for _, _, end in COMMAND_PROPERTIES[command_type]:
+                setattr(current, end, getattr(command, end))
+            current_values = [(start, end) for (start, _), (_, end) in zip(current_values, values)]
+            merged_into[id(command)] = None
+            continue
+        current, current_values, first = command, values, command
+    commands[:] = [
+        merged_into.get(id(command), command) for command in commands
+        if merged_into.get(id(command), command) is not None
+    ]
+    return sum(1 for replacement in merged_into.values() if replacement is None)
+
+
+def unroll_loops(commands: list[BaseCommand]) -> int:
+    """ Replaces the loops by their commands at absolute times. Triggers are kept after the other commands """
+    loops = sum(1 for command in commands if isinstance(command, Loop))
+    if loops:
+        triggers = [command for command in commands if isinstance(command, Trigger)]
+        commands[:] = flatten_commands(commands) + triggers
+    return loops
+
+
+def is_never_visible(event: Event) -> bool:
+    """
+    Whether the sprite or animation is never shown: it has no commands, or its opacity or scale is always 0
+    Sprites with triggers are kept, because the triggers could show them
+    """
+    if any(isinstance(command, Trigger) for command in event.commands):
+        return False
+    flat = [command for _, command in iter_flat_commands(event.commands)]
+    if not flat:
+        return True
+    fades = [command_values(command) for command in flat if type(command) is Fade]
+    scales = [command_values(command) for command in flat if type(command) is Scale]
+    vector_scales = [command_values(command) for command in flat if type(command) is VectorScale]
+    return (
+        (fades and all(values == [(0, 0)] for values in fades)) or
+        (scales and all(values == [(0, 0)] for values in scales)) or
+        (vector_scales and any(all(values[i] == (0, 0) for values in vector_scales) for i in (0, 1)))  # X or Y
+    )
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Main function
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def optimise_storyboard(storyboard: StoryBoard, unroll: bool = False, drop_invisible: bool = True) -> OptimisationReport:
+    """
+    :param storyboard: The storyboard (or the events of a beatmap) to optimise in place
+    :param unroll: If this is True, the loops are replaced by their commands at absolute times. This makes the
+        storyboard longer, but lets the commands of the loops be merged with the other ones
+    :param drop_invisible: If this is True, the sprites and animations that are never shown are removed
+    :return: What the pass did
+    """
+    report = OptimisationReport()
+    kept = []
+    for event in storyboard:
+        commands = getattr(event, "commands", None)
+        if commands is None:
+            kept.append(event)
+            continue
+        before = count_commands(commands)
+        report.commandsBefore += before
+
+        if drop_invisible and event.type in ("Sprite", "Animation") and is_never_visible(event):
+            report.spritesDropped += 1
+            continue
+        kept.append(event)
+
+        if unroll:
+            report.loopsUnrolled += unroll_loops(commands)
+        lists = [commands] + [command.commands for command in commands if isinstance(command, (Loop, Trigger))]
+        flat = [(offset, command) for offset, command in iter_flat_commands(commands)]
+        start_time = min((offset + command.startTime for offset, command in flat), default=None)
+        end_time = max((offset + command.endTime for offset, command in flat), default=None)
+        for i, (command_list, command_types) in enumerate(zip(lists, mergeable_types(lists))):
+            for command_type in command_types:
+                if i == 0:  # In loops, the first and last commands set the duration of each iteration
+                    report.commandsRemoved += remove_redundant_commands(command_list, command_type, start_time, end_time)
+                report.commandsMerged += merge_commands(command_list, command_type)
+        report.commandsAfter += count_commands(commands)
+
+    storyboard[:] = kept
+    return report
@@ -1,7 +1,10 @@
+from collections import Counter
+from io import StringIO
 from itertools import zip_longest, tee
-from re import findall, match, sub
+from re import compile, escape
+from typing import Iterable, TextIO
 from .classes import StoryBoard, BaseCommand, Loop, Trigger, Parameter, Event, Image, Video, Sprite, Animation
-from ..helpers import split_get, osu_fp, complete_path
+from ..helpers import SplitParser, osu_fp, complete_path, open_text_file, iter_sections
 
 
 EVENT_ARG_COUNTS = {  # {command_name}: ({min_args}, {max_args})
@@ -16,6 +19,15 @@ EVENT_ARG_COUNTS = {  # {command_name}: ({min_args}, {max_args})
         "P":  (1, 1)
     }
 
+COMMAND_PARSER = SplitParser(",", [str, str], max_split=1)
+LOOP_PARSER = SplitParser(",", [int, int])
+TRIGGER_PARSER = SplitParser(",", [str, int, int])
+COMMAND_HEAD_PARSER = SplitParser(",", [int, int, int, str], defaults=[..., ..., None, ...], max_split=3)
+PARAMETERS_PARSER = SplitParser(",", [[str]])
+COMMAND_ARGS_PARSER = SplitParser(",", [[int, str]])
+EVENT_PARSER = SplitParser(",", [[int, str]])
+VARIABLE_LINE = compile(r"([$]\w+)=(.+)")
+
 def grouper(n, iterable, fillvalue=None):  # From https://docs.python.org/3.1/library/itertools.html#recipes
     # grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx
     args = [iter(iterable)] * n
@@ -29,16 +41,14 @@ def pairwise(iterable):  # From https://docs.python.org/3.1/library/itertools.ht
 
 
 def get_commands(command: str) -> list[BaseCommand]:
-    cmd, data_str = split_get(command.replace(" ", "_"), ",", [str, str], max_split=1)
+    cmd, data_str = COMMAND_PARSER(command.replace(" ", "_"))
     indent = cmd.count("_")
     event = cmd.replace("_", " ").strip()
 
-    if event == "L": return [ Loop(indent, event, *split_get(data_str, ",", [int, int])) ]
-    elif event == "T": return [ Trigger(indent, event, *split_get(data_str, ",", [str, int, int])) ]
+    if event == "L": return [ Loop(indent, event, *LOOP_PARSER(data_str)) ]
+    elif event == "T": return [ Trigger(indent, event, *TRIGGER_PARSER(data_str)) ]
 
-    easing, start_time, end_time, params_str = split_get(
-        data_str, ",", [int, int, int, str], defaults=[..., ..., None, ...], max_split=3
-    )
+    easing, start_time, end_time, params_str = COMMAND_HEAD_PARSER(data_str)
     end_time = start_time if end_time is None else end_time
     duration = end_time - start_time
 
@@ -49,12 +59,12 @@ def get_commands(command: str) -> list[BaseCommand]:
             end_time + i*duration,
             p
         )
-        for i, p in enumerate(split_get(params_str, ",", [[str]]))
+        for i, p in enumerate(PARAMETERS_PARSER(params_str))
     ]
 
     min_args, max_args = EVENT_ARG_COUNTS[event]
     params = [
-        group for group in grouper(min_args, split_get(params_str, ",", [[int, str]]), fillvalue=None)
+        group for group in grouper(min_args, COMMAND_ARGS_PARSER(params_str), fillvalue=None)
     ]
     if len(params) < max_args // min_args:  # Test if all the necessary args are there: if not, duplicate the first ones
         params += params.copy()
@@ -75,7 +85,7 @@ def get_commands(command: str) -> list[BaseCommand]:
     ]
 
 
-def get_events(lines: list[str]) -> StoryBoard[Event]:
+def get_events(lines: Iterable[str]) -> StoryBoard[Event]:
     events = StoryBoard()
     for line in lines:
         if line.startswith(" ") or line.startswith("_"):  # Storyboard command
@@ -92,27 +102,119 @@ def get_events(lines: list[str]) -> StoryBoard[Event]:
             target_list.extend(cmd)
         else:
             events.append(
-                Event.from_params(*split_get(line, ",", [[int, str]]))
+                Event.from_params(*EVENT_PARSER(line))
             )
     return events
 
 
-def read_storyboard_file(path: str) -> StoryBoard[Event]:
-    path = complete_path(path, root=osu_fp.get(), folder="Songs\\", ext=".osb")  # Be sure the path is correct
-    with open(path, "r", encoding="utf-8") as file:
-        file_content = file.read()
-
-    sections = {
-        name: [line for line in content.split("\n") if line != "" and not line.startswith("//")]
-        for name, content in findall(r"(?:^|\n)\[(\w+)\]\n((?:[^\[]+|(?<!\n)\[)+)(?=\n\[|$)", file_content)
-    }
-    variables = {
+def read_variables(lines: Iterable[str]) -> dict[str, str]:
+    return {
         name: value
-        for line in sections.get("Variables", [])
-        for name, value in [ match(r"([$]\w+)=(.+)", line).groups() ]
+        for line in lines
+        if (variable := VARIABLE_LINE.match(line)) is not None
+        for name, value in [ variable.groups() ]
     }
 
-    return get_events([
-        sub(r"[$]\w+", lambda m: variables[m.group(0)], line)
-        for line in sections.get("Events", [])
-    ])
+
+def substitute_variables(lines: list[str], variables: dict[str, str]) -> list[str]:
+    """
+    Replaces the variables ($name) in the lines by their values, in a single pass with a regex that matches any of the
+    names (the longest ones first, so $ab is not read as $a followed by b)
+    Lines without "$" are kept as they are, and undefined variables are left in place
+    """
+    if not variables:
+        return lines
+    pattern = compile("(?:" + "|".join(map(escape, sorted(variables, key=len, reverse=True))) + r")\b")
+
+    def replace(variable) -> str:
+        return variables[variable.group(0)]
+
+    sub = pattern.sub
+    return [sub(replace, line) if "$" in line else line for line in lines]
+
+
+def read_storyboard_file(path: str) -> StoryBoard[Event]:
+    path = complete_path(path, root=osu_fp.get(), folder="Songs\\", ext=".osb")  # Be sure the path is correct
+    sections = {"Variables": [], "Events": []}
+    with open_text_file(path) as file:
+        for section, line in iter_sections(file):
+            if section in sections:
+                sections[section].append(line)
+
+    return get_events(substitute_variables(sections["Events"], read_variables(sections["Variables"])))
+
+
+def find_variables(events: Iterable[Event]) -> dict[str, str]:
+    """
+    {value: name} of the variables worth defining: the fields of event lines (like file paths) that are repeated enough
+    for their definition to be shorter than the characters saved
+    """
+    counts = Counter(
+        field
+        for event in events
+        for field in event.osu_format().split(",")[1:]
+        if len(field) > 3 and "$" not in field
+    )
+    variables = {}
+    for value, count in sorted(counts.items(), key=lambda item: (len(item[0]) - 3) * item[1], reverse=True):
+        name = f"$v{len(variables)}"
+        if (len(value) - len(name)) * count <= len(name) + len(value) + 2:  # Saved characters vs definition line
+            break
+        variables[value] = name
+    return variables
+
+
+def write_events(events: Iterable[Event], output: TextIO, variables: dict[str, str] = None):
+    """
+    Writes the lines of the events and their commands (without the section header)
+    The commands are indented by their depth in the loops and triggers, whatever their indentation attribute says
+    :param variables: {value: name} of the variables that replace the fields of the event lines
+    """
+    write = output.write
+    for event in events:
+        line = event.osu_format()
+        if variables:
+            line = ",".join(variables.get(field, field) for field in line.split(","))
+        lines = [line]
+
+        commands = getattr(event, "commands", None)
+        stack = [iter(commands)] if commands else []  # Iterators over the command lists being written
+        while stack:
+            command = next(stack[-1], None)
+            if command is None:
+                stack.pop()
+                continue
+            line = command.osu_format()
+            if command.indentation != len(stack):
+                line = " " * len(stack) + line[command.indentation:]
+            lines.append(line)
+            if isinstance(command, (Loop, Trigger)):
+                stack.append(iter(command.commands))
+
+        lines.append("")
+        write("\n".join(lines))
+
+
+def write_storyboard_file(storyboard: StoryBoard[Event], output_path: str = None, extract_variables: bool = False) -> str:
+    """
+    :param storyboard: The storyboard to write
+    :param output_path: If this is given, the storyboard is also written to that .osb file
+    :param extract_variables: If this is True, the values repeated in the event lines are replaced by variables
+    :return: The content of the .osb file
+    """
+    buffer = StringIO()
+    variables = find_variables(storyboard) if extract_variables else None
+    if variables:
+        buffer.write("[Variables]\n")
+        buffer.writelines(f"{name}={value}\n" for value, name in variables.items())
+        buffer.write("\n")
+    buffer.write("[Events]\n")
+    write_events(storyboard, buffer, variables)
+    storyboard_str = buffer.getvalue()
+
+    if output_path is not None:
+        output_path = complete_path(output_path, root=osu_fp.get(), folder="Songs\\", ext=".osb")
+        with open(output_path, 'w', encoding="utf-8") as output_file:
+            output_file.write(storyboard_str)
+
+    return storyboard_str
@@ -0,0 +1,370 @@
+"""
+Evaluation of storyboards over time: the state (position, opacity, scale...) of each sprite at any time
+Loops are flattened to absolute times. Triggers are skipped, because they depend on the gameplay
+The commands of each sprite are split by property into arrays sorted by start time, which are searched with bisect,
+and the lifetimes of the sprites are kept in an IntervalTree, so a lookup does not scan the whole storyboard
+"""
+
+
+from array import array
+from bisect import bisect_right
+from copy import copy
+from dataclasses import dataclass
+from math import cos, inf, pi, sin, sqrt
+from typing import Callable, Iterable, Iterator, Tuple, Union
+from .classes import (
+    BaseCommand, SpriteCommand, Loop, Trigger, Fade, Move, MoveX, MoveY, Scale, VectorScale, Rotate, Color, Parameter,
+    Event, Sprite, Animation, EVENT_LAYER_INT_TO_STR
+)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Easing functions. They map the progress of a command (from 0 to 1) to the progress of its value
+# See https://osu.ppy.sh/wiki/en/Storyboard/Scripting/Commands for the list
+# ----------------------------------------------------------------------------------------------------------------------
+
+ELASTIC_PERIOD = 2*pi / 0.3
+ELASTIC_PHASE = 0.3 / 4
+BACK_OVERSHOOT = 1.70158
+BACK_OVERSHOOT_IN_OUT = BACK_OVERSHOOT * 1.525
+
+
+def bounce_out(t: float) -> float:
+    if t < 1 / 2.75:
+        return 7.5625 * t * t
+    if t < 2 / 2.75:
+        t -= 1.5 / 2.75
+        return 7.5625 * t * t + 0.75
+    if t < 2.5 / 2.75:
+        t -= 2.25 / 2.75
+        return 7.5625 * t * t + 0.9375
+    t -= 2.625 / 2.75
+    return 7.5625 * t * t + 0.984375
+
+
+EASINGS: list[Callable[[float], float]] = [
+    lambda t: t,  # 0: Linear
+    lambda t: t * (2 - t),  # 1: Easing Out (same as QuadOut)
+    lambda t: t * t,  # 2: Easing In (same as QuadIn)
+    lambda t: t * t,  # 3: QuadIn
+    lambda t: t * (2 - t),  # 4: QuadOut
+    lambda t: 2*t*t if t < 0.5 else (4 - 2*t)*t - 1,  # 5: QuadInOut
+    lambda t: t ** 3,  # 6: CubicIn
+    lambda t: (t - 1) ** 3 + 1,  # 7: CubicOut
+    lambda t: 4 * t**3 if t < 0.5 else 4 * (t - 1)**3 + 1,  # 8: CubicInOut
+    lambda t: t ** 4,  # 9: QuartIn
+    lambda t: 1 - (t - 1) ** 4,  # 10: QuartOut
+    lambda t: 8 * t**4 if t < 0.5 else 1 - 8 * (t - 1)**4,  # 11: QuartInOut
+    lambda t: t ** 5,  # 12: QuintIn
+    lambda t: (t - 1) ** 5 + 1,  # 13: QuintOut
+    lambda t: 16 * t**5 if t < 0.5 else 16 * (t - 1)**5 + 1,  # 14: QuintInOut
+    lambda t: 1 - cos(t * pi/2),  # 15: SineIn
+    lambda t: sin(t * pi/2),  # 16: SineOut
+    lambda t: 0.5 - 0.5 * cos(pi * t),  # 17: SineInOut
+    lambda t: 2 ** (10 * (t - 1)),  # 18: ExpoIn
+    lambda t: 1 - 2 ** (-10 * t),  # 19: ExpoOut
+    lambda t: 0.5 * 2 ** (20*t - 10) if t < 0.5 else 1 - 0.5 * 2 ** (10 - 20*t),  # 20: ExpoInOut
+    lambda t: 1 - sqrt(1 - t*t),  # 21: CircIn
+    lambda t: sqrt(1 - (t - 1)**2),  # 22: CircOut
+    lambda t: 0.5 - 0.5 * sqrt(1 - 4*t*t) if t < 0.5 else 0.5 + 0.5 * sqrt(1 - (2*t - 2)**2),  # 23: CircInOut
+    lambda t: -2 ** (10*t - 10) * sin((1 - ELASTIC_PHASE - t) * ELASTIC_PERIOD),  # 24: ElasticIn
+    lambda t: 2 ** (-10*t) * sin((t - ELASTIC_PHASE) * ELASTIC_PERIOD) + 1,  # 25: ElasticOut
+    lambda t: 2 ** (-10*t) * sin((0.5*t - ELASTIC_PHASE) * ELASTIC_PERIOD) + 1,  # 26: ElasticHalfOut
+    lambda t: 2 ** (-10*t) * sin((0.25*t - ELASTIC_PHASE) * ELASTIC_PERIOD) + 1,  # 27: ElasticQuarterOut
+    lambda t: (  # 28: ElasticInOut
+        -0.5 * 2 ** (20*t - 10) * sin((1 - 1.5*ELASTIC_PHASE - 2*t) * ELASTIC_PERIOD / 1.5) if t < 0.5 else
+        0.5 * 2 ** (10 - 20*t) * sin((2*t - 1 - 1.5*ELASTIC_PHASE) * ELASTIC_PERIOD / 1.5) + 1
+    ),
+    lambda t: t * t * ((BACK_OVERSHOOT + 1) * t - BACK_OVERSHOOT),  # 29: BackIn
+    lambda t: (t - 1)**2 * ((BACK_OVERSHOOT + 1) * (t - 1) + BACK_OVERSHOOT) + 1,  # 30: BackOut
+    lambda t: (  # 31: BackInOut
+        0.5 * (2*t)**2 * ((BACK_OVERSHOOT_IN_OUT + 1) * 2*t - BACK_OVERSHOOT_IN_OUT) if t < 0.5 else
+        0.5 * ((2*t - 2)**2 * ((BACK_OVERSHOOT_IN_OUT + 1) * (2*t - 2) + BACK_OVERSHOOT_IN_OUT) + 2)
+    ),
+    lambda t: 1 - bounce_out(1 - t),  # 32: BounceIn
+    bounce_out,  # 33: BounceOut
+    lambda t: 0.5 - 0.5 * bounce_out(1 - 2*t) if t < 0.5 else 0.5 + 0.5 * bounce_out(2*t - 1),  # 34: BounceInOut
+]
+
+
+def ease(easing: int, t: float) -> float:
+    """ Unknown easings are linear """
+    return EASINGS[easing](t) if 0 <= easing < len(EASINGS) else t
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Loop flattening
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def iter_flat_commands(commands: Iterable[BaseCommand], offset: float = 0) -> Iterator[Tuple[float, SpriteCommand]]:
+    """
+    Yields (offset, command) pairs, where the command happens offset ms later than its own times say
+    The commands of a loop are relative to its start time, and are repeated loopCount times, each iteration lasting
+    from the start of its first command to the end of its last one. Triggers are skipped
+    """
+    for command in commands:
+        if isinstance(command, Loop):
+            inner = list(iter_flat_commands(command.commands))
+            if not inner:
+                continue
+            first = min(shift + cmd.startTime for shift, cmd in inner)
+            last = max(shift + cmd.endTime for shift, cmd in inner)
+            for i in range(max(command.loopCount, 1)):
+                loop_offset = offset + command.startTime + i*(last - first)
+                for shift, cmd in inner:
+                    yield loop_offset + shift, cmd
+        elif not isinstance(command, Trigger):
+            yield offset, command
+
+
+def flatten_commands(commands: Iterable[BaseCommand]) -> list[SpriteCommand]:
+    """ The commands, with the loops replaced by copies of their commands at absolute times (see iter_flat_commands) """
+    flat = []
+    for offset, command in iter_flat_commands(commands):
+        if offset or command.indentation != 1:
+            command = copy(command)
+            command.indentation = 1
+            command.startTime += offset
+            command.endTime += offset
+        flat.append(command)
+    return flat
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# PropertyTrack and ParameterTrack classes. Commands of a sprite that change one of its properties or parameters
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+# The properties changed by each command, with the names of their start and end values in the command
+COMMAND_PROPERTIES: dict[type, list[Tuple[str, str, str]]] = {
+    Fade: [("opacity", "startOpacity", "endOpacity")],
+    Move: [("x", "startX", "endX"), ("y", "startY", "endY")],
+    MoveX: [("x", "startX", "endX")],
+    MoveY: [("y", "startY", "endY")],
+    Scale: [("scale", "startScale", "endScale")],
+    VectorScale: [("scaleX", "startScaleX", "endScaleX"), ("scaleY", "startScaleY", "endScaleY")],
+    Rotate: [("rotation", "startRotate", "endRotate")],
+    Color: [("r", "startR", "endR"), ("g", "startG", "endG"), ("b", "startB", "endB")],
+}
+
+
+class PropertyTrack:
+    """
+    Segments of one property of a sprite, in typed arrays sorted by start time
+    At a time, the value is given by the last segment that has started: it is interpolated while the segment lasts,
+    then stays at its end value. Before the first segment, the value is its start value
+    """
+    __slots__ = ("starts", "ends", "easings", "startValues", "endValues")
+
+    def __init__(self, segments: list[Tuple[float, float, int, float, float]]):
+        segments.sort(key=lambda segment: segment[0])  # Stable: of two segments that start together, the last one wins
+        self.starts = array("d", (segment[0] for segment in segments))
+        self.ends = array("d", (segment[1] for segment in segments))
+        self.easings = array("b", (segment[2] for segment in segments))
+        self.startValues = array("d", (segment[3] for segment in segments))
+        self.endValues = array("d", (segment[4] for segment in segments))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def value(self, time: float) -> float:
+        i = bisect_right(self.starts, time) - 1
+        if i < 0:
+            return self.startValues[0]
+        start, end = self.starts[i], self.ends[i]
+        if time >= end:
+            return self.endValues[i]
+        start_value = self.startValues[i]
+        return start_value + (self.endValues[i] - start_value) * ease(self.easings[i], (time - start) / (end - start))
+
+
+class ParameterTrack:
+    """
+    The times at which a parameter (flip or additive blending) is active, as disjoint intervals sorted in typed arrays
+    Parameters last as long as their command, or forever if it has no duration
+    """
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, intervals: list[Tuple[float, float]]):
+        self.starts = array("d")
+        self.ends = array("d")
+        for start, end in sorted((start, end if end != start else inf) for start, end in intervals):
+            if self.ends and start <= self.ends[-1]:  # Overlaps the previous interval: merge them
+                self.ends[-1] = max(self.ends[-1], end)
+                continue
+            self.starts.append(start)
+            self.ends.append(end)
+
+    def is_active(self, time: float) -> bool:
+        i = bisect_right(self.starts, time) - 1
+        return i >= 0 and time <= self.ends[i]
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# SpriteState dataclass, and SpriteTimeline class. Evaluation of the commands of a sprite
+# Their properties use lowerCamelCase
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@dataclass
+class SpriteState:
+    sprite: Union[Sprite, Animation]
+    x: float
+    y: float
+    opacity: float = 1.0
+    scaleX: float = 1.0  # Product of the Scale and VectorScale commands
+    scaleY: float = 1.0
+    rotation: float = 0.0  # In radians
+    color: Tuple[float, float, float] = (255, 255, 255)
+    flipH: bool = False
+    flipV: bool = False
+    additive: bool = False
+    frame: int = None  # Current frame of animations
+
+    def is_visible(self) -> bool:
+        return self.opacity > 0 and self.scaleX != 0 and self.scaleY != 0
+
+
+class SpriteTimeline:
+    """ The commands of a sprite or an animation, flattened and split into PropertyTracks and ParameterTracks """
+    def __init__(self, sprite: Union[Sprite, Animation]):
+        self.sprite = sprite
+        segments: dict[str, list] = {}
+        parameters: dict[str, list] = {}
+        self.startTime = self.endTime = None
+        for offset, command in iter_flat_commands(sprite.commands):
+            start, end = command.startTime + offset, command.endTime + offset
+            if self.startTime is None or start < self.startTime: self.startTime = start
+            if self.endTime is None or end > self.endTime: self.endTime = end
+            if isinstance(command, Parameter):
+                parameters.setdefault(command.parameter, []).append( (start, end) )
+                continue
+            for name, start_value, end_value in COMMAND_PROPERTIES.get(type(command), ()):
+                segments.setdefault(name, []).append((
+                    start, end, command.easing,
+                    float(getattr(command, start_value)), float(getattr(command, end_value))
+                ))
+        self.tracks = {name: PropertyTrack(property_segments) for name, property_segments in segments.items()}
+        self.parameters = {name: ParameterTrack(intervals) for name, intervals in parameters.items()}
+
+    def value(self, name: str, time: float, default: float) -> float:
+        track = self.tracks.get(name)
+        return default if track is None else track.value(time)
+
+    def parameter_is_active(self, name: str, time: float) -> bool:
+        track = self.parameters.get(name)
+        return track is not None and track.is_active(time)
+
+    def state_at(self, time: float) -> SpriteState:
+        sprite, value = self.sprite, self.value
+        scale = value("scale", time, 1.0)
+        state = SpriteState(
+            sprite=sprite,
+            x=value("x", time, float(sprite.x)),
+            y=value("y", time, float(sprite.y)),
+            opacity=value("opacity", time, 1.0),
+            scaleX=scale * value("scaleX", time, 1.0),
+            scaleY=scale * value("scaleY", time, 1.0),
+            rotation=value("rotation", time, 0.0),
+            color=(value("r", time, 255), value("g", time, 255), value("b", time, 255)),
+        )
+        if self.parameters:
+            state.flipH = self.parameter_is_active("H", time)
+            state.flipV = self.parameter_is_active("V", time)
+            state.additive = self.parameter_is_active("A", time)
+        if isinstance(sprite, Animation) and int(sprite.frameCount) > 0:
+            frame_count, frame_delay = int(sprite.frameCount), float(sprite.frameDelay)
+            frame = int((time - self.startTime) // frame_delay) if frame_delay > 0 else 0
+            state.frame = min(frame, frame_count - 1) if sprite.loopType == "LoopOnce" else frame % frame_count
+        return state
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# IntervalTree class. Static interval tree used to find the sprites that are shown during a time range
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+class IntervalTree:
+    """
+    Intervals sorted by start, seen as an implicit balanced binary search tree (the root of [lo, hi) is its middle)
+    Each node also holds the greatest end of its subtree, so the subtrees that end too early are skipped
+    """
+    def __init__(self, intervals: Iterable[Tuple[float, float]]):
+        intervals = list(intervals)
+        order = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+        self.indices = array("q", order)
+        self.starts = array("d", (intervals[i][0] for i in order))
+        self.ends = array("d", (intervals[i][1] for i in order))
+        self.maxEnds = array("d", self.ends)
+        self.build_max_ends(0, len(order))
+
+    def build_max_ends(self, lo: int, hi: int) -> float:
+        if lo >= hi:
+            return float("-inf")
+        mid = (lo + hi) // 2
+        self.maxEnds[mid] = max(self.ends[mid], self.build_max_ends(lo, mid), self.build_max_ends(mid + 1, hi))
+        return self.maxEnds[mid]
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def overlapping(self, start: float, end: float) -> list[int]:
+        """ The (increasing) indices of the intervals that overlap [start, end] """
+        starts, ends, max_ends = self.starts, self.ends, self.maxEnds
+        found = []
+        stack = [(0, len(self.indices))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if max_ends[mid] < start:  # Everything in this subtree ends before the range
+                continue
+            stack.append( (lo, mid) )
+            if starts[mid] <= end:  # Else, this node and its right subtree start after the range
+                if ends[mid] >= start:
+                    found.append(self.indices[mid])
+                stack.append( (mid + 1, hi) )
+        found.sort()
+        return found
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Main Timeline class
+# ----------------------------------------------------------------------------------------------------------------------
+
+LAYER_ORDER = {layer: i for i, layer in EVENT_LAYER_INT_TO_STR.items()}  # Layers are drawn from Background to Foreground
+
+
+class Timeline:
+    """
+    The sprites and animations of a storyboard, evaluated over time
+    They are kept in drawing order: by layer, then in the order of the storyboard
+    A sprite is active from the start of its first command to the end of its last one; the ones without commands are
+    never shown
+    """
+    def __init__(self, events: Iterable[Event]):
+        self.sprites = [
+            timeline for event in events
+            if isinstance(event, (Sprite, Animation))
+            for timeline in [ SpriteTimeline(event) ]
+            if timeline.startTime is not None
+        ]
+        self.sprites.sort(key=lambda sprite: LAYER_ORDER.get(sprite.sprite.layer, 0))
+        self.lifetimes = IntervalTree((sprite.startTime, sprite.endTime) for sprite in self.sprites)
+
+    def __len__(self) -> int:
+        return len(self.sprites)
+
+    def active_sprites(self, start_time: float, end_time: float = None) -> list[SpriteTimeline]:
+        """ The sprites that are active at some point between start_time and end_time (both included) """
+        end_time = start_time if end_time is None else end_time
+        return [self.sprites[i] for i in self.lifetimes.overlapping(start_time, end_time)]
+
+    def state_at(self, time: float, visible_only: bool = True) -> list[SpriteState]:
+        """ The states of the sprites active at that time, in drawing order """
+        states = [sprite.state_at(time) for sprite in self.active_sprites(time)]
+        if visible_only:
+            return [state for state in states if state.is_visible()]
+        return states
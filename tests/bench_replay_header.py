@@ -0,0 +1,81 @@
+"""
+Benchmark of the decoding of .osr headers, into a Replay without its life graph and frames
+It compares read_replay_data(header_only=True) with the former reader, which located the strings with a recursive
+uleb128 decoder and then unpacked the whole file with a struct format built for each file
+Run it from the folder that contains the package: python -m <package>.tests.bench_replay_header
+"""
+
+
+import struct
+from random import Random
+from timeit import repeat
+from ..replay import Replay, ReplayFrame
+from ..replay.reader import read_replay_data, write_replay_file
+
+
+def get_uleb128(offset: int, file_bytes: bytes) -> tuple[int, int]:  # Former implementation
+    if file_bytes[offset] > 0x7f:
+        tmp_length, tmp_str_offset = get_uleb128(offset + 1, file_bytes)
+        return (tmp_length << 7) + file_bytes[offset] - 0x80, tmp_str_offset + 1
+    else:
+        return file_bytes[offset], 1
+
+
+def read_header_with_struct_format(file_bytes: bytes) -> Replay:  # Former implementation, without the decompression
+    str_formats = []
+    offset = 0
+    for pos in [5, 6, 7, 31]:
+        addr = pos + offset
+        if file_bytes[addr] == 0x00:
+            str_formats.append("x")
+        elif file_bytes[addr] == 0x0b:
+            str_len, size_of_uleb128 = get_uleb128(addr + 1, file_bytes)
+            str_formats.append(f"x{size_of_uleb128}x{str_len}s")
+            offset += size_of_uleb128 + str_len
+        else:
+            raise ValueError
+    replay_length, = struct.unpack("I", file_bytes[40+offset:44+offset])
+    f1, f2, f3, f4 = str_formats
+    replay_data = struct.unpack(
+        f"<BI{f1}{f2}{f3}6HIHBI{f4}QI{replay_length}sQ",
+        file_bytes[:52+offset+replay_length]
+    )
+    replay_data = [
+        data.decode("utf-8") if i in (2, 3, 4, 15) else data
+        for i, data in enumerate(replay_data)
+    ]
+    replay_data[15] = replay_data[18] = None  # Like header_only: no life graph and no frames
+    return Replay(*replay_data, None)
+
+
+def make_replay_file(frame_count: int, seed: int = 0) -> bytes:
+    rng = Random(seed)
+    frames = [ReplayFrame(0, 256, -500, 0), ReplayFrame(-1, 256, -500, 0)]
+    frames += [
+        ReplayFrame(rng.choice([16, 17, 1, 33]), round(rng.uniform(0, 512), 4), round(rng.uniform(0, 384), 3),
+                    rng.choice([0, 1, 5, 10, 15]))
+        for _ in range(frame_count)
+    ]
+    frames.append(ReplayFrame(-12345, 0, 0, 1234567))
+    replay = Replay(0, 20230101, "d41d8cd98f00b204e9800998ecf8427e", "Player", None, 100, 10, 1, 20, 5, 3,
+                    1234567, 300, 0, 8+64, "", 637000000000000000, 0, frames, 987654, None)
+    replay.lifeGraph = {time * 1000: rng.random() for time in range(200)}
+    return write_replay_file(replay, preset=0)
+
+
+def best_time(func, data: bytes, number: int = 300) -> float:
+    """ The best time of one call, in microseconds """
+    return min(repeat(lambda: func(data), number=number, repeat=7)) / number * 1e6
+
+
+def main():
+    print(f"{'frames':>8} {'file size':>10} {'former (us)':>12} {'current (us)':>13}")
+    for frame_count in (2_000, 20_000, 80_000):
+        data = make_replay_file(frame_count)
+        former = best_time(read_header_with_struct_format, data)
+        current = best_time(lambda file_bytes: read_replay_data(file_bytes, header_only=True), data)
+        print(f"{frame_count:>8} {len(data) >> 10:>8} KB {former:>12.1f} {current:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
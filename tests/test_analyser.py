@@ -0,0 +1,157 @@
+from copy import deepcopy
+from math import dist
+from random import Random
+
+import pytest
+
+from .. import Beatmap, HitObjectStore
+from ..beatmap.classes import HitObject, Slider, Spinner, Hold
+from ..beatmap.reader import read_beatmap_file, HIT_OBJECT_PARSER
+from ..beatmap.analyser import analyse_beatmap, find_stacks
+from .test_binary import OSU_FILE
+
+
+@pytest.fixture
+def osu_path(tmp_path):
+    path = tmp_path / "map.osu"
+    path.write_text(OSU_FILE)
+    return str(path)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_columnar_analysis(osu_path, monkeypatch, lazy):
+    beatmap = Beatmap.from_file(osu_path)
+    columnar = read_beatmap_file(osu_path, columnar=True)
+    store = columnar.HitObjects
+    built = []
+    build = HitObjectStore.build
+    monkeypatch.setattr(HitObjectStore, "build", lambda self, index: built.append(index) or build(self, index))
+    analyse_beatmap(columnar, lazy=lazy)
+    assert built == [i for i, obj in enumerate(beatmap.HitObjects) if obj.type == "slider"]
+
+    for i, obj in enumerate(beatmap.HitObjects):
+        row = store[i]
+        assert row is not store[i]  # The rows are built again, not kept
+        assert (row.stack, row.pos, row.comboIndex, row.comboNumber) == \
+               (obj.stack, obj.pos, obj.comboIndex, obj.comboNumber)
+        assert (store.stack[i], store.comboIndex[i], store.comboNumber[i]) == \
+               (obj.stack or 0, obj.comboIndex, obj.comboNumber)
+        if obj.type == "slider":
+            assert store.endTime[i] == obj.end.time and row.end.pos == obj.end.pos
+
+
+def test_rows_are_written_back(osu_path):
+    store = Beatmap.from_file(osu_path, columnar=True).HitObjects
+    obj = store[1]
+    obj.x, obj.stack = 150, 4
+    store[1] = obj
+    assert (store.x[1], store.stack[1]) == (150, 4) and store.lines[1].startswith("150,100,600,")
+
+
+def test_bezier_precision(osu_path):
+    beatmap = Beatmap.from_file(osu_path)
+    fixed, adaptive = read_beatmap_file(osu_path), read_beatmap_file(osu_path)
+    analyse_beatmap(fixed, bezier_precision=50)
+    analyse_beatmap(adaptive, bezier_precision=None)
+    sliders = [
+        objs for objs in zip(beatmap.HitObjects, fixed.HitObjects, adaptive.HitObjects) if objs[0].type == "slider"
+    ]
+    assert any(obj.curveType == "B" for obj, _, _ in sliders)
+    for obj, fixed_obj, adaptive_obj in sliders:
+        assert list(obj.path.points) == list(fixed_obj.path.points)  # 50 points per bezier curve by default
+        for time in range(obj.time, int(obj.end.time), 10):  # The adaptive path is within a pixel of the curve
+            assert dist(obj.ball_pos(time), adaptive_obj.ball_pos(time)) < 1
+
+
+def baseline_find_stacks(hit_objects, stack_leniency_time):
+    """ The quadratic scan that analyse_beatmap used before find_stacks, as a reference """
+    for i in reversed(range(len(hit_objects))):  # We iterate through the hit objects in reversed order
+        current = hit_objects[i]
+        if isinstance(current, (Spinner, Hold)) or current.stack is not None:  # Those are not part of stacks
+            continue
+        current.stack = 0  # This must be a stack base
+        slider_stack = isinstance(current, Slider)  # Stacks ignore sliders is the first object is itself a slider
+        total_stack = 0
+        for j in reversed(range(i)):  # We try to find the first object that might be stacked on top of current
+            obj = hit_objects[j]
+            if isinstance(obj, (Spinner, Hold)): continue
+            if isinstance(obj, Slider):  # Sliders are special because they have an end that could be part of a stack
+                if obj.end.time + stack_leniency_time < current.time:  # Too far in time; the stack stops here
+                    break
+                if dist((current.x, current.y), (obj.end.x, obj.end.y)) < 2.9:
+                    total_stack += 1
+                    current = obj
+                    current.stack = total_stack
+                    if not slider_stack:
+                        # Tail stack: we want the slider to base the base, so we are shifting everything back
+                        current2 = current.end
+                        current.stack = 0  # This slider is now the base of the stack
+                        for k in range(j+1, len(hit_objects)):
+                            obj2 = hit_objects[k]
+                            if isinstance(obj2, (Spinner, Hold)): continue
+                            if current2.time + stack_leniency_time < obj2.time:  # Too far in time; the stack stops here
+                                break
+                            if dist((current.end.x, current.end.y), (obj2.x, obj2.y)) < 2.9:
+                                current2 = obj2
+                                if current2.stack is None: current2.stack = 0
+                                current2.stack -= total_stack
+                        total_stack = 0
+                        slider_stack = True
+                elif dist((current.x, current.y), (obj.x, obj.y)) < 2.9:
+                    if slider_stack: break  # Sliders break the stack if their head is on it
+                    total_stack += 1
+                    current = obj
+                    current.stack = total_stack
+            else:  # obj is a Circle
+                if obj.time + stack_leniency_time < current.time:  # Too far in time; the stack stops here
+                    break
+                if dist((current.x, current.y), (obj.x, obj.y)) < 2.9:
+                    total_stack += 1
+                    current = obj
+                    current.stack = total_stack
+
+
+def random_hit_objects(seed: int, count: int = 300) -> list[HitObject]:
+    """ Objects crowded in a few osu!pixels, so that most of them stack, with slider ends put anywhere near them """
+    rng = Random(seed)
+
+    def near() -> float:
+        return 100 + rng.choice((0, 0, 1, 2, 2.5, 3, 4.5, 6))
+
+    hit_objects = []
+    time = 0
+    for _ in range(count):
+        time += rng.choice((0, 10, 50, 100, 300, 600, 2000))
+        kind = rng.random()
+        if kind < 0.55:
+            line = f"{near()},{near()},{time},1,0,0:0:0:0:"
+        elif kind < 0.9:
+            line = f"{near()},{near()},{time},2,0,L|200:200,1,100"
+        elif kind < 0.95:
+            line = f"256,192,{time},12,0,{time + 500},0:0:0:0:"
+        else:
+            line = f"{near()},192,{time},128,0,{time + 300}:0:0:0:0:"
+        obj = HitObject.from_params(*HIT_OBJECT_PARSER(line))
+        if isinstance(obj, Slider):
+            obj.end.time = obj.time + rng.choice((0, 100, 400, 1000))
+            obj.end.x, obj.end.y = near(), near()
+        hit_objects.append(obj)
+    return hit_objects
+
+
+@pytest.mark.parametrize("order", ["sorted", "unsorted", "shuffled"])
+@pytest.mark.parametrize("seed", range(10))
+def test_find_stacks_matches_the_quadratic_scan(seed, order):
+    hit_objects = random_hit_objects(seed)
+    rng = Random(seed)
+    if order == "unsorted":  # A few objects out of place
+        for i in rng.sample(range(len(hit_objects) - 1), 20):
+            hit_objects[i], hit_objects[i + 1] = hit_objects[i + 1], hit_objects[i]
+    elif order == "shuffled":
+        rng.shuffle(hit_objects)
+    expected = deepcopy(hit_objects)
+    baseline_find_stacks(expected, 490)
+    find_stacks(hit_objects, 490)
+    stacks = [obj.stack for obj in hit_objects]
+    assert stacks == [obj.stack for obj in expected]
+    assert len(set(stacks)) > 3  # The maps have to stack for the test to mean anything
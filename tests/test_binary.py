@@ -0,0 +1,154 @@
+from array import array
+
+import pytest
+
+from .. import Beatmap, Replay, ReplayFrame, ReplayFrames, StoryBoard
+from ..helpers import Vector
+
+
+OSU_FILE = """osu file format v14
+
+[General]
+AudioFilename: audio.mp3
+StackLeniency: 0.7
+Mode: 0
+
+[Metadata]
+Title:Song
+Artist:Artist
+Creator:Mapper
+Version:Hard
+
+[Difficulty]
+HPDrainRate:5
+CircleSize:4
+OverallDifficulty:8
+ApproachRate:9
+SliderMultiplier:1.4
+SliderTickRate:1
+
+[Events]
+0,0,"bg.jpg",0,0
+2,50000,55000
+Sprite,Foreground,Centre,"sb/s0.png",320,240
+ F,0,0,500,0,1
+ M,1,0,800,100,100,200,150
+ L,1000,3
+  R,0,0,200,0,3.14
+
+[TimingPoints]
+0,500,4,2,0,60,1,0
+2000,-50,4,2,0,60,0,0
+
+[HitObjects]
+100,100,500,1,0,0:0:0:0:
+100,100,600,1,0,0:0:0:0:
+200,150,1000,2,0,L|300:150,1,100
+250,200,2000,6,0,B|300:100|350:200|400:150,2,180
+300,300,3000,2,0,P|350:250|400:300,1,120
+256,192,4000,12,0,5000,0:0:0:0:
+""" + "".join(  # Enough sliders for their attributes to be written column by column
+    f"{100 + i * 10},200,{6000 + i * 500},2,0,B|{150 + i * 10}:150|{200 + i * 10}:250,1,140\n" for i in range(20)
+)
+
+
+def same(a, b, path="root", seen=None):
+    """ Asserts that a and b hold the same values. Read-only memoryviews are compared to arrays """
+    if isinstance(a, (array, memoryview)) or isinstance(b, (array, memoryview)):
+        typecodes = [values.typecode if isinstance(values, array) else values.format for values in (a, b)]
+        assert typecodes[0] == typecodes[1] and list(a) == list(b), path
+        return
+    assert type(a) is type(b), f"{path}: {type(a).__name__} != {type(b).__name__}"
+    if isinstance(a, Vector):
+        assert (a.x, a.y) == (b.x, b.y), path
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b), path
+        for i, (item_a, item_b) in enumerate(zip(a, b)):
+            same(item_a, item_b, f"{path}[{i}]", seen)
+    elif isinstance(a, dict):
+        assert list(a) == list(b), path
+        for key in a:
+            same(a[key], b[key], f"{path}[{key!r}]", seen)
+    elif hasattr(a, "__dict__"):
+        seen = set() if seen is None else seen
+        if (id(a), id(b)) in seen:  # Reference cycle (an analysed HitObjectStore refers to its beatmap)
+            return
+        seen.add((id(a), id(b)))
+        assert list(vars(a)) == list(vars(b)), path
+        for name in vars(a):
+            same(vars(a)[name], vars(b)[name], f"{path}.{name}", seen)
+    else:
+        assert a == b or (a != a and b != b), f"{path}: {a!r} != {b!r}"
+
+
+def make_replay() -> Replay:
+    frames = [ReplayFrame(0, 256, -500, 0), ReplayFrame(-1, 256, -500, 0)]
+    frames += [ReplayFrame(16, 100.5 + i, 200.25 - i, i % 4) for i in range(200)]
+    frames.append(ReplayFrame(-12345, 0, 0, 1234567))
+    return Replay(0, 20230101, "d41d8cd98f00b204e9800998ecf8427e", "Player", None, 100, 10, 1, 20, 5, 3,
+                  1234567, 300, 0, 8+64, "", 637000000000000000, 0, frames, 987654, None)
+
+
+@pytest.fixture
+def osu_path(tmp_path):
+    path = tmp_path / "map.osu"
+    path.write_text(OSU_FILE)
+    return str(path)
+
+
+@pytest.fixture
+def osr_path(tmp_path):
+    path = tmp_path / "replay.osr"
+    make_replay().save(str(path))
+    return str(path)
+
+
+@pytest.mark.parametrize("memory_map", [False, True])
+@pytest.mark.parametrize("columnar", [False, True])
+def test_beatmap_round_trip(tmp_path, osu_path, memory_map, columnar):
+    beatmap = Beatmap.from_file(osu_path, columnar=columnar)
+    assert all(obj.path is not None for obj in beatmap.HitObjects if obj.type == "slider")
+    beatmap.save_binary(str(tmp_path / "map.ospy"))
+    loaded = Beatmap.from_binary(str(tmp_path / "map.ospy"), memory_map)
+    same(beatmap, loaded)
+    for obj, loaded_obj in zip(beatmap.HitObjects, loaded.HitObjects):
+        if obj.type == "slider":
+            assert loaded_obj.ball_pos(obj.time + 50) == obj.ball_pos(obj.time + 50)
+
+
+@pytest.mark.parametrize("memory_map", [False, True])
+@pytest.mark.parametrize("columnar", [False, True])
+def test_replay_round_trip(tmp_path, osr_path, memory_map, columnar):
+    replay = Replay.from_file(osr_path, columnar=columnar)
+    assert isinstance(replay.replay, ReplayFrames) == columnar
+    replay.save_binary(str(tmp_path / "replay.ospy"))
+    same(replay, Replay.from_binary(str(tmp_path / "replay.ospy"), memory_map))
+
+
+@pytest.mark.parametrize("memory_map", [False, True])
+def test_storyboard_round_trip(tmp_path, osu_path, memory_map):
+    storyboard = Beatmap.from_file(osu_path).Events
+    assert isinstance(storyboard, StoryBoard) and len(storyboard) == 3
+    storyboard.save_binary(str(tmp_path / "events.ospy"))
+    same(storyboard, StoryBoard.from_binary(str(tmp_path / "events.ospy"), memory_map))
+
+
+def test_memory_mapped_objects_are_copied_on_write(tmp_path, osu_path, osr_path):
+    replay = Replay.from_file(osr_path, columnar=True)
+    replay.save_binary(str(tmp_path / "replay.ospy"))
+    loaded = Replay.from_binary(str(tmp_path / "replay.ospy"), memory_map=True)
+    assert isinstance(loaded.replay.time, memoryview)
+    loaded.add_frame(16, 10, 20, 1)
+    assert len(loaded.replay) == len(replay.replay) + 1 and loaded.replay[-1] == ReplayFrame(16, 10, 20, 1)
+
+    beatmap = Beatmap.from_file(osu_path, columnar=True)
+    beatmap.save_binary(str(tmp_path / "map.ospy"))
+    loaded = Beatmap.from_binary(str(tmp_path / "map.ospy"), memory_map=True)
+    assert isinstance(loaded.HitObjects.stack, memoryview)
+    obj = loaded.HitObjects[0]
+    obj.stack = 3
+    loaded.HitObjects[0] = obj
+    assert loaded.HitObjects.stack[0] == 3
+    slider = next(obj for obj in loaded.HitObjects if obj.type == "slider")
+    slider.path.points.append((0.0, 0.0))
+    assert slider.path.points[-1] == (0.0, 0.0)
@@ -0,0 +1,67 @@
+import os
+import pickle
+
+import pytest
+
+from .. import Beatmap
+from ..beatmap.cache import BeatmapCache, ENTRY_EXT
+from ..helpers.binary import to_binary, from_binary, class_from_name
+from .test_binary import OSU_FILE, same
+
+
+@pytest.fixture
+def osu_path(tmp_path):
+    path = tmp_path / "map.osu"
+    path.write_text(OSU_FILE)
+    return str(path)
+
+
+def entries(cache: BeatmapCache) -> list[str]:
+    return [entry.path for entry in os.scandir(cache.directory) if entry.name.endswith(ENTRY_EXT)]
+
+
+def test_entries_round_trip(tmp_path, osu_path):
+    cache = BeatmapCache(str(tmp_path / "cache"))
+    beatmap = cache.load(osu_path)
+    entry, = entries(cache)
+    assert isinstance(from_binary(open(entry, "rb").read()), Beatmap)
+    same(beatmap, cache.load(osu_path))
+    same(beatmap, Beatmap.from_file(osu_path, cache=cache))
+
+
+class Payload:
+    def __reduce__(self):
+        return os.remove, (self.path,)
+
+
+@pytest.mark.parametrize("content", ["garbage", "truncated", "pickle", "foreign class"])
+def test_broken_entries_are_misses(tmp_path, osu_path, content):
+    cache = BeatmapCache(str(tmp_path / "cache"))
+    beatmap = cache.load(osu_path)
+    entry, = entries(cache)
+    data = open(entry, "rb").read()
+    if content == "garbage":
+        data = b"not a beatmap"
+    elif content == "truncated":
+        data = data[:len(data) // 2]
+    elif content == "pickle":  # Unpickling it would delete a file
+        payload = Payload()
+        payload.path = osu_path
+        data = pickle.dumps(payload)
+    else:  # A class imported by a module of the package, instead of one of its own classes
+        data = to_binary(beatmap).replace(b"\x17beatmap.classes:Beatmap", b"\x15beatmap.classes:array")
+    with open(entry, "wb") as file:
+        file.write(data)
+
+    assert cache.get(os.path.basename(entry).split("_")[0]) is None
+    assert entries(cache) == [] and os.path.exists(osu_path)
+    same(beatmap, cache.load(osu_path))
+
+
+@pytest.mark.parametrize("name", [
+    "beatmap.classes:array", "beatmap.classes:hashlib_md5", "os:system", "nothing:Beatmap"
+])
+def test_only_classes_of_the_package_are_decoded(name):
+    assert class_from_name("beatmap.classes:Beatmap") is Beatmap
+    with pytest.raises(ValueError):
+        class_from_name(name)
@@ -0,0 +1,107 @@
+import pytest
+
+from .. import Beatmap, Replay, ReplayFrame
+
+OSU_FILE = """osu file format v14
+
+[General]
+AudioFilename: audio.mp3
+StackLeniency: 0.7
+Mode: 0
+
+[Difficulty]
+HPDrainRate:5
+CircleSize:4
+OverallDifficulty:5
+ApproachRate:9
+SliderMultiplier:1.4
+SliderTickRate:1
+
+[TimingPoints]
+0,500,4,2,0,60,1,0
+
+[HitObjects]
+"""
+# OverallDifficulty 5: the 300, 100 and 50 windows are 100, 200 and 300 ms. CircleSize 4: the radius is 36.5 px
+K1 = 0b101  # K1 also sets M1
+
+
+def make_beatmap(tmp_path, *lines: str) -> Beatmap:
+    path = tmp_path / "map.osu"
+    path.write_text(OSU_FILE + "\n".join(lines) + "\n")
+    return Beatmap.from_file(str(path))
+
+
+def make_replay(mods: int = 0) -> Replay:
+    return Replay(0, 20230101, "", "Player", None, 0, 0, 0, 0, 0, 0, 0, 0, 0, mods, "", 0, 0, [], 0, None)
+
+
+def add_frames(replay: Replay, frames: list[tuple]):
+    """ Adds frames given with absolute times (add_frame takes the time since the previous frame) """
+    previous = sum(frame.time for frame in replay.replay)
+    for time, x, y, keys in frames:
+        replay.add_frame(time - previous, x, y, keys)
+        previous = time
+
+
+def tap(time: int, x: float, y: float) -> list[tuple]:
+    return [(time - 20, x, y, 0), (time, x, y, K1), (time + 50, x, y, 0)]
+
+
+def test_hit_windows(tmp_path):
+    beatmap = make_beatmap(
+        tmp_path,
+        "100,100,1000,1,0,0:0:0:0:", "200,100,2000,1,0,0:0:0:0:", "300,100,3000,1,0,0:0:0:0:",
+        "400,100,4000,1,0,0:0:0:0:", "400,300,5000,1,0,0:0:0:0:"
+    )
+    replay = make_replay()
+    add_frames(replay, tap(1000 - 30, 100, 100) + tap(2000 + 150, 200, 100) + tap(3000 - 250, 300, 100))
+    add_frames(replay, tap(4000 - 350, 400, 100) + tap(5000, 400, 340))  # Too early, then off the circle
+    judgement = replay.judge(beatmap)
+    assert [hit.result for hit in judgement.judgements] == [300, 100, 50, 0, 0]
+    assert judgement.hit_errors() == [-30, 150, -250]
+    assert (judgement.count300, judgement.count100, judgement.count50, judgement.countMiss) == (1, 1, 1, 2)
+
+
+def test_note_lock(tmp_path):
+    beatmap = make_beatmap(tmp_path, "100,300,6000,1,0,0:0:0:0:", "300,300,6100,1,0,0:0:0:0:")
+    replay = make_replay()
+    add_frames(replay, tap(6050, 300, 300))  # On the second circle, while the first one can still be hit
+    assert [hit.result for hit in replay.judge(beatmap).judgements] == [0, 0]
+
+    add_frames(replay, tap(6200, 300, 300))  # Still taken by the first circle
+    assert [hit.result for hit in replay.judge(beatmap).judgements] == [0, 0]
+
+    add_frames(replay, tap(6350, 300, 300))  # Once the first circle is missed, the second one can be hit
+    assert [hit.result for hit in replay.judge(beatmap).judgements] == [0, 50]
+
+
+@pytest.mark.parametrize("mods", [0, 1 << 4])  # No mod, HardRock
+def test_hard_rock_flip(tmp_path, mods):
+    beatmap = make_beatmap(tmp_path, "100,100,1000,1,0,0:0:0:0:")
+    replay = make_replay(mods)
+    add_frames(replay, tap(1000, 100, 100))  # add_frame flips the frames of HardRock replays
+    assert replay.judge(beatmap).judgements[0].result == 300
+
+    if mods:  # Unflipped frames are at the other end of the playfield
+        replay.replay = [ReplayFrame(frame.time, frame.x, 384 - frame.y, frame.action) for frame in replay.replay]
+        assert replay.judge(beatmap).judgements[0].result == 0
+
+
+def follow(start: int, end: int, keys: int) -> list[tuple]:
+    """ Frames following the slider of test_slider_break from start to end (ms since its start) """
+    return [(8000 + t, 100 + 300 * t / 1071.43, 200, keys) for t in range(start, end, 16)]
+
+
+def test_slider_break(tmp_path):
+    # 300 px at 140 px per beat: the slide lasts 1071 ms, with a tick at 500 ms
+    beatmap = make_beatmap(tmp_path, "100,200,8000,2,0,L|400:200,1,300")
+    replay = make_replay()
+    add_frames(replay, [(7980, 100, 200, 0)] + follow(0, 1120, K1))
+    hit, = replay.judge(beatmap).judgements
+    assert (hit.result, hit.ticksHit, hit.tickCount, hit.endHit) == (300, 1, 1, True)
+
+    replay = make_replay()
+    add_frames(replay, [(7980, 100, 200, 0)] + follow(0, 300, K1) + follow(300, 1120, 0))  # Released after 300 ms
+    hit, = replay.judge(beatmap).judgements
+    assert (hit.result, hit.hitError, hit.ticksHit, hit.endHit) == (50, 0, 0, False)
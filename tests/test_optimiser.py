@@ -0,0 +1,124 @@
+from random import Random
+
+import pytest
+
+from ..storyboard.reader import get_events
+from ..storyboard.timeline import iter_flat_commands
+from .test_timeline import random_command
+
+SPRITE = 'Sprite,Foreground,Centre,"sb/s.png",320,240'
+
+
+def snapshot(storyboard, times: list[float]) -> list[list[tuple]]:
+    """ The visible states of the sprites at each time, rounded so that merged commands give the same values """
+    timeline = storyboard.timeline()
+    return [
+        [
+            (id(state.sprite), *(round(value, 6) for value in (
+                state.x, state.y, state.opacity, state.scaleX, state.scaleY, state.rotation, *state.color
+            )), state.flipH, state.flipV, state.additive, state.frame)
+            for state in timeline.state_at(time)
+        ]
+        for time in times
+    ]
+
+
+def sample_times(storyboard, rng: Random) -> list[float]:
+    """ Random times, and the times around the start and end of every command """
+    times = [rng.uniform(-500, 15000) for _ in range(300)]
+    for event in storyboard:
+        for offset, command in iter_flat_commands(event.commands):
+            for time in (offset + command.startTime, offset + command.endTime):
+                times += [time - 1, time, time + 1]
+    return times
+
+
+def command_lines(storyboard) -> list[str]:
+    return [command.osu_format() for event in storyboard for command in event.commands]
+
+
+def test_merge():
+    storyboard = get_events([
+        SPRITE,
+        " M,0,0,100,0,0,100,100", " M,0,100,300,100,100,300,300",  # Same rate
+        " F,0,0,100,1,1", " F,0,200,300,1,1",  # Same constant value
+        " R,0,0,100,0,1", " R,0,100,200,1,1.5",  # Different rates
+    ])
+    times = sample_times(storyboard, Random(0))
+    before = snapshot(storyboard, times)
+    report = storyboard.optimise()
+    assert command_lines(storyboard) == [
+        " M,0,0,300,0,0,300,300", " F,0,0,300,1,1", " R,0,0,100,0,1", " R,0,100,200,1,1.5"
+    ]
+    assert report.commandsMerged == 2 and (report.commandsBefore, report.commandsAfter) == (6, 4)
+    assert snapshot(storyboard, times) == before
+
+
+def test_redundant_commands():
+    storyboard = get_events([
+        SPRITE,
+        " F,0,0,100,0,1",
+        " F,0,500,,1",  # Sets the opacity it already has
+        " F,0,1000,1100,1,0",
+        " F,0,1200,1400,0,1",
+        " F,0,1300,,1",  # Sets the end value of the previous command before that one ends
+        " S,0,2000,,2",  # Ends the lifetime of the sprite, so it is kept
+    ])
+    times = sample_times(storyboard, Random(0))
+    before = snapshot(storyboard, times)
+    report = storyboard.optimise()
+    assert command_lines(storyboard) == [
+        " F,0,0,100,0,1", " F,0,1000,1100,1,0", " F,0,1200,1400,0,1", " F,0,1300,1300,1,1", " S,0,2000,2000,2,2"
+    ]
+    assert report.commandsRemoved == 1
+    assert snapshot(storyboard, times) == before
+
+
+def test_sprite_dropping():
+    storyboard = get_events([
+        SPRITE, " F,0,0,1000,0,1",  # Shown
+        SPRITE,  # No commands
+        SPRITE, " F,0,0,1000,0,0", " M,0,0,1000,0,0,100,100",  # Transparent
+        SPRITE, " L,0,2", "  S,0,0,100,0,0",  # Scaled to 0 in a loop
+        SPRITE, " V,0,0,1000,0,1,0,2",  # No width
+        SPRITE, " F,0,0,1000,0,0", " T,HitSoundClap,0,1000", "  F,0,0,100,1,1",  # Shown by its trigger
+    ])
+    shown, *_, triggered = storyboard
+    assert storyboard.optimise(drop_invisible=False).spritesDropped == 0 and len(storyboard) == 6
+    report = storyboard.optimise()
+    assert list(storyboard) == [shown, triggered] and report.spritesDropped == 4
+
+
+def random_storyboard(rng: Random) -> list[str]:
+    """ Sprites with runs of commands that can be merged or removed, mixed with random commands and loops """
+    lines = []
+    for i in range(20):
+        lines.append(f'Sprite,{rng.choice(("Background", "Foreground"))},Centre,"sb/s{i}.png",320,240')
+        for command, size in rng.sample([("F", 1), ("M", 2), ("MX", 1), ("S", 1), ("V", 2), ("R", 1), ("C", 3)], 3):
+            time = rng.randrange(0, 5000, 100)
+            values = [rng.randrange(0, 3) for _ in range(size)]
+            rates = [rng.choice((0, 0, 1, -1)) for _ in range(size)]
+            for _ in range(rng.randrange(1, 6)):
+                duration = rng.choice((0, 100, 200))
+                ends = [value + rate * duration // 100 for value, rate in zip(values, rates)]
+                lines.append(f" {command},0,{time},{time + duration}," + ",".join(map(str, values + ends)))
+                time += duration + rng.choice((0, 0, 100))
+                values = ends
+        for _ in range(rng.randrange(3)):
+            lines.append(random_command(rng, " ", 8000))
+        if rng.random() < 0.3:
+            lines.append(f" L,{rng.randrange(8000)},{rng.randrange(1, 4)}")
+            lines.extend(random_command(rng, "  ", 500) for _ in range(rng.randrange(1, 3)))
+    return lines
+
+
+@pytest.mark.parametrize("unroll", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_random_storyboards_are_shown_the_same(seed, unroll):
+    rng = Random(seed)
+    storyboard = get_events(random_storyboard(rng))
+    times = sample_times(storyboard, rng)
+    before = snapshot(storyboard, times)
+    report = storyboard.optimise(unroll=unroll)
+    assert report.commandsRemoved + report.commandsMerged > 0
+    assert snapshot(storyboard, times) == before
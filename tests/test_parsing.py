@@ -0,0 +1,70 @@
+import pytest
+
+from ..helpers.parsing import MAX_LAYOUTS, SplitParser, split_get
+
+
+def typed(values) -> list:
+    """ The values with their types, so 1 and 1.0 or 1 and True are told apart """
+    return [(type(value), value) for value in values]
+
+
+def parse_both(s: str, sep: str, obj_funcs: list, defaults: list = None, **kwargs):
+    """ The results of split_get and of a SplitParser, or the types of the exceptions they raised """
+    results = []
+    for parse in (
+        lambda: split_get(s, sep, list(obj_funcs), None if defaults is None else list(defaults), **kwargs),
+        lambda: SplitParser(sep, obj_funcs, defaults, **kwargs)(s)
+    ):
+        try:
+            results.append(typed(parse()))
+        except Exception as e:
+            results.append(type(e))
+    return results
+
+
+CASES = [
+    # Starred layouts
+    ("1,2,3,4", ",", [[int]], None, {}),
+    ("", ",", [[int]], None, {}),
+    ("1, 2.5 ,x", ",", [[int, float, str]], None, {}),
+    ("1,2,3,x", ",", [[int]], None, {}),
+    ("a|1|2|3", "|", [str, [int]], None, {}),
+    ("a|1|2|3|b", "|", [str, [int], str], None, {}),
+    ("a|b", "|", [str, [int], str], None, {}),
+    ("1,2,3", ",", [[int]], [9, 9], {}),
+    (",".join(map(str, range(150))), ",", [[int]], None, {}),
+    (",".join(map(str, range(150))), ",", [[int]], None, {"max_len": None}),
+    # Tuples of functions
+    ("Mode: 1", ":", [str, (int, float, str)], None, {}),
+    ("StackLeniency: 0.7", ":", [str, (int, float, str)], None, {}),
+    ("Title: a:b", ":", [str, (int, float, str)], None, {"max_split": 1}),
+    ("x,y", ",", [(int, float), (int, float)], [0, ...], {}),
+    # Padded results
+    ("1:2", ":", [int, int, int, int, str], [0, 0, 0, 0, ""], {"min_len": 5}),
+    ("", ":", [int, int, int, int, str], [0, 0, 0, 0, ""], {"min_len": 5}),
+    ("1:2:3:4:5:file.wav", ":", [int, int, int, int, int, str], [0, 0, 0, 0, 0, ""], {"min_len": 6}),
+    ("1:2", ":", [int, int, int], [7, 8, 9], {"min_len": 5}),
+    ("1:2:3:4", ":", [int, int], None, {"min_len": 8, "max_len": 3}),
+    # Fallbacks to the defaults, to str and to exceptions
+    ("a:2", ":", [int, int], [5, ...], {}),
+    ("a:b", ":", [int, int], [5, ...], {}),
+    ("1:2:three:4", ":", [int, int], None, {}),
+    ("1, 2 ,3", ",", [int, int, int], None, {"no_strip": True}),
+    ("0,0,\"bg.jpg\",0,0", ",", [[int, str]], None, {}),
+    ("F,0,0,500,0,1", ",", [int, int, int, str], [..., ..., None, ...], {"max_split": 3}),
+    ("F,0,,500,0,1", ",", [str, int, int, str], [..., ..., None, ...], {"max_split": 3}),
+]
+
+
+@pytest.mark.parametrize("s, sep, obj_funcs, defaults, kwargs", CASES)
+def test_split_parser_matches_split_get(s, sep, obj_funcs, defaults, kwargs):
+    expected, result = parse_both(s, sep, obj_funcs, defaults, **kwargs)
+    assert result == expected
+
+
+def test_layouts_are_reused_and_bounded():
+    parser = SplitParser(",", [str, [int], str], [..., 0])
+    for length in list(range(1, MAX_LAYOUTS * 2)) * 2:
+        s = ",".join(["a"] + ["1"] * length + ["z"])
+        assert typed(parser(s)) == typed(split_get(s, ",", [str, [int], str], [..., 0]))
+    assert len(parser.layouts) == MAX_LAYOUTS
@@ -0,0 +1,71 @@
+import pytest
+
+from ..helpers import paths
+from ..helpers.paths import FileCache, osu_fp, open_text_file, mapped_file
+
+
+@pytest.fixture
+def file_cache(monkeypatch):
+    cache = FileCache(max_size=1 << 10)
+    monkeypatch.setattr(paths, "file_cache", cache)
+    return cache
+
+
+def forbid_disk_reads(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("The file was read from the disk")
+    monkeypatch.setattr(paths, "open", fail, raising=False)
+    monkeypatch.setattr(paths.os, "open", fail)
+
+
+def test_text_file_is_read_once(tmp_path, monkeypatch, file_cache):
+    path = str(tmp_path / "map.osu")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("osu file format v14\n")
+    with open_text_file(path) as file:
+        assert file.read() == "osu file format v14\n"
+    assert file_cache.size == 20
+
+    forbid_disk_reads(monkeypatch)
+    with open_text_file(path) as file:
+        assert file.read() == "osu file format v14\n"
+
+
+def test_mapped_file_is_read_once(tmp_path, monkeypatch, file_cache):
+    path = tmp_path / "replay.osr"
+    path.write_bytes(b"\x00\x01\x02")
+    with mapped_file(str(path)) as data:
+        assert data == b"\x00\x01\x02"
+
+    forbid_disk_reads(monkeypatch)
+    with mapped_file(str(path)) as data:
+        assert data == b"\x00\x01\x02"
+
+
+def test_changed_and_big_files_are_not_taken_from_the_cache(tmp_path, file_cache):
+    path = tmp_path / "replay.osr"
+    path.write_bytes(b"\x00")
+    with mapped_file(str(path)) as data:
+        assert data == b"\x00"
+    path.write_bytes(b"\x00\x01")
+    with mapped_file(str(path)) as data:
+        assert data == b"\x00\x01"
+
+    path.write_bytes(bytes(2 << 10))
+    with mapped_file(str(path)) as data:
+        assert len(data) == 2 << 10 and not isinstance(data, bytes)
+    assert file_cache.size == 2
+
+
+def test_osu_folder_is_saved_only_when_asked(tmp_path, monkeypatch):
+    container = tmp_path / "osu_fp.txt"
+    container.write_text("C:\\osu!")
+    monkeypatch.setattr(paths, "FP_CONTAINER", str(container))
+    monkeypatch.setattr(osu_fp, "fp", osu_fp.fp)
+
+    osu_fp.set("D:\\osu!")
+    assert osu_fp.get() == "D:\\osu!" and container.read_text() == "C:\\osu!"
+    osu_fp.save()
+    assert container.read_text() == "D:\\osu!"
+    osu_fp.set("E:\\osu!", persist=True)
+    assert osu_fp.get() == "E:\\osu!" and container.read_text() == "E:\\osu!"
@@ -0,0 +1,142 @@
+import hashlib
+import lzma
+import random
+import struct
+
+import pytest
+
+from .. import Replay, ReplayFrame, ReplayFrames
+from ..replay.classes import MODS_INDEX_TO_STR
+from ..replay.reader import format_frames, read_replay_file, write_replay_file
+from .test_binary import make_replay, same
+
+
+# The writer before the frames were formatted column by column, copied as the reference of the .osr output
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+LZMA_CONFIG = {
+    "id": lzma.FILTER_LZMA1,
+    "mode": lzma.MODE_NORMAL,
+    "lc": 3,
+    "lp": 0,
+    "pb": 2,
+    "preset": 2,
+    "dict_size": 1 << 21
+}
+
+
+def osr_string(string: str) -> bytes:
+    if string == "": return bytes([0x00])
+    # Determine the uleb128 that corresponds to the length of the string
+    str_len = []
+    l = len(string)
+    while l:
+        str_len.append(l % 0x80 + 0x80)
+        l >>= 7
+    str_len[-1] -= 0x80  # The last byte does not exceed 0x80
+
+    return bytes([0x0b]) + bytes(str_len) + bytes(string, "utf-8")
+
+
+def reference_write_replay_file(replay: Replay) -> bytes:
+    # Reformat mod list to an integer
+    mods = sum(
+        1 << i
+        for i, mod in MODS_INDEX_TO_STR.items()
+        if mod in replay.mods
+    )
+
+    # Compress the array early to get its length
+    replay_str = "".join(
+        f"{frame.time}|{frame.x:.7g}|{frame.y:.7g}|{frame.action},"
+        for frame in replay.replay
+    ).encode("ascii")
+    compressed_array = lzma.compress(replay_str, format=lzma.FORMAT_ALONE, filters=[LZMA_CONFIG])
+    replay_hash = hashlib.md5(replay_str).hexdigest() if replay.replayHash is None else replay.replayHash
+    replay_length = len(compressed_array)
+
+    # Reformat life graph dictionary to a string
+    life_graph = "".join(
+        f"{time}|{health:n},"
+        for time, health in replay.lifeGraph.items()
+    )
+
+    # Encode strings into their .osr format
+    beatmap_hash = osr_string(replay.beatmapHash)
+    player_name = osr_string(replay.playerName)
+    replay_hash = osr_string(replay_hash)
+    life_graph = osr_string(life_graph)
+
+    return struct.pack(
+        f"<BI{len(beatmap_hash)}s{len(player_name)}s{len(replay_hash)}s6HIHBI{len(life_graph)}sQI{replay_length}sQd",
+        replay.gameMode,
+        replay.version,
+        beatmap_hash,
+        player_name,
+        replay_hash,
+        replay.count300,
+        replay.count100,
+        replay.count50,
+        replay.countGeki,
+        replay.countKatu,
+        replay.countMiss,
+        replay.score,
+        replay.maxCombo,
+        replay.fullCombo,
+        mods,
+        life_graph,
+        replay.time,
+        replay_length,
+        compressed_array,
+        replay.scoreID,
+        replay.additionalModInfo if replay.additionalModInfo is not None else 0.0
+    )
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def writable_replay(columnar: bool) -> Replay:
+    """ A replay with a life graph and no replay hash, whose frames are stored as a list or as columns """
+    replay = make_replay()
+    rng = random.Random(0)  # Coordinates with 7 significant digits at most, which .7g writes back exactly
+    replay.replay[-1:-1] = [
+        ReplayFrame(rng.choice((1, 16, 17, 33)), round(rng.uniform(0, 512), 4), round(rng.uniform(-50, 400), 4),
+                    rng.randrange(16))
+        for _ in range(2000)
+    ]
+    replay.lifeGraph = {time: (time % 7) / 8 for time in range(0, 60000, 1500)}
+    replay.replayHash = None
+    replay.additionalModInfo = 0.0  # What None is written as
+    if columnar:
+        frames = replay.replay
+        replay.replay = ReplayFrames([frame.time for frame in frames], [frame.x for frame in frames],
+                                     [frame.y for frame in frames], [frame.action for frame in frames])
+    return replay
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("preset", [0, 9])
+def test_round_trip(tmp_path, preset, columnar):
+    replay = writable_replay(columnar)
+    path = str(tmp_path / "replay.osr")
+    data = write_replay_file(replay, path, preset)
+    assert open(path, "rb").read() == data
+
+    loaded = read_replay_file(path, columnar=columnar)
+    assert list(loaded.replay) == list(replay.replay)
+    assert loaded.lifeGraph == replay.lifeGraph
+    assert loaded.replayHash == hashlib.md5(format_frames(replay.replay)).hexdigest()
+    for name in vars(replay).keys() - {"replay", "replayHash", "replayLength"}:  # Lengths are only known once written
+        same(getattr(replay, name), getattr(loaded, name), name)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_default_preset_matches_the_reference_writer(columnar):
+    replay = writable_replay(columnar)
+    expected = reference_write_replay_file(replay)
+    assert write_replay_file(replay) == expected
+    assert write_replay_file(replay, preset=2) == expected
+    replay.replayHash = "0123456789abcdef0123456789abcdef"
+    assert write_replay_file(replay) == reference_write_replay_file(replay)
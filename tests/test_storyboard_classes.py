@@ -0,0 +1,18 @@
+import pytest
+
+from ..storyboard.reader import get_events
+
+
+@pytest.mark.parametrize("line", [
+    '5,1000,Background,"sfx/hit.wav",70',
+    '6,Foreground,Centre,"sb/anim.png",320,240,4,100,LoopForever',
+])
+def test_event_round_trip(line):
+    event, = get_events([line])
+    assert event.osu_format() == line
+
+
+def test_colour_command_round_trip():
+    lines = ['4,Foreground,Centre,"sb/s0.png",1,2', " C,0,0,100,255,128,64,1,2,3"]
+    sprite, = get_events(lines)
+    assert [sprite.osu_format()] + [command.osu_format() for command in sprite.commands] == lines
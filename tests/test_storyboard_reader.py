@@ -0,0 +1,16 @@
+from ..storyboard.reader import substitute_variables
+
+
+def test_substitute_variables():
+    variables = {"$bg": "BG", "$c": "C", "$bgX": "BGX"}
+    lines = ["Sprite,Background,Centre,$bg,320,240", "Sprite,$c,$bgX", "_F,0,0,1000,0,1"]
+    assert substitute_variables(lines, variables) == [
+        "Sprite,Background,Centre,BG,320,240", "Sprite,C,BGX", "_F,0,0,1000,0,1"
+    ]
+
+
+def test_substitute_variables_keeps_undefined_variables():
+    # A defined name that is a prefix of an undefined one must not be replaced
+    variables = {"$bg": "BG", "$c": "C"}
+    lines = ["Sprite,$bgY,1", "Sprite,$cX,1", "Sprite,$bg,$c"]
+    assert substitute_variables(lines, variables) == ["Sprite,$bgY,1", "Sprite,$cX,1", "Sprite,BG,C"]
@@ -0,0 +1,216 @@
+from math import inf
+from random import Random
+
+import pytest
+
+from ..storyboard.classes import Loop, Trigger, Parameter, Animation
+from ..storyboard.reader import get_events
+from ..storyboard.timeline import (
+    EASINGS, COMMAND_PROPERTIES, LAYER_ORDER, Timeline, IntervalTree, ease, flatten_commands
+)
+
+VALUE_COUNTS = {"F": 2, "M": 4, "MX": 2, "MY": 2, "S": 2, "V": 4, "R": 2, "C": 6}  # Values of each command
+DEFAULTS = {"opacity": 1.0, "scale": 1.0, "scaleX": 1.0, "scaleY": 1.0, "rotation": 0.0, "r": 255, "g": 255, "b": 255}
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Easings
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("easing", range(len(EASINGS)))
+def test_easing_ends(easing):
+    assert ease(easing, 0) == pytest.approx(0, abs=2e-3) and ease(easing, 1) == pytest.approx(1, abs=2e-3)
+
+
+# In, Out and InOut easings of the same family
+@pytest.mark.parametrize("ease_in, ease_out, ease_in_out", [
+    (3, 4, 5), (6, 7, 8), (9, 10, 11), (12, 13, 14), (15, 16, 17), (18, 19, 20), (21, 22, 23), (32, 33, 34)
+])
+def test_easing_families(ease_in, ease_out, ease_in_out):
+    for t in [i / 20 for i in range(21)]:
+        assert ease(ease_out, t) == pytest.approx(1 - ease(ease_in, 1 - t), abs=1e-9)
+        half = ease(ease_in, 2*t) / 2 if t < 0.5 else 1 - ease(ease_in, 2 - 2*t) / 2
+        assert ease(ease_in_out, t) == pytest.approx(half, abs=1e-9)
+
+
+def test_other_easings():
+    for t in [i / 20 for i in range(21)]:
+        assert ease(0, t) == t and ease(1, t) == ease(4, t) and ease(2, t) == ease(3, t)
+        assert ease(25, t) == pytest.approx(1 - ease(24, 1 - t), abs=1e-9)  # Elastic
+        assert ease(30, t) == pytest.approx(1 - ease(29, 1 - t), abs=1e-9)  # Back
+        assert ease(28, t) == pytest.approx(1 - ease(28, 1 - t), abs=1e-9)
+        assert ease(31, t) == pytest.approx(1 - ease(31, 1 - t), abs=1e-9)
+        assert ease(35, t) == t  # Unknown easings are linear
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Loops
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def test_loop_flattening():
+    sprite, = get_events([
+        'Sprite,Foreground,Centre,"sb/a.png",320,240',
+        " F,0,0,500,0,1",
+        " L,1000,3",
+        "  M,0,100,300,0,0,10,10",
+        "  R,0,200,400,0,1",
+        " T,HitSoundClap,0,5000",
+        "  S,0,0,100,1,2",
+    ])
+    # Each iteration lasts from the start of its first command to the end of its last one (100 to 400)
+    flat = flatten_commands(sprite.commands)
+    assert [(type(command).__name__, command.startTime, command.endTime) for command in flat] == [
+        ("Fade", 0, 500),
+        ("Move", 1100, 1300), ("Rotate", 1200, 1400),
+        ("Move", 1400, 1600), ("Rotate", 1500, 1700),
+        ("Move", 1700, 1900), ("Rotate", 1800, 2000),
+    ]
+    assert sprite.commands[1].commands[0].startTime == 100  # The commands of the loop are not changed
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# IntervalTree
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_interval_tree(seed):
+    rng = Random(seed)
+    starts = [rng.randrange(1000) for _ in range(500)]
+    intervals = [(start, start + rng.choice((0, 1, 10, 50, 300))) for start in starts]
+    tree = IntervalTree(intervals)
+    assert len(tree) == 500
+    for _ in range(300):
+        start = rng.randrange(-50, 1100)
+        end = start + rng.choice((0, 0, 5, 30))
+        assert tree.overlapping(start, end) == [i for i, (a, b) in enumerate(intervals) if a <= end and b >= start]
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Timeline, against a brute force evaluation of random storyboards
+# ----------------------------------------------------------------------------------------------------------------------
+
+
+def random_command(rng: Random, indentation: str, max_start: int) -> str:
+    command = rng.choice([*VALUE_COUNTS, "P"])
+    start = rng.randrange(max_start)
+    end = start + rng.choice((0, 0, 100, 500, 2000))
+    if command == "P":
+        return f"{indentation}P,0,{start},{end},{rng.choice('HVA')}"
+    values = (
+        rng.randrange(256) if command == "C" else rng.randrange(-100, 200) / 100 for _ in range(VALUE_COUNTS[command])
+    )
+    return f"{indentation}{command},{rng.randrange(35)},{start},{end}," + ",".join(map(str, values))
+
+
+def random_storyboard(seed: int) -> list[str]:
+    rng = Random(seed)
+    lines = []
+    for i in range(40):
+        layer = rng.choice(("Background", "Fail", "Pass", "Foreground"))
+        if rng.random() < 0.2:
+            lines.append(f'Animation,{layer},Centre,"sb/a{i}.png",100,100,{rng.randrange(1, 5)},{rng.choice((0, 50))},'
+                         f'{rng.choice(("LoopForever", "LoopOnce"))}')
+        else:
+            lines.append(f'Sprite,{layer},Centre,"sb/s{i}.png",{rng.randrange(640)},{rng.randrange(480)}')
+        for _ in range(rng.randrange(6)):
+            lines.append(random_command(rng, " ", 10000))
+        if rng.random() < 0.5:
+            lines.append(f" L,{rng.randrange(10000)},{rng.randrange(4)}")
+            lines.extend(random_command(rng, "  ", 1000) for _ in range(rng.randrange(1, 4)))
+        if rng.random() < 0.2:
+            lines.append(" T,HitSoundClap,0,20000")
+            lines.append(random_command(rng, "  ", 1000))
+    return lines
+
+
+def brute_force_commands(sprite) -> list[tuple]:
+    """ (start, end, command) for each command of sprite, with the loops unrolled and the triggers skipped """
+    commands = []
+    for command in sprite.commands:
+        if isinstance(command, Loop) and command.commands:
+            first = min(inner.startTime for inner in command.commands)
+            last = max(inner.endTime for inner in command.commands)
+            for i in range(max(command.loopCount, 1)):
+                offset = command.startTime + i*(last - first)
+                commands += [(inner.startTime + offset, inner.endTime + offset, inner) for inner in command.commands]
+        elif not isinstance(command, (Loop, Trigger)):
+            commands.append((command.startTime, command.endTime, command))
+    return commands
+
+
+def values(command) -> dict:
+    """ The attributes of a command, except its times and indentation (which are changed by flatten_commands) """
+    return {name: value for name, value in vars(command).items() if name not in ("indentation", "startTime", "endTime")}
+
+
+def brute_force_value(commands: list[tuple], name: str, time: float, default: float) -> float:
+    segments = [
+        (start, end, command.easing, float(getattr(command, start_value)), float(getattr(command, end_value)))
+        for start, end, command in commands
+        for property_name, start_value, end_value in COMMAND_PROPERTIES.get(type(command), ())
+        if property_name == name
+    ]
+    if not segments:
+        return default
+    started = [segment for segment in segments if segment[0] <= time]
+    if not started:
+        return min(segments, key=lambda segment: segment[0])[3]
+    start, end, easing, start_value, end_value = max(reversed(started), key=lambda segment: segment[0])  # Last on ties
+    if time >= end:
+        return end_value
+    return start_value + (end_value - start_value) * ease(easing, (time - start) / (end - start))
+
+
+def brute_force_parameter(commands: list[tuple], parameter: str, time: float) -> bool:
+    return any(
+        start <= time <= (end if end != start else inf)
+        for start, end, command in commands if isinstance(command, Parameter) and command.parameter == parameter
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_timeline(seed):
+    storyboard = get_events(random_storyboard(seed))
+    commands = {id(sprite): brute_force_commands(sprite) for sprite in storyboard}
+    for sprite in storyboard:
+        flat = flatten_commands(sprite.commands)
+        assert [(command.startTime, command.endTime, values(command)) for command in flat] == \
+               [(start, end, values(command)) for start, end, command in commands[id(sprite)]]
+    lifetimes = {
+        id(sprite): (min(start for start, _, _ in commands[id(sprite)]), max(end for _, end, _ in commands[id(sprite)]))
+        for sprite in storyboard if commands[id(sprite)]
+    }
+    drawing_order = sorted((sprite for sprite in storyboard if id(sprite) in lifetimes),
+                           key=lambda sprite: LAYER_ORDER[sprite.layer])
+    timeline = Timeline(storyboard)
+    assert len(timeline) == len(lifetimes)
+
+    rng = Random(seed)
+    for time in [rng.uniform(-500, 14000) for _ in range(200)] + [0, 100, 500, 1000, 2000]:
+        active = [sprite for sprite in drawing_order if lifetimes[id(sprite)][0] <= time <= lifetimes[id(sprite)][1]]
+        states = timeline.state_at(time, visible_only=False)
+        assert [state.sprite for state in states] == active
+        for state in states:
+            sprite, sprite_commands = state.sprite, commands[id(state.sprite)]
+
+            def value(name: str) -> float:
+                return brute_force_value(sprite_commands, name, time, DEFAULTS[name])
+
+            assert state.x == pytest.approx(brute_force_value(sprite_commands, "x", time, sprite.x))
+            assert state.y == pytest.approx(brute_force_value(sprite_commands, "y", time, sprite.y))
+            assert state.opacity == pytest.approx(value("opacity"))
+            assert state.scaleX == pytest.approx(value("scale") * value("scaleX"))
+            assert state.scaleY == pytest.approx(value("scale") * value("scaleY"))
+            assert state.rotation == pytest.approx(value("rotation"))
+            assert state.color == pytest.approx((value("r"), value("g"), value("b")))
+            assert (state.flipH, state.flipV, state.additive) == tuple(
+                brute_force_parameter(sprite_commands, parameter, time) for parameter in "HVA"
+            )
+            if isinstance(sprite, Animation):
+                frame = int((time - lifetimes[id(sprite)][0]) // sprite.frameDelay) if sprite.frameDelay else 0
+                last = sprite.frameCount - 1
+                assert state.frame == (min(frame, last) if sprite.loopType == "LoopOnce" else frame % sprite.frameCount)
+        assert [state for state in states if state.is_visible()] == timeline.state_at(time)